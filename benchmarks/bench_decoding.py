@@ -0,0 +1,37 @@
+# Compares decoding a large list response with dataclasses_json's from_json and the generated decode methods.
+# Run with: python -m benchmarks.bench_decoding [edges]
+import json
+import sys
+import warnings
+
+from gql.clients.codec import StdlibJSONCodec, default_codec
+
+from benchmarks.common import best_of, characters_response, render_module
+
+
+def main(count: int = 10000):
+    # dataclasses_json warns about the missing `errors` on every decode
+    warnings.simplefilter('ignore', RuntimeWarning)
+    module = render_module()
+    response_text = json.dumps(characters_response(count))
+    response_bytes = response_text.encode('utf-8')
+    codec = default_codec()
+
+    from_json_time, from_json_result = best_of(lambda: module.AllCharacters.from_json(response_text))
+    decode_time, decode_result = best_of(lambda: module.AllCharacters.decode(json.loads(response_text)))
+    codec_time, codec_result = best_of(lambda: module.AllCharacters.decode(codec.loads(response_bytes)))
+    assert from_json_result == decode_result == codec_result
+
+    print(f'Decoding {count} edges ({len(response_text) // 1024} KB)')
+    report('from_json (dataclasses_json)', from_json_time, from_json_time)
+    report('decode (generated)', decode_time, from_json_time)
+    if not isinstance(codec, StdlibJSONCodec):
+        report(f'decode ({type(codec).__name__}, bytes)', codec_time, from_json_time)
+
+
+def report(label: str, elapsed: float, baseline: float):
+    print(f'  {label:<36} {elapsed * 1000:8.1f} ms {baseline / elapsed:6.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,76 @@
+# Measures the time to import many generated modules in a fresh interpreter, and what importing the dependencies
+# they defer (dataclasses_json, marshmallow and the clients' transports) costs on top when they're first used.
+# As a baseline, the same modules are also timed importing dataclasses_json eagerly, as they used to.
+# Run with: python -m benchmarks.bench_imports [modules]
+import os
+import subprocess
+import sys
+import tempfile
+
+from gql.config import Config
+from gql.query_parser import QueryParser
+from gql.renderer_dataclasses import DataclassesRenderer
+from gql.utils_schema import load_schema
+
+from benchmarks.common import SWAPI_SCHEMA_FILENAME, CHARACTERS_QUERY
+
+DEFERRED_IMPORTS = ('dataclasses_json', 'marshmallow', 'requests', 'aiohttp', 'gql.clients.sync', 'gql.clients.asyncio')
+
+IMPORT_SCRIPT = """
+import importlib, sys, time
+count, deferred = int(sys.argv[1]), sys.argv[2:]
+start = time.perf_counter()
+for index in range(count):
+    importlib.import_module(f'generated_{index}')
+modules = time.perf_counter() - start
+loaded = [name for name in deferred if name in sys.modules]
+start = time.perf_counter()
+for name in deferred:
+    importlib.import_module(name)
+print(modules, time.perf_counter() - start, ','.join(loaded))
+"""
+
+
+def write_modules(directory: str, count: int, eager: bool = False):
+    schema = load_schema(SWAPI_SCHEMA_FILENAME)
+    renderer = DataclassesRenderer(schema, Config(schema=SWAPI_SCHEMA_FILENAME, endpoint='http://localhost/graphql', documents=''))
+    parser = QueryParser(schema)
+    for index in range(count):
+        query = CHARACTERS_QUERY.replace('AllCharacters', f'AllCharacters{index}')
+        with open(os.path.join(directory, f'generated_{index}.py'), 'w') as outfile:
+            rendered = renderer.render(parser.parse(query))
+            if eager:
+                # Generated modules used to decorate their classes with dataclasses_json's own dataclass_json
+                rendered = rendered.replace('\nfrom dataclasses import dataclass, field\n',
+                                            '\nfrom dataclasses import dataclass, field\nfrom dataclasses_json import dataclass_json\n', 1)
+                rendered = rendered.replace('from gql.runtime import dataclass_json, ', 'from gql.runtime import ', 1)
+            outfile.write(rendered)
+
+
+def time_imports(count: int, repeat: int, eager: bool):
+    with tempfile.TemporaryDirectory() as directory:
+        write_modules(directory, count, eager)
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join([directory, os.getcwd()])}
+        command = [sys.executable, '-c', IMPORT_SCRIPT, str(count), *DEFERRED_IMPORTS]
+        # The first run compiles the modules to bytecode, like a deployed application would have
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True).stdout.decode().split()
+            runs.append((float(output[0]), float(output[1]), output[2] if len(output) > 2 else ''))
+    return min(runs)
+
+
+def main(count: int = 300, repeat: int = 5):
+    print(f'Importing {count} generated modules')
+    for label, eager in (('deferred dataclasses_json', False), ('eager dataclasses_json (baseline)', True)):
+        modules_time, deferred_time, loaded = time_imports(count, repeat, eager)
+        print(f'  {label}')
+        print(f'    generated modules              {modules_time * 1000:8.1f} ms')
+        print(f'    remaining imports on first use {deferred_time * 1000:8.1f} ms')
+        print(f'    deferred modules already loaded: {loaded or "none"}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,37 @@
+# Compares eager and lazy decoding of a large list response when only a top-level field is read, and when
+# everything is read.
+# Run with: python -m benchmarks.bench_lazy [edges]
+import sys
+
+from gql.config import Config
+
+from benchmarks.bench_slots import peak_memory
+from benchmarks.common import SWAPI_SCHEMA_FILENAME, best_of, characters_response, render_module
+
+
+def read_total(module, response):
+    return module.AllCharacters.decode(response).data.allCharacters.totalCount
+
+
+def read_all(module, response):
+    result = module.AllCharacters.decode(response)
+    return [edge.node.homeworld.name for edge in result.data.allCharacters.edges]
+
+
+def main(count: int = 100000):
+    response = characters_response(count)
+
+    print(f'Decoding {count} edges')
+    for lazy in (False, True):
+        config = Config(schema=SWAPI_SCHEMA_FILENAME, endpoint='http://localhost/graphql', documents='', lazy=lazy)
+        module = render_module(config=config)
+        label = 'lazy' if lazy else 'eager'
+
+        for access, read in (('total only', read_total), ('everything', read_all)):
+            elapsed, _ = best_of(lambda: read(module, response), repeat=3)
+            memory = peak_memory(lambda: read(module, response))
+            print(f'  {label:<6} {access:<11} {elapsed * 1000:8.1f} ms {memory / 1024 / 1024:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,37 @@
+# Compares memory use and construction time of regular and slotted generated classes on a large list response.
+# Run with: python -m benchmarks.bench_slots [edges]
+import sys
+import tracemalloc
+
+from gql.config import Config
+
+from benchmarks.common import SWAPI_SCHEMA_FILENAME, best_of, characters_response, render_module
+
+
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    try:
+        result = func()  # pylint:disable=unused-variable
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def main(count: int = 100000):
+    response = characters_response(count)
+
+    print(f'Decoding {count} edges')
+    for slots in (False, True):
+        config = Config(schema=SWAPI_SCHEMA_FILENAME, endpoint='http://localhost/graphql', documents='', slots=slots)
+        module = render_module(config=config)
+
+        elapsed, _ = best_of(lambda: module.AllCharacters.decode(response), repeat=3)
+        memory = peak_memory(lambda: module.AllCharacters.decode(response))
+        label = 'slotted' if slots else 'regular'
+        print(f'  {label:<8} {elapsed * 1000:8.1f} ms {memory / 1024 / 1024:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
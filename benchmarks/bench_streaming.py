@@ -0,0 +1,57 @@
+# Compares decoding a large list response once fully received with streaming its items, processing each and
+# dropping it, as a consumer writing them somewhere would.
+# Run with: python -m benchmarks.bench_streaming [edges]
+import sys
+from unittest import mock
+
+from gql.clients import Client
+
+from benchmarks.bench_slots import peak_memory
+from benchmarks.common import best_of, characters_response, render_module
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamedResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.content = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+def read_full(module):
+    result = module.AllCharacters.execute()
+    return sum(len(edge.node.name) for edge in result.data.allCharacters.edges)
+
+
+def read_streamed(module):
+    return sum(len(edge.node.name) for edge in module.AllCharacters.execute_stream('allCharacters.edges'))
+
+
+def main(count: int = 100000):
+    module = render_module()
+    client = Client.shared('http://localhost/graphql')
+    body = client.codec.dumps(characters_response(count))
+
+    print(f'Decoding {count} edges ({len(body) / 1024 / 1024:.1f} MB response)')
+    with mock.patch.object(client.session, 'post', side_effect=lambda *args, **kwargs: _StreamedResponse(body)):
+        for label, read in (('full', read_full), ('streamed', read_streamed)):
+            elapsed, _ = best_of(lambda: read(module), repeat=3)
+            memory = peak_memory(lambda: read(module))
+            print(f'  {label:<9} {elapsed * 1000:8.1f} ms {memory / 1024 / 1024:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
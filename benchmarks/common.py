@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+from types import ModuleType
+from typing import Callable, Tuple
+
+from gql.config import Config
+from gql.query_parser import QueryParser
+from gql.renderer_dataclasses import DataclassesRenderer
+from gql.utils_schema import load_schema
+
+SWAPI_SCHEMA_FILENAME = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'swapi-schema.graphql')
+
+CHARACTERS_QUERY = """
+query AllCharacters {
+  allCharacters {
+    totalCount
+    edges {
+      node {
+        id
+        name
+        height
+        mass
+        hairColor
+        skinColor
+        eyeColor
+        birthYear
+        gender
+        homeworld { name }
+      }
+    }
+  }
+}
+"""
+
+
+def render_module(query: str = CHARACTERS_QUERY, config: Config = None) -> ModuleType:
+    schema = load_schema(SWAPI_SCHEMA_FILENAME)
+    config = config or Config(schema=SWAPI_SCHEMA_FILENAME, endpoint='http://localhost/graphql', documents='')
+    rendered = DataclassesRenderer(schema, config).render(QueryParser(schema).parse(query))
+
+    module = ModuleType('benchmark_module')
+    # dataclasses_json resolves type hints through sys.modules
+    sys.modules[module.__name__] = module
+    exec(compile(rendered, '', 'exec'), module.__dict__)
+    return module
+
+
+def characters_response(count: int) -> dict:
+    return {
+        'data': {
+            'allCharacters': {
+                'totalCount': count,
+                'edges': [
+                    {
+                        'node': {
+                            'id': f'person-{index}',
+                            'name': f'Person {index}',
+                            'height': '172',
+                            'mass': '77',
+                            'hairColor': 'blond',
+                            'skinColor': 'fair',
+                            'eyeColor': 'blue',
+                            'birthYear': '19BBY',
+                            'gender': 'male',
+                            'homeworld': {'name': 'Tatooine'},
+                        }
+                    }
+                    for index in range(count)
+                ],
+            }
+        }
+    }
+
+
+def best_of(func: Callable[[], object], repeat: int = 5) -> Tuple[float, object]:
+    # Best wall time of `repeat` runs, along with the last result
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
@@ -1,20 +1,33 @@
 #!/usr/bin/env python
 import click
 import glob
+import json
 import time
 import os
+import multiprocessing
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
 from os.path import join as join_paths, isfile
 
 from graphql import GraphQLSchema
+from graphql.error import GraphQLError, GraphQLSyntaxError
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED
 
+from gql.clients.utils import hash_query
 from gql.config import Config
-from gql.query_parser import QueryParser, AnonymousQueryError, InvalidQueryError
+from gql.fragment_index import FragmentIndex, SourceMap
+from gql.manifest import Manifest, MANIFEST_FNAME, hash_config, hash_generator, hash_text
+from gql.query_parser import QueryParser, ParsedQuery, ParsedOperation, operation_documents, document_enums, AnonymousQueryError, InvalidQueryError, VALIDATION_RULE_SETS
 from gql.renderer_dataclasses import DataclassesRenderer
-from gql.utils_schema import load_schema
+from gql.utils_schema import load_schema, load_schema_with_hash, clear_schema_cache, diff_schemas, document_coordinates, \
+    dump_schema, load_dumped_schema
+from gql.utils_watch import Debouncer, GlobMatcher
 
 DEFAULT_CONFIG_FNAME = '.gql.json'
+DEFAULT_CACHE_DIR = '.gql-cache'
+DEFAULT_PERSISTED_QUERIES_FNAME = 'persisted-queries.json'
+PERSISTED_QUERIES_FORMAT = 'apollo-persisted-query-manifest'
 SCHEMA_PROMPT = click.style('Where is your schema?: ', fg='bright_white') + \
                 click.style('(path or url) ', fg='bright_black', dim=False)
 
@@ -29,6 +42,27 @@ def safe_remove(fname):
         pass
 
 
+def write_if_changed(fname: str, content: str) -> bool:
+    try:
+        with open(fname, 'r') as fin:
+            if fin.read() == content:
+                return False
+    except OSError:
+        pass
+
+    # Write next to the target and rename over it so readers never observe a half written file
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_fname, 'w') as outfile:
+            outfile.write(content)
+        os.replace(tmp_fname, fname)
+    except:
+        safe_remove(tmp_fname)
+        raise
+
+    return True
+
+
 @click.group()
 def cli():
     pass
@@ -57,89 +91,463 @@ def init(schema, endpoint, root, config_filename):
     click.echo(f"Config file generated at {click.style(config_filename, fg='bright_white')}\n\n")
 
 
-def process_file(filename: str, parser: QueryParser, renderer: DataclassesRenderer):
+@dataclass
+class CompileResult:
+    filename: str
+    target_filename: str
+    rendered: Optional[str] = None
+    error: Optional[str] = None
+    # Bytes of the document as written and of the minified documents sent for its operations
+    source_size: int = 0
+    sent_size: int = 0
+
+
+def target_filename_for(filename: str) -> str:
     root, _s = os.path.splitext(filename)
-    target_filename = root + '.py'
+    return root + '.py'
 
-    click.echo(f'Parsing {filename} ... ', nl=False)
+
+def read_query(filename: str) -> str:
     with open(filename, 'r') as fin:
-        query = fin.read()
-        try:
-            parsed = parser.parse(query)
-            rendered = renderer.render(parsed)
-            with open(target_filename, 'w') as outfile:
-                outfile.write(rendered)
-                click.secho('Success!', fg='bright_white')
+        return fin.read()
 
-        except AnonymousQueryError:
-            click.secho('Failed!', fg='bright_red')
-            click.secho('\tQuery is missing a name', fg='bright_black')
-            safe_remove(target_filename)
-        except InvalidQueryError as invalid_err:
-            click.secho('Failed!', fg='bright_red')
-            click.secho(f'\t{invalid_err}', fg='bright_black')
-            safe_remove(target_filename)
+
+def create_parser(schema: GraphQLSchema, config: Config) -> QueryParser:
+    if config.validation not in VALIDATION_RULE_SETS:
+        raise click.ClickException(f'Unknown validation "{config.validation}", expected one of: {", ".join(VALIDATION_RULE_SETS)}')
+
+    return QueryParser(schema, validation_rules=VALIDATION_RULE_SETS[config.validation])
+
+
+def error_message(error: Exception, source_map: SourceMap = None) -> str:
+    if source_map is None:
+        return str(error)
+
+    errors = error.errors if isinstance(error, InvalidQueryError) else [error]
+    return '\n'.join(str(source_map.locate(err)) for err in errors)
+
+
+def compile_file(filename: str, parser: QueryParser, renderer: DataclassesRenderer, query: str = None,
+                 source_map: SourceMap = None) -> CompileResult:
+    result = CompileResult(filename=filename, target_filename=target_filename_for(filename))
+    if query is None:
+        query = read_query(filename)
+
+    try:
+        parsed = parser.parse(query)
+        result.rendered = renderer.render(parsed)
+        result.source_size, result.sent_size = document_sizes(query)
+    except AnonymousQueryError:
+        result.error = 'Query is missing a name'
+    except (InvalidQueryError, GraphQLSyntaxError) as err:
+        result.error = error_message(err, source_map)
+
+    return result
+
+
+def shared_module_filename(config: Config) -> str:
+    return os.path.join(*config.shared_module.split('.')) + '.py'
+
+
+def share_fragments(config: Config, source: str, parser: QueryParser, renderer: DataclassesRenderer,
+                    source_map: SourceMap = None, documents: Iterable[str] = ()) -> Optional[CompileResult]:
+    # Validates and renders every fragment of the project once, into config.shared_module, then has the parser skip
+    # them and the renderer import them. When they don't compile, documents keep their own copy of the fragments.
+    # The enums selected by any of the `documents` are rendered there too, so every module uses the same classes.
+    parser.share_fragments({})
+    renderer.shared = None
+    enums = document_enums(parser.schema, documents)
+    if not source and not enums:
+        return None
+
+    result = CompileResult(filename='shared fragments', target_filename=shared_module_filename(config))
+    try:
+        parsed = parser.parse_fragments(source) if source else ParsedQuery(query='')
+        parsed.enums.extend(enum for enum in enums if enum.name not in {known.name for known in parsed.enums})
+        result.rendered = renderer.render(parsed)
+    except (InvalidQueryError, GraphQLSyntaxError) as err:
+        result.error = error_message(err, source_map)
+
+    if result.error is None:
+        renderer.shared = parsed
+    else:
+        parser.share_fragments({})
+
+    return result
+
+
+def document_sizes(query: str) -> Tuple[int, int]:
+    sent = operation_documents(query).values()
+    return len(query.encode('utf-8')), sum(len(document.encode('utf-8')) for document in sent)
+
+
+def size_summary(source_size: int, sent_size: int) -> str:
+    saved = f' ({(sent_size - source_size) / source_size:+.0%})' if source_size else ''
+    return f'Operation documents: {source_size:,} bytes as written, {sent_size:,} bytes minified{saved}'
+
+
+def write_result(result: CompileResult, remove_on_error: bool = True):
+    click.echo(f'Parsing {result.filename} ... ', nl=False)
+    if result.error is not None:
+        click.secho('Failed!', fg='bright_red')
+        click.secho(f'\t{result.error}', fg='bright_black')
+        if remove_on_error:
+            safe_remove(result.target_filename)
+        return
+
+    if write_if_changed(result.target_filename, result.rendered):
+        click.secho('Success!', fg='bright_white')
+    else:
+        click.secho('Success! (unchanged)', fg='bright_white')
+
+
+def process_file(filename: str, parser: QueryParser, renderer: DataclassesRenderer, remove_on_error: bool = True,
+                 query: str = None, source_map: SourceMap = None) -> CompileResult:
+    result = compile_file(filename, parser, renderer, query=query, source_map=source_map)
+    write_result(result, remove_on_error=remove_on_error)
+    return result
+
+
+def is_fragments_only(index: FragmentIndex, filename: str) -> bool:
+    return bool(index.defined_in(filename)) and not index.has_operations(filename)
+
+
+def build_fragment_index(filenames: List[str]) -> FragmentIndex:
+    index = FragmentIndex()
+    for filename in filenames:
+        index.update(filename, read_query(filename))
+
+    return index
+
+
+def load_fragment_index(config: Config) -> FragmentIndex:
+    return build_fragment_index(sorted(glob.glob(config.documents, recursive=True)))
+
+
+def load_document_sources(config: Config, fragment_index: FragmentIndex = None) -> Dict[str, Tuple[str, SourceMap]]:
+    # Documents are compiled together with the fragments they spread from other files, the source map tells which
+    # file each part comes from. Fragment-only documents don't produce a module of their own.
+    fragment_index = fragment_index or load_fragment_index(config)
+    return {
+        filename: fragment_index.document_source_map(filename)
+        for filename in sorted(fragment_index.documents) if not is_fragments_only(fragment_index, filename)
+    }
+
+
+# Per worker process state for `gql run --jobs`, set up once by init_worker
+_WORKER_STATE = {}
+
+
+def init_worker(config: Config, schema_data: bytes, shared: Optional[Tuple[Dict[str, str], ParsedQuery]]):
+    # Workers get the schema the main process loaded (and hashed into the manifest) instead of loading it again
+    schema = load_dumped_schema(schema_data)
+    _WORKER_STATE['parser'] = create_parser(schema, config)
+    _WORKER_STATE['renderer'] = DataclassesRenderer(schema, config)
+    if shared is not None:
+        # Fragments shared by the main process, so workers don't validate them again
+        _WORKER_STATE['parser'].share_fragments(shared[0])
+        _WORKER_STATE['renderer'].shared = shared[1]
+
+
+def compile_file_in_worker(filename_and_source: Tuple[str, Tuple[str, SourceMap]]) -> CompileResult:
+    filename, (query, source_map) = filename_and_source
+    return compile_file(filename, _WORKER_STATE['parser'], _WORKER_STATE['renderer'], query=query, source_map=source_map)
+
+
+def compile_files_parallel(sources: Mapping[str, Tuple[str, SourceMap]], config: Config, schema: GraphQLSchema, jobs: int,
+                           shared: Optional[Tuple[Dict[str, str], ParsedQuery]] = None) -> Iterator[CompileResult]:
+    chunksize = max(1, len(sources) // (jobs * 4))
+    initargs = (config, dump_schema(schema), shared)
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=initargs) as pool:
+        # imap yields in submission order so output stays sorted by filename
+        yield from pool.imap(compile_file_in_worker, sources.items(), chunksize=chunksize)
 
 
 @cli.command()
 @click.option('-c', '--config', 'config_filename', default=DEFAULT_CONFIG_FNAME, type=click.Path(exists=True))
-def run(config_filename):
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, type=click.Path(file_okay=False))
+@click.option('--no-cache', is_flag=True, default=False, help='Ignore the cache: rebuild the schema and regenerate every file')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(min=0), help='Number of worker processes (0 uses all CPUs)')
+def run(config_filename, cache_dir, no_cache, jobs):
     if not isfile(config_filename):
         click.echo(f'Could not find configuration file {config_filename}')
 
     config = Config.load(config_filename)
-    schema = load_schema(config.schema)
+    cache_dir = None if no_cache else cache_dir
+    schema, schema_hash = load_schema_with_hash(config.schema, cache_dir=cache_dir)
 
-    filenames = glob.glob(config.documents, recursive=True)
-
-    query_parser = QueryParser(schema)
+    fragment_index = load_fragment_index(config)
+    query_parser = create_parser(schema, config)
     query_renderer = DataclassesRenderer(schema, config)
+    config_hash = hash_config(config)
+    if config.shared_module:
+        fragments_source, fragments_source_map = fragment_index.fragments_source_map()
+        shared_result = share_fragments(config, fragments_source, query_parser, query_renderer, source_map=fragments_source_map,
+                                        documents=fragment_index.sources())
+        if shared_result is not None:
+            write_result(shared_result, remove_on_error=False)
+        if query_renderer.shared is None:
+            # Documents compiled with their own fragments must be compiled again once they can be shared
+            config_hash = hash_text(f'{config_hash}:unshared')
+
+    manifest_filename = join_paths(cache_dir, MANIFEST_FNAME) if cache_dir else None
+    manifest = Manifest.load(manifest_filename) if manifest_filename else Manifest()
+    manifest.reset_if_stale(schema_hash, config_hash, hash_generator())
+
+    all_sources = load_document_sources(config, fragment_index)
+    all_filenames = list(all_sources)
+    query_hashes = {filename: hash_text(source) for filename, (source, _map) in all_sources.items()}
+    sources = {
+        filename: source for filename, source in all_sources.items()
+        if not manifest.is_fresh(filename, query_hashes[filename], target_filename_for(filename))
+    }
+    filenames = list(sources)
+    jobs = min(jobs or os.cpu_count() or 1, len(filenames))
+
+    if jobs > 1:
+        shared = (query_parser.shared_fragments, query_renderer.shared) if query_renderer.shared is not None else None
+        results = compile_files_parallel(sources, config, schema, jobs, shared)
+    else:
+        results = (
+            compile_file(filename, query_parser, query_renderer, query=source, source_map=source_map)
+            for filename, (source, source_map) in sources.items()
+        )
+
+    source_size = sent_size = 0
+    regenerated = failed = 0
+    for result in results:
+        write_result(result)
+        if result.error is None:
+            # Only successful files are recorded, failed ones are compiled again on the next run
+            manifest.record(result.filename, query_hashes[result.filename])
+            source_size += result.source_size
+            sent_size += result.sent_size
+            regenerated += 1
+        else:
+            manifest.forget(result.filename)
+            failed += 1
+
+    if manifest_filename:
+        manifest.retain(all_filenames)
+        manifest.save(manifest_filename)
+
+    skipped = len(all_filenames) - len(filenames)
+    click.secho(f'Regenerated {regenerated} file(s), skipped {skipped} unchanged file(s)', fg='cyan')
+    if source_size:
+        click.secho(size_summary(source_size, sent_size), fg='cyan')
+    if failed:
+        click.secho(f'Failed to compile {failed} file(s)', fg='bright_red', err=True)
+
+
+class QueryFilesHandler(FileSystemEventHandler):
+    def __init__(self, config: Config, schema: GraphQLSchema, debounce: float, cache_dir: str = None):
+        self.config = config
+        self.cache_dir = cache_dir
+        self.matcher = GlobMatcher(config.documents)
+        self.schema_filename = os.path.abspath(config.schema) if isfile(config.schema) else None
+        self.debouncer = Debouncer(debounce, self.process)
+        self.fragment_index = build_fragment_index(
+            [os.path.abspath(filename) for filename in glob.glob(config.documents, recursive=True)]
+        )
+        self.failed: Set[str] = set()
+        self.set_schema(schema)
+
+    def set_schema(self, schema: GraphQLSchema):
+        self.schema = schema
+        self.parser = create_parser(schema, self.config)
+        self.renderer = DataclassesRenderer(schema, self.config)
+        self.share_fragments()
+
+    def share_fragments(self):
+        if not self.config.shared_module:
+            return
+
+        source, source_map = self.fragment_index.fragments_source_map()
+        result = share_fragments(self.config, source, self.parser, self.renderer, source_map=source_map,
+                                 documents=self.fragment_index.sources())
+        if result is not None:
+            write_result(result, remove_on_error=False)
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+
+        paths = []
+        if event.event_type == EVENT_TYPE_MOVED:
+            # Editors often save by writing a temp file and renaming it over the original
+            paths = [event.src_path, event.dest_path]
+        elif event.event_type in {EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_DELETED}:
+            paths = [event.src_path]
+
+        for path in paths:
+            path = os.path.abspath(path)
+            if path == self.schema_filename or self.matcher.matches(path):
+                self.debouncer.trigger(path)
+
+    def process(self, filename: str):
+        if filename == self.schema_filename:
+            self.reload_schema()
+            return
+
+        changed_fragments = self.fragment_index.defined_in(filename)
+        if isfile(filename):
+            self.fragment_index.update(filename, read_query(filename))
+        else:
+            self.fragment_index.remove(filename)
+            self.failed.discard(filename)
+
+        # Documents spreading a fragment defined in this file (before or after the change) need rebuilding too
+        changed_fragments |= self.fragment_index.defined_in(filename)
+        if changed_fragments or self.selects_unshared_enums(filename):
+            self.share_fragments()
+        filenames = {filename} | self.fragment_index.dependents(changed_fragments)
+
+        for dependent in sorted(filenames):
+            if dependent in self.fragment_index.documents and not is_fragments_only(self.fragment_index, dependent):
+                self.compile(dependent)
+
+    def selects_unshared_enums(self, filename: str) -> bool:
+        if not self.config.shared_module or filename not in self.fragment_index.documents:
+            return False
+
+        shared = {enum.name for enum in self.renderer.shared.enums} if self.renderer.shared is not None else set()
+        enums = document_enums(self.schema, [self.fragment_index.documents[filename].source])
+        return any(enum.name not in shared for enum in enums)
+
+    def compile(self, filename: str):
+        # Keep the last good output around while the query is being edited
+        source, source_map = self.fragment_index.document_source_map(filename)
+        result = process_file(filename, self.parser, self.renderer, remove_on_error=False, query=source, source_map=source_map)
+        if result.error is None:
+            self.failed.discard(filename)
+        else:
+            self.failed.add(filename)
+
+    def is_affected(self, filename: str, changed: Set[str]) -> bool:
+        if filename in self.failed:
+            return True
 
-    for filename in filenames:
-        process_file(filename, query_parser, query_renderer)
+        try:
+            return bool(document_coordinates(self.schema, self.fragment_index.document_source(filename)) & changed)
+        except GraphQLError:
+            return True
 
+    def reload_schema(self):
+        if not isfile(self.schema_filename):
+            return
 
-@cli.command()
-@click.option('-c', '--config', 'config_filename', default=DEFAULT_CONFIG_FNAME, type=click.Path(exists=True))
-def watch(config_filename):
-    class Handler(FileSystemEventHandler):
-        def __init__(self, config: Config, schema: GraphQLSchema):
-            self.parser = QueryParser(schema)
-            self.renderer = DataclassesRenderer(schema, config)
+        click.echo(f'Reloading schema {self.config.schema} ... ', nl=False)
+        try:
+            schema = load_schema(self.config.schema, cache_dir=self.cache_dir)
+        except (ValueError, KeyError, TypeError) as load_err:
+            click.secho('Failed!', fg='bright_red')
+            click.secho(f'\t{load_err}', fg='bright_black')
+            return
 
-        def on_any_event(self, event):
-            if event.is_directory:
-                return
+        changed = diff_schemas(self.schema, schema)
+        documents = [
+            filename for filename in sorted(self.fragment_index.documents)
+            if not is_fragments_only(self.fragment_index, filename)
+        ]
+        # Usage is computed against the schema the documents were compiled with
+        affected = [filename for filename in documents if changed and self.is_affected(filename, changed)]
+        self.set_schema(schema)
 
-            if event.event_type in {EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED}:
-                filenames = [os.path.abspath(fn) for fn in glob.iglob(config.documents, recursive=True)]
-                if event.src_path not in filenames:
-                    return
+        click.secho(f'{len(changed)} type(s)/field(s) changed, rebuilding {len(affected)} of {len(documents)} document(s)',
+                    fg='bright_white')
+        for filename in affected:
+            self.compile(filename)
 
-                # Take any action here when a file is first created.
-                process_file(event.src_path, self.parser, self.renderer)
 
+@cli.command()
+@click.option('-c', '--config', 'config_filename', default=DEFAULT_CONFIG_FNAME, type=click.Path(exists=True))
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, type=click.Path(file_okay=False))
+@click.option('--no-cache', is_flag=True, default=False, help='Build the schema from scratch without reading or writing the cache')
+@click.option('--debounce', default=0.2, type=click.FloatRange(min=0), help='Seconds to wait for a file to settle before compiling it')
+def watch(config_filename, cache_dir, no_cache, debounce):
     if not isfile(config_filename):
         click.echo(f'Could not find configuration file {config_filename}')
 
     config = Config.load(config_filename)
-    schema = load_schema(config.schema)
+    cache_dir = None if no_cache else cache_dir
+    schema = load_schema(config.schema, cache_dir=cache_dir)
+
+    handler = QueryFilesHandler(config, schema, debounce, cache_dir=cache_dir)
 
     click.secho(f'Watching {config.documents}', fg='cyan')
+    if handler.schema_filename:
+        click.secho(f'Watching schema {config.schema}', fg='cyan')
     click.secho('Ready for changes...', fg='cyan')
 
     observer = Observer()
-    observer.schedule(Handler(config, schema), os.path.abspath('./'), recursive=True)
+    observer.schedule(handler, handler.matcher.root, recursive=handler.matcher.recursive)
+    if handler.schema_filename:
+        observer.schedule(handler, os.path.dirname(handler.schema_filename), recursive=False)
     observer.start()
     try:
         while True:
             time.sleep(5)
     except:
         observer.stop()
+        handler.debouncer.cancel()
         print('Error')
 
     observer.join()
 
 
+@cli.command('clear-cache')
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, type=click.Path(file_okay=False))
+def clear_cache(cache_dir):
+    removed = clear_schema_cache(cache_dir)
+    safe_remove(join_paths(cache_dir, MANIFEST_FNAME))
+    click.echo(f'Removed {removed} cached schema(s) and the incremental build manifest from {cache_dir}')
+
+
+@cli.command('export-persisted-queries')
+@click.option('-c', '--config', 'config_filename', default=DEFAULT_CONFIG_FNAME, type=click.Path(exists=True))
+@click.option('-o', '--output', default=DEFAULT_PERSISTED_QUERIES_FNAME, type=click.Path(dir_okay=False))
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, type=click.Path(file_okay=False))
+@click.option('--no-cache', is_flag=True, default=False, help='Build the schema from scratch without reading or writing the cache')
+def export_persisted_queries(config_filename, output, cache_dir, no_cache):
+    # Writes every operation with the hash generated code sends, so the server can allowlist them
+    config = Config.load(config_filename)
+    schema = load_schema(config.schema, cache_dir=None if no_cache else cache_dir)
+    parser = create_parser(schema, config)
+
+    operations = []
+    failed = []
+    source_size = sent_size = 0
+    for filename, (source, source_map) in load_document_sources(config).items():
+        try:
+            parsed = parser.parse(source)
+        except AnonymousQueryError:
+            failed.append((filename, 'Query is missing a name'))
+            continue
+        except (InvalidQueryError, GraphQLSyntaxError) as err:
+            failed.append((filename, error_message(err, source_map)))
+            continue
+
+        sizes = document_sizes(source)
+        source_size += sizes[0]
+        sent_size += sizes[1]
+
+        documents = operation_documents(source)
+        for operation in parsed.objects:
+            if isinstance(operation, ParsedOperation):
+                document = documents[operation.name]
+                operations.append({'id': hash_query(document), 'name': operation.name, 'type': operation.type, 'body': document})
+
+    if failed:
+        for filename, error in failed:
+            click.secho(f'Parsing {filename} ... Failed!', fg='bright_red')
+            click.secho(f'\t{error}', fg='bright_black')
+        raise click.ClickException(f'Could not export persisted queries, {len(failed)} document(s) failed to parse')
+
+    manifest = {'format': PERSISTED_QUERIES_FORMAT, 'version': 1, 'operations': sorted(operations, key=lambda op: op['name'])}
+    write_if_changed(output, json.dumps(manifest, indent=2, sort_keys=True))
+    click.secho(f'Exported {len(operations)} operation(s) to {output}', fg='cyan')
+    click.secho(size_summary(source_size, sent_size), fg='cyan')
+
+
 if __name__ == '__main__':
     cli()
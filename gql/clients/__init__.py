@@ -1,2 +1,28 @@
-from .asyncio import AsyncIOClient
-from .sync import Client
+from importlib import import_module
+
+from .cache import CacheStats, MemoryCache, ResponseCache
+from .codec import JSONCodec, OrjsonCodec, StdlibJSONCodec, default_codec
+from .store import EntityStore
+from .streaming import ResponseErrors, StreamError
+
+# The clients are imported on first access, so importing the package doesn't import both requests and aiohttp
+_LAZY_ATTRIBUTES = {
+    'AsyncIOClient': '.asyncio',
+    'BatchError': '.asyncio',
+    'Client': '.sync',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(import_module(module_name, __name__), name)
+    # Later lookups don't go through __getattr__ again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -1,11 +1,80 @@
-from typing import Callable, Mapping, Union
+import asyncio
+from typing import Any, AsyncIterator, AsyncGenerator, Callable, ClassVar, Dict, List, Mapping, Sequence, Tuple, Union
 
 import aiohttp
 
+from .cache import ResponseCache, cache_response, cached_response
+from .codec import JSONCodec, default_codec
+from .store import EntityStore, store_response, stored_response
+from .streaming import ListStreamParser, ResponseErrors, route_elements, DEFAULT_STREAM_CHUNK_SIZE, ERRORS_PATH
+from .utils import is_query, request_key, hash_query, add_persisted_query, is_persisted_query, without_query, \
+    without_persisted_query, persisted_query_error, PERSISTED_QUERY_NOT_SUPPORTED
+
+DEFAULT_CONNECTION_LIMIT = 100
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 0
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_MAX_BATCH_SIZE = 10
+
+
+class BatchError(Exception):
+    pass
+
+
+class _Batch:
+    def __init__(self, headers: Mapping[str, str]):
+        self.headers = headers
+        self.payloads: List[Mapping[str, Any]] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: asyncio.TimerHandle = None
+
+
+class _LoopClients:
+    def __init__(self):
+        self.clients: Dict[str, 'AsyncIOClient'] = {}
+        # Suspended async generator closing the clients when the loop shuts down, referenced here as loops only keep
+        # weak references to their async generators
+        self.closer: AsyncGenerator = None
+
 
 class AsyncIOClient:
-    def __init__(self, endpoint, headers=None):
+    # Shared clients per event loop (sessions and connectors are bound to the loop they were created on) and endpoint.
+    # A loop's entry is dropped and its clients closed when the loop shuts down, short-lived loops (asyncio.run per
+    # request) don't pile up along with their sessions and sockets.
+    __shared: ClassVar[Dict[asyncio.AbstractEventLoop, _LoopClients]] = {}
+    # Settings of the shared clients by endpoint, applied to the client of every loop
+    __shared_options: ClassVar[Dict[str, Dict[str, Any]]] = {}
+
+    def __init__(self, endpoint, headers=None,
+                 limit: int = DEFAULT_CONNECTION_LIMIT,
+                 limit_per_host: int = DEFAULT_CONNECTION_LIMIT_PER_HOST,
+                 dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL,
+                 timeout: float = None,
+                 batch_window: float = None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 deduplicate: bool = True,
+                 cache: ResponseCache = None,
+                 persisted_queries: bool = False,
+                 codec: JSONCodec = None,
+                 store: EntityStore = None):
         self.endpoint = endpoint
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        # Batching is opt-in: the server must accept a JSON array of operations and answer with an array of results
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.__batches: Dict[Tuple[Tuple[str, str], ...], _Batch] = {}
+        # Concurrent identical queries share a single request
+        self.deduplicate = deduplicate
+        self.__in_flight: Dict[str, asyncio.Future] = {}
+        # Query responses are only cached when given a cache, mutations never are
+        self.cache = cache
+        # Automatic persisted queries: send the query hash alone and the full query only when the server doesn't know it yet
+        self.persisted_queries = persisted_queries
+        self.codec = codec or default_codec()
+        # Normalized entities of the responses to generated operations, answering the queries it has every field of
+        self.store = store
 
         headers = headers or {}
         self.__headers = {
@@ -16,18 +85,151 @@ class AsyncIOClient:
         }
         self.__session = None
 
+    @classmethod
+    def configure(cls, endpoint, **kwargs):
+        # Settings of the shared client for this endpoint, used by the clients created from now on whatever their loop.
+        # Can be called before any loop runs, e.g. at startup before asyncio.run.
+        cls.__shared_options[endpoint] = kwargs
+
+    @classmethod
+    def shared(cls, endpoint, **kwargs) -> 'AsyncIOClient':
+        # kwargs only apply when the client for this loop and endpoint is first created, they are then kept as the
+        # endpoint's settings (see configure) for the clients of the next loops
+        loop = asyncio.get_event_loop()
+        cls.__evict_closed_loops()
+        loop_clients = cls.__shared.get(loop)
+        if loop_clients is None:
+            loop_clients = cls.__shared[loop] = _LoopClients()
+        if loop_clients.closer is None and loop.is_running():
+            cls.__close_on_shutdown(loop, loop_clients)
+
+        client = loop_clients.clients.get(endpoint)
+        if client is None:
+            if kwargs:
+                cls.__shared_options[endpoint] = kwargs
+            client = loop_clients.clients[endpoint] = cls(endpoint, **cls.__shared_options.get(endpoint, {}))
+
+        return client
+
+    @classmethod
+    async def close_shared(cls):
+        loop_clients = cls.__shared.pop(asyncio.get_event_loop(), None)
+        if loop_clients is not None:
+            for client in loop_clients.clients.values():
+                await client.close()
+
+    @classmethod
+    def __close_on_shutdown(cls, loop: asyncio.AbstractEventLoop, loop_clients: _LoopClients):
+        # asyncio.run (like anything calling loop.shutdown_asyncgens) closes the async generators still suspended
+        # before closing the loop, while it can still run their cleanup: this one closes the loop's clients.
+        async def closer():
+            try:
+                yield
+            finally:
+                if cls.__shared.get(loop) is loop_clients:
+                    del cls.__shared[loop]
+                for client in list(loop_clients.clients.values()):
+                    await client.close()
+
+        loop_clients.closer = closer()
+        # The loop only tracks async generators first iterated while it runs, shared() waits for the loop to run
+        # before setting this up
+        asyncio.ensure_future(loop_clients.closer.__anext__(), loop=loop)
+
+    @classmethod
+    def __evict_closed_loops(cls):
+        # Loops closed without shutting down their async generators can't run the clients' cleanup anymore, their
+        # entries are dropped so the clients can at least be garbage collected
+        for loop in [loop for loop in cls.__shared if loop.is_closed()]:
+            del cls.__shared[loop]
+
     @property
     def session(self):
         if not self.__session or self.__session.closed:
-            self.__session = aiohttp.ClientSession(headers=self.__headers)
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self.__session = aiohttp.ClientSession(
+                headers=self.__headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
 
         return self.__session
 
+    async def close(self):
+        if self.__session and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
     async def call(self, query,
                    variables=None,
                    return_json=False,
-                   on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None) -> Union[dict, str]:
+                   on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None,
+                   cache: bool = True,
+                   cache_ttl: float = None,
+                   query_hash: str = None,
+                   selection=None) -> Union[dict, str]:
+
+        payload, headers = self.__prepare(query, variables, on_before_callback)
+
+        if self.persisted_queries:
+            # Generated code passes the hash computed at build time, unless the callback changed the query
+            add_persisted_query(payload, query_hash if query_hash and payload['query'] is query else hash_query(payload['query']))
+
+        # Generated code also passes the operation's selection plan, for the entity store
+        if self.store is None or payload['query'] is not query:
+            selection = None
+
+        if not is_query(payload['query']):
+            response = await self.__send(payload, headers, return_json)
+            if selection is not None:
+                store_response(self.store, selection, payload.get('variables'), response, self.codec, root_fields=False)
+            return response
 
+        if cache and selection is not None:
+            response = stored_response(self.store, selection, payload.get('variables'), return_json, self.codec)
+            if response is not None:
+                return response
+
+        response = await self.__query(payload, headers, return_json, cache, cache_ttl)
+        if selection is not None:
+            store_response(self.store, selection, payload.get('variables'), response, self.codec)
+
+        return response
+
+    async def stream(self, query, path: Sequence[str],
+                     variables=None,
+                     on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None,
+                     chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[Any]:
+        # Yields the elements of the list at `path` (keys from the response root, like ('data', 'allFilms', 'edges'))
+        # while the response is being received. Errors in the response are raised once it is complete.
+        # Elements are decoded by the stream parser rather than the codec, which needs whole documents.
+        payload, headers = self.__prepare(query, variables, on_before_callback)
+        path = tuple(path)
+        parser = ListStreamParser([path, ERRORS_PATH])
+        errors = []
+
+        async with self.session.post(self.endpoint, data=self.codec.dumps(payload), headers=headers, raise_for_status=True) as resp:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                for element in route_elements(parser.feed(chunk), path, errors):
+                    yield element
+
+        for element in route_elements(parser.close(), path, errors):
+            yield element
+        if errors:
+            raise ResponseErrors(errors)
+
+    def __prepare(self, query, variables, on_before_callback) -> Tuple[dict, dict]:
         headers = self.__headers.copy()
 
         payload = {
@@ -39,8 +241,96 @@ class AsyncIOClient:
         if on_before_callback:
             on_before_callback(payload, headers)
 
-        async with self.session.post(self.endpoint, json=payload, headers=headers, raise_for_status=True) as resp:
+        return payload, headers
+
+    async def __query(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool, cache: bool, cache_ttl: float) -> Union[dict, str]:
+        if not (cache and self.cache is not None):
+            return await self.__fetch(payload, headers, return_json)
+
+        cache_key = request_key(payload, headers)
+        response = cached_response(self.cache, cache_key, return_json, self.codec)
+        if response is None:
+            response = await self.__fetch(payload, headers, return_json)
+            cache_response(self.cache, cache_key, response, self.codec, cache_ttl)
+
+        return response
+
+    async def __fetch(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        if not self.deduplicate:
+            return await self.__send(payload, headers, return_json)
+
+        key = request_key(payload, headers, return_json)
+        future = self.__in_flight.get(key)
+        if future is None:
+            future = self.__in_flight[key] = asyncio.ensure_future(self.__send(payload, headers, return_json))
+            future.add_done_callback(lambda done: self.__in_flight.pop(key) if self.__in_flight.get(key) is done else None)
+
+        # Shielded so a caller giving up doesn't cancel the request for everyone else
+        return await asyncio.shield(future)
+
+    async def __send(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        if not is_persisted_query(payload):
+            return await self.__post(payload, headers, return_json)
+
+        response = await self.__post(without_query(payload), headers, return_json)
+        error = persisted_query_error(response)
+        if error is None:
+            return response
+
+        if error == PERSISTED_QUERY_NOT_SUPPORTED[0]:
+            self.persisted_queries = False
+            payload = without_persisted_query(payload)
+
+        # Sending the query along with its hash registers it for the next calls
+        return await self.__post(payload, headers, return_json)
+
+    async def __post(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        if self.batch_window is not None:
+            result = await self.__call_batched(payload, headers)
+            return result if return_json else self.codec.dumps(result).decode('utf-8')
+
+        async with self.session.post(self.endpoint, data=self.codec.dumps(payload), headers=headers, raise_for_status=True) as resp:
             if return_json:
-                return await resp.json()
+                return self.codec.loads(await resp.read())
 
             return await resp.text()
+
+    async def __call_batched(self, payload: Mapping[str, Any], headers: Mapping[str, str]) -> dict:
+        # Operations can only share a request if they share headers
+        key = tuple(sorted(headers.items()))
+        batch = self.__batches.get(key)
+        if batch is None:
+            batch = self.__batches[key] = _Batch(headers)
+            batch.timer = asyncio.get_event_loop().call_later(self.batch_window, self.__dispatch, key)
+
+        future = asyncio.get_event_loop().create_future()
+        batch.payloads.append(payload)
+        batch.futures.append(future)
+        if len(batch.payloads) >= self.max_batch_size:
+            batch.timer.cancel()
+            self.__dispatch(key)
+
+        return await future
+
+    def __dispatch(self, key):
+        batch = self.__batches.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self.__send_batch(batch))
+
+    async def __send_batch(self, batch: _Batch):
+        try:
+            async with self.session.post(self.endpoint, data=self.codec.dumps(batch.payloads), headers=batch.headers, raise_for_status=True) as resp:
+                results = self.codec.loads(await resp.read())
+
+            if not isinstance(results, list) or len(results) != len(batch.futures):
+                raise BatchError(f'Expected a list of {len(batch.futures)} results from a batched request')
+        except Exception as error:  # pylint:disable=broad-except
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, result in zip(batch.futures, results):
+            # Callers may have been cancelled while the batch was in flight
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,124 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+from .codec import JSONCodec
+
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+DEFAULT_CACHE_TTL = 60
+
+
+# Storage for query responses, keyed by the operation text, variables and headers.
+# Values are the raw response texts so external stores (redis, memcached...) can hold them as they are.
+class ResponseCache(ABC):
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: float = None):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# In process LRU cache. Entries expire `ttl` seconds after being stored and the least recently used ones are evicted
+# once there are more than `max_entries` of them or their texts add up to more than `max_bytes` characters.
+class MemoryCache(ResponseCache):
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, ttl: float = DEFAULT_CACHE_TTL, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.size = 0
+        self.__entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key: str) -> Optional[str]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self.__remove(key)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or (self.max_bytes is not None and len(value) > self.max_bytes):
+            return
+
+        with self.__lock:
+            self.__remove(key)
+            self.__entries[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while len(self.__entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                self.__remove(next(iter(self.__entries)))
+                self.stats.evictions += 1
+
+    def delete(self, key: str):
+        with self.__lock:
+            self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
+
+    def __remove(self, key: str):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+def cached_response(cache: ResponseCache, key: str, return_json: bool, codec: JSONCodec) -> Union[None, dict, str]:
+    value = cache.get(key)
+    if value is None:
+        return None
+
+    return codec.loads(value) if return_json else value
+
+
+def cache_response(cache: ResponseCache, key: str, response: Union[dict, str], codec: JSONCodec, ttl: float = None):
+    # Responses carrying errors are usually transient, don't keep serving them
+    data = response if isinstance(response, dict) else codec.loads(response)
+    if not isinstance(data, dict) or data.get('errors'):
+        return
+
+    cache.set(key, response if isinstance(response, str) else codec.dumps(response).decode('utf-8'), ttl)
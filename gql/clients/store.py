@@ -0,0 +1,192 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Union
+
+from .cache import CacheStats
+from .codec import JSONCodec
+
+DEFAULT_STORE_MAX_RECORDS = 10000
+
+# Marks arguments given by a variable in selection plans (see gql.selection)
+VARIABLE_MARKER = '$'
+
+_MISSING = object()
+
+
+class _Ref:
+    # Points from a field to the record of an entity
+    __slots__ = ('key',)
+
+    def __init__(self, key: str):
+        self.key = key
+
+
+# Normalized store of the entities found in responses. Objects with an `id` are kept once, keyed by their type
+# (`__typename` when selected) and id, and merged field by field with every response they appear in, so operations
+# selecting fields already received from other operations can be answered without a request.
+# Records are entities and root fields (keyed by the root type, field name and arguments). Once there are more than
+# `max_records` of them the least recently used ones are evicted, operations reading an evicted record are fetched again.
+class EntityStore:
+
+    def __init__(self, max_records: int = DEFAULT_STORE_MAX_RECORDS):
+        self.max_records = max_records
+        self.stats = CacheStats()
+        self.__records: 'OrderedDict[str, Any]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__records)
+
+    def read(self, selection, variables: Mapping[str, Any] = None) -> Optional[dict]:
+        # Returns the operation's data if every field it selects is in the store, None otherwise
+        type_name, _, fields = selection
+        variables = variables or {}
+        with self.__lock:
+            data = {}
+            for key, name, arguments, field_selection in fields:
+                record_key = f'{type_name}.{_storage_key(name, arguments, variables)}'
+                value = self.__records.get(record_key, _MISSING)
+                if value is not _MISSING:
+                    self.__records.move_to_end(record_key)
+                    value = self.__read_value(value, field_selection, variables)
+
+                if value is _MISSING:
+                    self.stats.misses += 1
+                    return None
+
+                data[key] = value
+
+            self.stats.hits += 1
+            return data
+
+    def write(self, selection, data: Mapping[str, Any], variables: Mapping[str, Any] = None, root_fields: bool = True):
+        # Without root fields (for mutations) only the entities found in the data are stored
+        type_name, _, fields = selection
+        variables = variables or {}
+        with self.__lock:
+            for key, name, arguments, field_selection in fields:
+                if key not in data:
+                    continue
+
+                record_key = f'{type_name}.{_storage_key(name, arguments, variables)}'
+                value = self.__write_value(data[key], field_selection, variables, self.__records.get(record_key))
+                if root_fields:
+                    self.__set(record_key, value)
+
+            self.__evict()
+
+    def evict(self, type_name: str, entity_id: Any):
+        with self.__lock:
+            self.__records.pop(_entity_key(type_name, entity_id), None)
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+
+    def __read_value(self, value: Any, selection, variables: Mapping[str, Any]) -> Any:
+        if value is None:
+            return None
+
+        if isinstance(value, list):
+            items = [self.__read_value(item, selection, variables) for item in value]
+            return _MISSING if any(item is _MISSING for item in items) else items
+
+        if selection is None:
+            return value
+
+        if isinstance(value, _Ref):
+            record = self.__records.get(value.key)
+            if record is None:
+                return _MISSING
+            self.__records.move_to_end(value.key)
+            value = record
+
+        result = {}
+        for key, name, arguments, field_selection in selection[2]:
+            field_value = value.get(_storage_key(name, arguments, variables), _MISSING)
+            if field_value is not _MISSING:
+                field_value = self.__read_value(field_value, field_selection, variables)
+            if field_value is _MISSING:
+                return _MISSING
+            result[key] = field_value
+
+        return result
+
+    def __write_value(self, value: Any, selection, variables: Mapping[str, Any], existing: Any = None) -> Any:
+        if value is None or selection is None:
+            return value
+
+        if isinstance(value, list):
+            return [self.__write_value(item, selection, variables) for item in value]
+
+        type_name, id_key, fields = selection
+        entity_key = None
+        if id_key is not None and value.get(id_key) is not None:
+            entity_key = _entity_key(value.get('__typename', type_name), value[id_key])
+            existing = self.__records.get(entity_key)
+
+        # Fields are merged into what was already known of the object
+        record = dict(existing) if isinstance(existing, dict) else {}
+        for key, name, arguments, field_selection in fields:
+            if key in value:
+                storage_key = _storage_key(name, arguments, variables)
+                record[storage_key] = self.__write_value(value[key], field_selection, variables, record.get(storage_key))
+
+        if entity_key is None:
+            return record
+
+        self.__set(entity_key, record)
+        return _Ref(entity_key)
+
+    def __set(self, key: str, value: Any):
+        self.__records[key] = value
+        self.__records.move_to_end(key)
+
+    def __evict(self):
+        while len(self.__records) > self.max_records:
+            self.__records.popitem(last=False)
+            self.stats.evictions += 1
+
+
+def _entity_key(type_name: str, entity_id: Any) -> str:
+    return f'{type_name}:{entity_id}'
+
+
+def _storage_key(name: str, arguments: Optional[Dict[str, Any]], variables: Mapping[str, Any]) -> str:
+    if not arguments:
+        return name
+
+    return f'{name}({json.dumps(_resolve(arguments, variables), sort_keys=True)})'
+
+
+def _resolve(value: Any, variables: Mapping[str, Any]) -> Any:
+    if isinstance(value, tuple) and len(value) == 2 and value[0] == VARIABLE_MARKER:
+        return variables.get(value[1])
+
+    if isinstance(value, list):
+        return [_resolve(item, variables) for item in value]
+
+    if isinstance(value, dict):
+        return {name: _resolve(item, variables) for name, item in value.items()}
+
+    return value
+
+
+def stored_response(store: EntityStore, selection, variables: Mapping[str, Any], return_json: bool, codec: JSONCodec) -> Union[None, dict, str]:
+    data = store.read(selection, variables)
+    if data is None:
+        return None
+
+    response = {'data': data}
+    return response if return_json else codec.dumps(response).decode('utf-8')
+
+
+def store_response(store: EntityStore, selection, variables: Mapping[str, Any], response: Union[dict, str], codec: JSONCodec,
+                   root_fields: bool = True):
+    # Like the response cache, responses with errors aren't kept
+    response = response if isinstance(response, dict) else codec.loads(response)
+    if not isinstance(response, dict) or response.get('errors') or not isinstance(response.get('data'), dict):
+        return
+
+    store.write(selection, response['data'], variables, root_fields=root_fields)
@@ -0,0 +1,182 @@
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+STRUCTURAL_CHARS = re.compile(r'["{}\[\],:]')
+WHITESPACE = ' \t\n\r'
+
+PathT = Tuple[str, ...]
+
+DEFAULT_STREAM_CHUNK_SIZE = 64 * 1024
+ERRORS_PATH: PathT = ('errors',)
+
+
+class StreamError(Exception):
+    pass
+
+
+class ResponseErrors(Exception):
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__('\n'.join(str(error.get('message', error)) if isinstance(error, dict) else str(error) for error in errors))
+
+
+class _Frame:
+    __slots__ = ('is_object', 'key', 'expect_key', 'target')
+
+    def __init__(self, is_object: bool, target: Optional[PathT] = None):
+        self.is_object = is_object
+        self.key: Optional[str] = None
+        self.expect_key = is_object
+        self.target = target
+
+
+# Incremental JSON parser decoding the elements of a few arrays (found by their path of object keys from the root)
+# out of a document fed chunk by chunk. Elements are returned as soon as they are complete and nothing else is kept,
+# so memory is bounded by the largest element rather than by the document.
+# Only the structure leading to the arrays is scanned here, elements are decoded in one go by json's C decoder.
+class ListStreamParser:
+    def __init__(self, paths: Iterable[Sequence[str]]):
+        self.paths = {tuple(path) for path in paths}
+        self.depths = {len(path) for path in self.paths}
+        self.buffer = ''
+        self.pos = 0
+        self.stack: List[_Frame] = []
+        self.expect_element = False
+        # An element only partly received is retried once the buffer has grown enough, keeping retries linear
+        self.retry_at = 0
+        self.__utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.__decoder = json.JSONDecoder()
+
+    def feed(self, chunk: bytes) -> List[Tuple[PathT, Any]]:
+        self.buffer += self.__utf8.decode(chunk)
+        elements: List[Tuple[PathT, Any]] = []
+
+        while True:
+            if self.expect_element:
+                if not self.__read_element(elements):
+                    break
+                continue
+
+            match = STRUCTURAL_CHARS.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                break
+
+            index = match.start()
+            char = self.buffer[index]
+            top = self.stack[-1] if self.stack else None
+
+            if char == '"':
+                end = self.__string_end(index)
+                if end is None:
+                    # Wait for the rest of the string
+                    self.pos = index
+                    break
+
+                if top is not None and top.is_object and top.expect_key:
+                    top.key = self.__decode_key(self.buffer[index + 1:end])
+                    top.expect_key = False
+
+                self.pos = end + 1
+                continue
+
+            if char == '{' or char == '[':
+                frame = _Frame(is_object=char == '{', target=self.__target_for(char))
+                self.stack.append(frame)
+                self.expect_element = frame.target is not None
+            elif char == '}' or char == ']':
+                if not self.stack:
+                    raise StreamError(f'Unexpected {char} at offset {index}')
+                self.stack.pop()
+            elif char == ',':
+                if top is not None and top.is_object:
+                    top.expect_key = True
+                elif top is not None and top.target is not None:
+                    self.expect_element = True
+
+            self.pos = index + 1
+
+        # Drop what was consumed
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.retry_at = max(self.retry_at - self.pos, 0)
+            self.pos = 0
+
+        return elements
+
+    def close(self) -> List[Tuple[PathT, Any]]:
+        # Returns the elements still waiting for a retry
+        self.retry_at = 0
+        elements = self.feed(self.__utf8.decode(b'', final=True).encode('utf-8'))
+        if self.stack or self.buffer.strip(WHITESPACE):
+            raise StreamError('Response ended before the JSON document was complete')
+
+        return elements
+
+    def __read_element(self, elements: List[Tuple[PathT, Any]]) -> bool:
+        # Reads the next element of the target array, returns False when more data is needed
+        start = self.pos
+        while start < len(self.buffer) and self.buffer[start] in WHITESPACE:
+            start += 1
+        self.pos = start
+        if start == len(self.buffer) or len(self.buffer) < self.retry_at:
+            return False
+
+        if self.buffer[start] == ']':
+            # Empty array, the scanner closes it
+            self.expect_element = False
+            return True
+
+        try:
+            value, end = self.__decoder.raw_decode(self.buffer, start)
+        except json.JSONDecodeError:
+            end = None
+
+        # A number running to the end of the buffer may continue in the next chunk
+        if end is None or end == len(self.buffer):
+            self.retry_at = start + 2 * (len(self.buffer) - start)
+            return False
+
+        elements.append((self.stack[-1].target, value))
+        self.expect_element = False
+        self.retry_at = 0
+        self.pos = end
+        return True
+
+    def __target_for(self, char: str) -> Optional[PathT]:
+        if char != '[' or len(self.stack) not in self.depths:
+            return None
+
+        if not all(frame.is_object for frame in self.stack):
+            return None
+
+        path = tuple(frame.key for frame in self.stack)
+        return path if path in self.paths else None
+
+    def __string_end(self, start: int) -> Optional[int]:
+        index = start
+        while True:
+            index = self.buffer.find('"', index + 1)
+            if index == -1:
+                return None
+
+            backslashes = 0
+            while self.buffer[index - 1 - backslashes] == '\\':
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return index
+
+    @staticmethod
+    def __decode_key(raw: str) -> str:
+        return json.loads(f'"{raw}"') if '\\' in raw else raw
+
+
+def route_elements(elements: List[Tuple[PathT, Any]], path: PathT, errors: list) -> Iterator[Any]:
+    # Yields the elements of the list at `path`, collecting the response errors on the side
+    for element_path, element in elements:
+        if element_path == path:
+            yield element
+        else:
+            errors.append(element)
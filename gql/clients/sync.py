@@ -1,11 +1,60 @@
-from typing import Callable, Mapping, Union
+import os
+import threading
+from typing import Any, Callable, ClassVar, Dict, Iterator, Mapping, Sequence, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import ResponseCache, cache_response, cached_response
+from .codec import JSONCodec, default_codec
+from .store import EntityStore, store_response, stored_response
+from .streaming import ListStreamParser, ResponseErrors, route_elements, DEFAULT_STREAM_CHUNK_SIZE, ERRORS_PATH
+from .utils import is_query, request_key, hash_query, add_persisted_query, is_persisted_query, without_query, \
+    without_persisted_query, persisted_query_error, PERSISTED_QUERY_NOT_SUPPORTED
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 0
+
+TimeoutT = Union[None, float, Tuple[float, float]]
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
 
 
 class Client:
-    def __init__(self, endpoint, headers=None):
+    __shared: ClassVar[Dict[str, 'Client']] = {}
+    # Settings of the shared clients by endpoint, kept apart from the clients so they outlive a fork
+    __shared_options: ClassVar[Dict[str, Dict[str, Any]]] = {}
+    __shared_lock: ClassVar[threading.Lock] = threading.Lock()
+    __shared_pid: ClassVar[int] = os.getpid()
+
+    def __init__(self, endpoint, headers=None,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 retries: int = DEFAULT_RETRIES,
+                 timeout: TimeoutT = None,
+                 deduplicate: bool = True,
+                 cache: ResponseCache = None,
+                 persisted_queries: bool = False,
+                 codec: JSONCodec = None,
+                 store: EntityStore = None):
         self.endpoint = endpoint
+        self.timeout = timeout
+        # Automatic persisted queries: send the query hash alone and the full query only when the server doesn't know it yet
+        self.persisted_queries = persisted_queries
+        self.codec = codec or default_codec()
+        # Normalized entities of the responses to generated operations, answering the queries it has every field of
+        self.store = store
+        # Query responses are only cached when given a cache, mutations never are
+        self.cache = cache
+        # Identical queries issued concurrently from several threads share a single request
+        self.deduplicate = deduplicate
+        self.__in_flight: Dict[str, _InFlight] = {}
+        self.__in_flight_lock = threading.Lock()
 
         headers = headers or {}
         self.__headers = {
@@ -15,11 +64,114 @@ class Client:
             'Accept-Encoding': 'gzip',
         }
 
+        # Only connection failures are retried: the request never reached the server so it is safe even for mutations
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, read=False, status=0, backoff_factor=0.1),
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def configure(cls, endpoint, **kwargs):
+        # Settings of the shared client for this endpoint, used by the clients created from now on
+        with cls.__shared_lock:
+            cls.__shared_options[endpoint] = kwargs
+
+    @classmethod
+    def shared(cls, endpoint, **kwargs) -> 'Client':
+        # One client (and connection pool) per endpoint and process. kwargs only apply when it is first created, they
+        # are then kept as the endpoint's settings (see configure).
+        with cls.__shared_lock:
+            if cls.__shared_pid != os.getpid():
+                # Pooled sockets must not be shared with a forked parent, the clients are created again from their settings
+                cls.__shared = {}
+                cls.__shared_pid = os.getpid()
+
+            client = cls.__shared.get(endpoint)
+            if client is None:
+                if kwargs:
+                    cls.__shared_options[endpoint] = kwargs
+                client = cls.__shared[endpoint] = cls(endpoint, **cls.__shared_options.get(endpoint, {}))
+
+            return client
+
+    @classmethod
+    def close_shared(cls):
+        with cls.__shared_lock:
+            for client in cls.__shared.values():
+                client.close()
+            cls.__shared = {}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def call(self, query,
              variables=None,
              return_json=False,
-             on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None) -> Union[dict, str]:
+             on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None,
+             cache: bool = True,
+             cache_ttl: float = None,
+             query_hash: str = None,
+             selection=None) -> Union[dict, str]:
+
+        payload, headers = self.__prepare(query, variables, on_before_callback)
+
+        if self.persisted_queries:
+            # Generated code passes the hash computed at build time, unless the callback changed the query
+            add_persisted_query(payload, query_hash if query_hash and payload['query'] is query else hash_query(payload['query']))
+
+        # Generated code also passes the operation's selection plan, for the entity store
+        if self.store is None or payload['query'] is not query:
+            selection = None
+
+        if not is_query(payload['query']):
+            response = self.__send(payload, headers, return_json)
+            if selection is not None:
+                store_response(self.store, selection, payload.get('variables'), response, self.codec, root_fields=False)
+            return response
 
+        if cache and selection is not None:
+            response = stored_response(self.store, selection, payload.get('variables'), return_json, self.codec)
+            if response is not None:
+                return response
+
+        response = self.__query(payload, headers, return_json, cache, cache_ttl)
+        if selection is not None:
+            store_response(self.store, selection, payload.get('variables'), response, self.codec)
+
+        return response
+
+    def stream(self, query, path: Sequence[str],
+               variables=None,
+               on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None,
+               chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[Any]:
+        # Yields the elements of the list at `path` (keys from the response root, like ('data', 'allFilms', 'edges'))
+        # while the response is being received. Errors in the response are raised once it is complete.
+        # Elements are decoded by the stream parser rather than the codec, which needs whole documents.
+        payload, headers = self.__prepare(query, variables, on_before_callback)
+        path = tuple(path)
+        parser = ListStreamParser([path, ERRORS_PATH])
+        errors = []
+
+        with self.session.post(self.endpoint, data=self.codec.dumps(payload), headers=headers, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size):
+                yield from route_elements(parser.feed(chunk), path, errors)
+
+        yield from route_elements(parser.close(), path, errors)
+        if errors:
+            raise ResponseErrors(errors)
+
+    def __prepare(self, query, variables, on_before_callback) -> Tuple[dict, dict]:
         headers = self.__headers.copy()
 
         payload = {
@@ -31,6 +183,65 @@ class Client:
         if on_before_callback:
             on_before_callback(payload, headers)
 
-        response = requests.post(self.endpoint, json=payload, headers=headers)
+        return payload, headers
+
+    def __query(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool, cache: bool, cache_ttl: float) -> Union[dict, str]:
+        if not (cache and self.cache is not None):
+            return self.__fetch(payload, headers, return_json)
+
+        cache_key = request_key(payload, headers)
+        response = cached_response(self.cache, cache_key, return_json, self.codec)
+        if response is None:
+            response = self.__fetch(payload, headers, return_json)
+            cache_response(self.cache, cache_key, response, self.codec, cache_ttl)
+
+        return response
+
+    def __fetch(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        if not self.deduplicate:
+            return self.__send(payload, headers, return_json)
+
+        key = request_key(payload, headers, return_json)
+        with self.__in_flight_lock:
+            in_flight = self.__in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = self.__in_flight[key] = _InFlight()
+
+        if not is_leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = self.__send(payload, headers, return_json)
+            return in_flight.result
+        except Exception as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self.__in_flight_lock:
+                del self.__in_flight[key]
+            in_flight.done.set()
+
+    def __send(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        if not is_persisted_query(payload):
+            return self.__post(payload, headers, return_json)
+
+        response = self.__post(without_query(payload), headers, return_json)
+        error = persisted_query_error(response)
+        if error is None:
+            return response
+
+        if error == PERSISTED_QUERY_NOT_SUPPORTED[0]:
+            self.persisted_queries = False
+            payload = without_persisted_query(payload)
+
+        # Sending the query along with its hash registers it for the next calls
+        return self.__post(payload, headers, return_json)
+
+    def __post(self, payload: Mapping[str, Any], headers: Mapping[str, str], return_json: bool) -> Union[dict, str]:
+        response = self.session.post(self.endpoint, data=self.codec.dumps(payload), headers=headers, timeout=self.timeout)
         response.raise_for_status()
-        return response.json() if return_json else response.text
+        return self.codec.loads(response.content) if return_json else response.text
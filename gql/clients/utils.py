@@ -0,0 +1,135 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import Any, Mapping, Optional, Union
+
+OPERATION_KEYWORDS = ('query', 'mutation', 'subscription')
+
+# Automatic persisted queries, as implemented by Apollo server and most GraphQL servers
+PERSISTED_QUERY_VERSION = 1
+PERSISTED_QUERY_NOT_FOUND = ('PersistedQueryNotFound', 'PERSISTED_QUERY_NOT_FOUND')
+PERSISTED_QUERY_NOT_SUPPORTED = ('PersistedQueryNotSupported', 'PERSISTED_QUERY_NOT_SUPPORTED')
+
+
+def _top_level_words(document: str):
+    # Yields the words and braces found outside of any selection set, skipping comments and strings.
+    # Good enough to tell operation types apart without parsing the whole document.
+    depth = 0
+    index = 0
+    length = len(document)
+    while index < length:
+        char = document[index]
+        if char == '#':
+            end = document.find('\n', index)
+            index = length if end == -1 else end
+        elif document.startswith('"""', index):
+            end = document.find('"""', index + 3)
+            while end != -1 and document[end - 1] == '\\':
+                end = document.find('"""', end + 3)
+            index = length if end == -1 else end + 3
+        elif char == '"':
+            index += 1
+            while index < length and document[index] not in '"\n':
+                index += 2 if document[index] == '\\' else 1
+            index += 1
+        elif char == '{':
+            if depth == 0:
+                yield '{'
+            depth += 1
+            index += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                yield '}'
+            index += 1
+        elif depth == 0 and (char.isalpha() or char == '_'):
+            start = index
+            while index < length and (document[index].isalnum() or document[index] == '_'):
+                index += 1
+            yield document[start:index]
+        else:
+            index += 1
+
+
+@lru_cache(maxsize=1024)
+def operation_types(document: str) -> frozenset:
+    types = set()
+    definition_start = True
+    for word in _top_level_words(document):
+        if word == '}':
+            definition_start = True
+            continue
+
+        if definition_start:
+            if word in OPERATION_KEYWORDS:
+                types.add(word)
+            elif word == '{':
+                # Shorthand `{ ... }` anonymous query
+                types.add('query')
+        definition_start = False
+
+    return frozenset(types)
+
+
+def is_query(document: str) -> bool:
+    # Only documents made of queries are safe to deduplicate or cache
+    types = operation_types(document)
+    return bool(types) and types == {'query'}
+
+
+def request_key(payload: Mapping[str, Any], headers: Mapping[str, str], *extra) -> str:
+    # Canonical representation of everything that goes over the wire, variables order doesn't matter
+    return json.dumps([payload, headers, *extra], sort_keys=True, separators=(',', ':'), default=str)
+
+
+@lru_cache(maxsize=1024)
+def hash_query(document: str) -> str:
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+
+def add_persisted_query(payload: dict, query_hash: str):
+    payload['extensions'] = {
+        **payload.get('extensions', {}),
+        'persistedQuery': {'version': PERSISTED_QUERY_VERSION, 'sha256Hash': query_hash},
+    }
+
+
+def is_persisted_query(payload: Mapping[str, Any]) -> bool:
+    return 'persistedQuery' in payload.get('extensions', {})
+
+
+def without_query(payload: Mapping[str, Any]) -> dict:
+    return {key: value for key, value in payload.items() if key != 'query'}
+
+
+def without_persisted_query(payload: Mapping[str, Any]) -> dict:
+    extensions = {key: value for key, value in payload['extensions'].items() if key != 'persistedQuery'}
+    stripped = {key: value for key, value in payload.items() if key != 'extensions'}
+    if extensions:
+        stripped['extensions'] = extensions
+
+    return stripped
+
+
+def persisted_query_error(response: Union[dict, str]) -> Optional[str]:
+    # Returns the persisted query error code (a NOT_FOUND or NOT_SUPPORTED one) carried by the response, if any.
+    # Plain responses are only decoded when they mention one of the codes, so the common path stays a substring search.
+    if isinstance(response, str):
+        if not any(code in response for code in PERSISTED_QUERY_NOT_FOUND + PERSISTED_QUERY_NOT_SUPPORTED):
+            return None
+        try:
+            response = json.loads(response)
+        except ValueError:
+            return None
+
+    if not isinstance(response, dict):
+        return None
+
+    for error in response.get('errors') or ():
+        for code in (error.get('message'), (error.get('extensions') or {}).get('code')):
+            if code in PERSISTED_QUERY_NOT_FOUND:
+                return PERSISTED_QUERY_NOT_FOUND[0]
+            if code in PERSISTED_QUERY_NOT_SUPPORTED:
+                return PERSISTED_QUERY_NOT_SUPPORTED[0]
+
+    return None
@@ -12,6 +12,10 @@ class Config:
     endpoint: str
     documents: str
     custom_header: str = ''
+    validation: str = 'full'
+    slots: bool = False
+    lazy: bool = False
+    shared_module: str = ''
 
     @classmethod
     def load(cls: Type[ConfigT], filename: str) -> ConfigT:
@@ -0,0 +1,211 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from graphql import parse, visit, Visitor, FragmentDefinitionNode, OperationDefinitionNode, Source
+from graphql.error import GraphQLError, GraphQLSyntaxError
+
+
+@dataclass
+class ParsedFragment:
+    name: str
+    filename: str
+    source: str
+    # Offset of the definition in its file
+    start: int = 0
+    spreads: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class IndexedDocument:
+    filename: str
+    source: str
+    has_operations: bool = False
+    fragments: Dict[str, ParsedFragment] = field(default_factory=dict)
+    spreads: Set[str] = field(default_factory=set)
+
+
+class FragmentSpreadsVisitor(Visitor):
+
+    def __init__(self, document: IndexedDocument):
+        self.document = document
+        self.current: Optional[ParsedFragment] = None
+
+    def enter_operation_definition(self, node: OperationDefinitionNode, *_args):
+        self.document.has_operations = True
+        self.current = None
+        return node
+
+    def enter_fragment_definition(self, node: FragmentDefinitionNode, *_args):
+        source = self.document.source[node.loc.start:node.loc.end] if node.loc else ''
+        start = node.loc.start if node.loc else 0
+        self.current = ParsedFragment(name=node.name.value, filename=self.document.filename, source=source, start=start)
+        self.document.fragments[self.current.name] = self.current
+        return node
+
+    def enter_fragment_spread(self, node, *_args):
+        self.document.spreads.add(node.name.value)
+        if self.current:
+            self.current.spreads.add(node.name.value)
+        return node
+
+
+@dataclass
+class SourceSegment:
+    filename: str
+    # Whole content of the file the segment was read from
+    file_source: str
+    # Offsets of the segment in the combined document and in its file
+    start: int
+    file_start: int
+    length: int
+
+    def __contains__(self, position: int) -> bool:
+        return self.start <= position <= self.start + self.length
+
+
+@dataclass
+class SourceMap:
+    # Where each part of a document combined from several files (see FragmentIndex.document_source) comes from
+    segments: List[SourceSegment] = field(default_factory=list)
+
+    def locate(self, error: GraphQLError) -> GraphQLError:
+        # Errors point into the combined document, have them point into the file the failing definition was read from
+        segment = next((segment for segment in self.segments if error.positions and error.positions[0] in segment), None)
+        if segment is None:
+            return error
+
+        positions = [segment.file_start + position - segment.start for position in error.positions if position in segment]
+        return GraphQLError(error.message, source=Source(segment.file_source, segment.filename), positions=positions)
+
+
+# Project wide index of where every fragment is defined and which documents spread it.
+# Lets documents spread fragments defined in other files and tells which documents to rebuild when a fragment changes.
+class FragmentIndex:
+
+    def __init__(self):
+        self.documents: Dict[str, IndexedDocument] = {}
+        self.definitions: Dict[str, Set[str]] = {}
+        self.spreaders: Dict[str, Set[str]] = {}
+
+    def update(self, filename: str, source: str):
+        self.remove(filename)
+
+        document = IndexedDocument(filename=filename, source=source)
+        try:
+            visit(parse(source), FragmentSpreadsVisitor(document))
+        except GraphQLSyntaxError:
+            # Index what we can, compiling the document will report the error
+            pass
+
+        self.documents[filename] = document
+        for name in document.fragments:
+            self.definitions.setdefault(name, set()).add(filename)
+        for name in document.spreads:
+            self.spreaders.setdefault(name, set()).add(filename)
+
+    def remove(self, filename: str):
+        document = self.documents.pop(filename, None)
+        if not document:
+            return
+
+        for name in document.fragments:
+            self.definitions[name].discard(filename)
+        for name in document.spreads:
+            self.spreaders[name].discard(filename)
+
+    def defined_in(self, filename: str) -> Set[str]:
+        document = self.documents.get(filename)
+        return set(document.fragments) if document else set()
+
+    def has_operations(self, filename: str) -> bool:
+        document = self.documents.get(filename)
+        return bool(document and document.has_operations)
+
+    def fragment(self, name: str) -> Optional[ParsedFragment]:
+        filenames = self.definitions.get(name)
+        if not filenames:
+            return None
+
+        # Duplicate names are reported by validation, pick deterministically meanwhile
+        return self.documents[min(filenames)].fragments[name]
+
+    def external_fragments(self, filename: str) -> List[ParsedFragment]:
+        # Fragments spread by the document (directly or through other fragments) but defined elsewhere.
+        # Ordered so every fragment comes after the fragments it spreads, as rendered classes inherit from them.
+        document = self.documents[filename]
+        return self.__ordered(sorted(document.spreads), set(document.fragments))
+
+    def all_fragments(self) -> List[ParsedFragment]:
+        # Every fragment of the project, each after the fragments it spreads
+        return self.__ordered(sorted(name for name, filenames in self.definitions.items() if filenames), set())
+
+    def __ordered(self, names: Iterable[str], visited: Set[str]) -> List[ParsedFragment]:
+        ordered: List[ParsedFragment] = []
+
+        def add(name: str):
+            if name in visited:
+                return
+
+            visited.add(name)
+            fragment = self.fragment(name)
+            if fragment:
+                for spread in sorted(fragment.spreads):
+                    add(spread)
+                ordered.append(fragment)
+
+        for name in names:
+            add(name)
+
+        return ordered
+
+    def sources(self) -> List[str]:
+        return [self.documents[filename].source for filename in sorted(self.documents)]
+
+    def fragments_source(self) -> str:
+        return self.fragments_source_map()[0]
+
+    def fragments_source_map(self) -> Tuple[str, SourceMap]:
+        return self.__combine((fragment.filename, fragment.start, fragment.source) for fragment in self.all_fragments())
+
+    def document_source(self, filename: str) -> str:
+        return self.document_source_map(filename)[0]
+
+    def document_source_map(self, filename: str) -> Tuple[str, SourceMap]:
+        parts = [(filename, 0, self.documents[filename].source)]
+        parts.extend((fragment.filename, fragment.start, fragment.source) for fragment in self.external_fragments(filename))
+        return self.__combine(parts)
+
+    def __combine(self, parts: Iterable[Tuple[str, int, str]]) -> Tuple[str, SourceMap]:
+        sources: List[str] = []
+        source_map = SourceMap()
+        start = 0
+        for filename, file_start, source in parts:
+            if sources:
+                start += 2
+            source_map.segments.append(SourceSegment(filename=filename, file_source=self.documents[filename].source,
+                                                     start=start, file_start=file_start, length=len(source)))
+            sources.append(source)
+            start += len(source)
+
+        return '\n\n'.join(sources), source_map
+
+    def dependents(self, fragment_names: Iterable[str]) -> Set[str]:
+        # Walk spreads backwards: documents spreading a changed fragment are affected, and so is anything
+        # spreading a fragment those documents define.
+        affected: Set[str] = set()
+        seen_names = set(fragment_names)
+        pending = deque(seen_names)
+        while pending:
+            name = pending.popleft()
+            for filename in self.spreaders.get(name, ()):
+                if filename in affected:
+                    continue
+
+                affected.add(filename)
+                for defined_name in self.documents[filename].fragments:
+                    if defined_name not in seen_names:
+                        seen_names.add(defined_name)
+                        pending.append(defined_name)
+
+        return affected
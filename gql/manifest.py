@@ -0,0 +1,85 @@
+import os
+import hashlib
+from functools import lru_cache
+from importlib import import_module
+from typing import Dict, Type, TypeVar
+from dataclasses import dataclass, field, asdict
+from dataclasses_json import dataclass_json
+
+from gql.config import Config
+
+# Bump whenever the manifest's own format changes. Changes to generated code are tracked by hash_generator.
+MANIFEST_VERSION = 1
+MANIFEST_FNAME = 'manifest.json'
+
+# Modules whose code shapes generated modules: any change to them (a new release or a local edit) regenerates everything
+GENERATOR_MODULES = ('gql.query_parser', 'gql.selection', 'gql.renderer_dataclasses', 'gql.utils_codegen', 'gql.runtime', 'gql.clients.utils')
+
+# Config fields that don't affect the rendered output. The schema is tracked by content hash instead.
+CONFIG_FIELDS_IGNORED = ('schema', 'documents')
+
+ManifestT = TypeVar('ManifestT', bound='ManifestT')
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def hash_config(config: Config) -> str:
+    relevant = {name: value for name, value in sorted(asdict(config).items()) if name not in CONFIG_FIELDS_IGNORED}
+    return hash_text(repr(relevant))
+
+
+@lru_cache()
+def hash_generator() -> str:
+    digest = hashlib.sha256()
+    for name in GENERATOR_MODULES:
+        with open(import_module(name).__file__, 'rb') as fin:
+            digest.update(fin.read())
+
+    return digest.hexdigest()
+
+
+@dataclass_json
+@dataclass
+class Manifest:
+    version: int = MANIFEST_VERSION
+    schema_hash: str = ''
+    config_hash: str = ''
+    generator_hash: str = ''
+    files: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls: Type[ManifestT], filename: str) -> ManifestT:
+        try:
+            with open(filename, 'r') as fin:
+                return cls.from_json(fin.read())  # pylint:disable=no-member
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+    def save(self, filename: str):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as outfile:
+            outfile.write(self.to_json(indent=2))  # pylint:disable=no-member
+
+        os.replace(tmp_filename, filename)
+
+    def reset_if_stale(self, schema_hash: str, config_hash: str, generator_hash: str):
+        current = (MANIFEST_VERSION, schema_hash, config_hash, generator_hash)
+        if (self.version, self.schema_hash, self.config_hash, self.generator_hash) != current:
+            self.version, self.schema_hash, self.config_hash, self.generator_hash = current
+            self.files = {}
+
+    def is_fresh(self, filename: str, query_hash: str, target_filename: str) -> bool:
+        return self.files.get(filename) == query_hash and os.path.isfile(target_filename)
+
+    def record(self, filename: str, query_hash: str):
+        self.files[filename] = query_hash  # pylint:disable=unsupported-assignment-operation
+
+    def forget(self, filename: str):
+        self.files.pop(filename, None)  # pylint:disable=no-member
+
+    def retain(self, filenames):
+        keep = set(filenames)
+        self.files = {filename: query_hash for filename, query_hash in self.files.items() if filename in keep}  # pylint:disable=no-member
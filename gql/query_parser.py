@@ -1,9 +1,45 @@
-from typing import Any, List, Mapping, Union, cast
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Union, cast
 from dataclasses import dataclass, field
 
-from graphql import GraphQLSchema, validate, parse, get_operation_ast, visit, Visitor, TypeInfo, TypeInfoVisitor, \
+from graphql import GraphQLSchema, GraphQLError, validate, parse, visit, Visitor, TypeInfo, TypeInfoVisitor, \
     GraphQLNonNull, is_scalar_type, GraphQLList, OperationDefinitionNode, NonNullTypeNode, TypeNode, GraphQLEnumType, \
-    is_enum_type
+    is_enum_type, specified_rules, ParallelVisitor, ValidationContext, assert_valid_schema, DocumentNode, \
+    FragmentDefinitionNode, FragmentSpreadNode, SelectionSetNode, print_ast, get_named_type, SKIP
+from graphql.language import Lexer, Source, TokenKind
+from graphql.validation.rules import RuleType
+from graphql.validation import ExecutableDefinitionsRule, UniqueOperationNamesRule, LoneAnonymousOperationRule, \
+    KnownTypeNamesRule, FragmentsOnCompositeTypesRule, VariablesAreInputTypesRule, ScalarLeafsRule, FieldsOnCorrectTypeRule, \
+    UniqueFragmentNamesRule, KnownFragmentNamesRule, PossibleFragmentSpreadsRule, NoFragmentCyclesRule, NoUnusedFragmentsRule
+
+# Rules the renderer relies on to produce correct code. Suitable for documents that were already validated elsewhere
+# (by the server's persisted query pipeline or CI for example).
+TRUSTED_VALIDATION_RULES: List[RuleType] = [
+    ExecutableDefinitionsRule,
+    UniqueOperationNamesRule,
+    LoneAnonymousOperationRule,
+    KnownTypeNamesRule,
+    FragmentsOnCompositeTypesRule,
+    VariablesAreInputTypesRule,
+    ScalarLeafsRule,
+    FieldsOnCorrectTypeRule,
+    UniqueFragmentNamesRule,
+    KnownFragmentNamesRule,
+    PossibleFragmentSpreadsRule,
+    NoFragmentCyclesRule,
+]
+
+VALIDATION_RULE_SETS: Mapping[str, Sequence[RuleType]] = {
+    'full': specified_rules,
+    'trusted': TRUSTED_VALIDATION_RULES,
+}
+
+VALIDATION_CACHE_SIZE = 4096
+
+# Tokens that need a space between them when printed next to each other
+WORD_TOKENS = {TokenKind.NAME, TokenKind.INT, TokenKind.FLOAT, TokenKind.STRING, TokenKind.BLOCK_STRING}
 
 
 @dataclass
@@ -47,6 +83,13 @@ class ParsedOperation:
 NodeT = Union[ParsedOperation, ParsedObject]
 
 
+def parse_enum(enum_type: GraphQLEnumType) -> ParsedEnum:
+    return ParsedEnum(
+        name=enum_type.name,
+        values={name: value.value or name for name, value in enum_type.values.items()}
+    )
+
+
 @dataclass
 class ParsedQuery:
     query: str
@@ -100,14 +143,11 @@ class FieldToTypeMatcherVisitor(Visitor):
         self.push(parsed_op)
         self.push(parsed_op.children[0])  # pylint:disable=unsubscriptable-object
 
-        return node
-
     # def enter_selection_set(self, node, *_):
     #     return node
 
     def leave_selection_set(self, node, *_):
         self.pull()
-        return node
 
     # Fragments
 
@@ -118,11 +158,9 @@ class FieldToTypeMatcherVisitor(Visitor):
         )
         self.parsed.objects.append(obj)  # pylint:disable=no-member
         self.push(obj)
-        return node
 
     def enter_fragment_spread(self, node, *_):
         self.current.parents.append(node.name.value)
-        return node
 
     # def enter_inline_fragment(self, node, *_):
     #     return node
@@ -150,11 +188,7 @@ class FieldToTypeMatcherVisitor(Visitor):
                 enum_type = cast(GraphQLEnumType, self.schema.type_map[underlying_graphql_type.name])
                 name = enum_type.name
                 if not any(e.name == name for e in self.parsed.enums):  # pylint:disable=not-an-iterable
-                    parsed_enum = ParsedEnum(
-                        name=enum_type.name,
-                        values={name: value.value or name for name, value in enum_type.values.items()}
-                    )
-                    self.parsed.enums.append(parsed_enum)  # pylint:disable=no-member
+                    self.parsed.enums.append(parse_enum(enum_type))  # pylint:disable=no-member
             else:
                 obj = ParsedObject(
                     name=str(underlying_graphql_type)
@@ -163,8 +197,6 @@ class FieldToTypeMatcherVisitor(Visitor):
                 self.current.children.append(obj)
                 self.push(obj)
 
-        return node
-
     @staticmethod
     def __scalar_type_to_python(scalar):
         nullable = True
@@ -213,6 +245,99 @@ class FieldToTypeMatcherVisitor(Visitor):
         return mapping, nullable, var_type
 
 
+def minify_document(document: str) -> str:
+    # Drops comments, commas and whitespace, keeping single spaces between names and values only
+    lexer = Lexer(Source(document))
+    parts: List[str] = []
+    previous = None
+    token = lexer.advance()
+    while token.kind != TokenKind.EOF:
+        if previous in WORD_TOKENS and token.kind in WORD_TOKENS:
+            parts.append(' ')
+        parts.append(document[token.start:token.end])
+        previous = token.kind
+        token = lexer.advance()
+
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def operation_asts(query: str) -> Dict[str, DocumentNode]:
+    # Each named operation of a query, first definition of its own document holding only the fragments the operation
+    # spreads (directly or through other fragments). Parsed once for the documents sent and the selection plans.
+    # Shared, don't mutate the result.
+    document_ast = parse(query)
+    fragments = {
+        definition.name.value: definition
+        for definition in document_ast.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+
+    documents = {}
+    for definition in document_ast.definitions:
+        if isinstance(definition, OperationDefinitionNode) and definition.name:
+            used: Dict[str, FragmentDefinitionNode] = {}
+            _collect_fragments(definition.selection_set, fragments, used)
+            documents[definition.name.value] = DocumentNode(definitions=[definition, *(used[name] for name in sorted(used))])
+
+    return documents
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def operation_documents(query: str) -> Dict[str, str]:
+    # The document sent for each named operation of a query (see operation_asts): canonically printed and minified.
+    # Shared, don't mutate the result.
+    return {name: minify_document(print_ast(document_ast)) for name, document_ast in operation_asts(query).items()}
+
+
+def _collect_fragments(selection_set: Optional[SelectionSetNode], fragments: Mapping[str, FragmentDefinitionNode],
+                       used: Dict[str, FragmentDefinitionNode]):
+    if selection_set is None:
+        return
+
+    for selection in selection_set.selections:
+        if isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name not in used and name in fragments:
+                used[name] = fragments[name]
+                _collect_fragments(fragments[name].selection_set, fragments, used)
+        else:
+            _collect_fragments(selection.selection_set, fragments, used)
+
+
+class EnumsVisitor(Visitor):
+    # Enums of the fields a document selects, the ones FieldToTypeMatcherVisitor parses, without matching the rest
+
+    def __init__(self, type_info: TypeInfo):
+        self.type_info = type_info
+        self.enums: Dict[str, ParsedEnum] = {}
+
+    def enter_field(self, node, *_args):
+        named_type = get_named_type(self.type_info.get_type())
+        if is_enum_type(named_type) and named_type.name not in self.enums:
+            self.enums[named_type.name] = parse_enum(named_type)
+        return node
+
+
+def document_enums(schema: GraphQLSchema, queries: Iterable[str]) -> List[ParsedEnum]:
+    # Enums selected by any of the documents, sorted by name. Documents that don't parse are left to their own
+    # compilation to report.
+    enums: Dict[str, ParsedEnum] = {}
+    for query in queries:
+        try:
+            document_ast = parse(query)
+        except GraphQLError:
+            continue
+
+        type_info = TypeInfo(schema)
+        visitor = EnumsVisitor(type_info)
+        visit(document_ast, TypeInfoVisitor(type_info, visitor))
+        for name, parsed_enum in visitor.enums.items():
+            enums.setdefault(name, parsed_enum)
+
+    return [enums[name] for name in sorted(enums)]
+
+
 class AnonymousQueryError(Exception):
     def __init__(self):
         super().__init__('All queries must be named')
@@ -225,25 +350,149 @@ class InvalidQueryError(Exception):
         super().__init__(message)
 
 
+class SharedFragmentsVisitor(ParallelVisitor):
+    # Runs visitors in parallel like ParallelVisitor, but none of them enter the fragment definitions `skip` accepts
+    def __init__(self, visitors: Sequence[Visitor], skip: Callable[[FragmentDefinitionNode], bool]):
+        super().__init__(visitors)
+        self.skip = skip
+
+    def enter(self, node, *args):
+        if isinstance(node, FragmentDefinitionNode) and self.skip(node):
+            return SKIP
+
+        return super().enter(node, *args)
+
+
 class QueryParser:
-    def __init__(self, schema: GraphQLSchema):
+    def __init__(self, schema: GraphQLSchema, validation_rules: Sequence[RuleType] = None, single_pass: bool = True):
         self.schema = schema
+        self.validation_rules = specified_rules if validation_rules is None else validation_rules
+        self.single_pass = single_pass
         self.__jinja2_env = None
+        # Parsers are bound to a single schema so document hashes are enough to key validation results
+        self.__validation_cache: 'OrderedDict[str, List[GraphQLError]]' = OrderedDict()
+        # Sources of the fragments already validated and matched by parse_fragments, by name
+        self.__shared_fragments: Dict[str, str] = {}
+
+    @property
+    def shared_fragments(self) -> Dict[str, str]:
+        return dict(self.__shared_fragments)
+
+    def share_fragments(self, sources: Mapping[str, str]):
+        # Fragment definitions identical to these are skipped (not validated nor matched) in the documents parsed next,
+        # their classes are expected to be rendered once elsewhere (see DataclassesRenderer's `shared`)
+        self.__shared_fragments = dict(sources)
+
+    def validate(self, query: str, document_ast) -> List[GraphQLError]:
+        key = self.__cache_key(query)
+        errors = self.__cached_errors(key)
+        if errors is None:
+            errors = self.__validate(document_ast, self.validation_rules, self.__skip_shared(query))
+            self.__cache_errors(key, errors)
+
+        return errors
 
     def parse(self, query: str, should_validate: bool = True) -> ParsedQuery:
         document_ast = parse(query)
-        operation = get_operation_ast(document_ast)
 
-        if not operation.name:
+        # Every operation of the document is parsed in the same pass and gets its own class, named after it
+        if any(isinstance(definition, OperationDefinitionNode) and not definition.name for definition in document_ast.definitions):
             raise AnonymousQueryError()
 
+        return self.__parse(query, document_ast, should_validate, self.validation_rules, self.__skip_shared(query))
+
+    def parse_fragments(self, query: str) -> ParsedQuery:
+        # Parses and validates a document of fragments once for the whole project, then shares them. Fragments don't
+        # have to be used in this document, they are spread by the others.
+        document_ast = parse(query)
+        rules = [rule for rule in self.validation_rules if rule is not NoUnusedFragmentsRule]
+        parsed = self.__parse(query, document_ast, True, rules, lambda _node: False)
+
+        self.share_fragments({
+            definition.name.value: query[definition.loc.start:definition.loc.end]
+            for definition in document_ast.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        })
+        return parsed
+
+    def __parse(self, query: str, document_ast: DocumentNode, should_validate: bool, rules: Sequence[RuleType],
+                skip: Callable[[FragmentDefinitionNode], bool]) -> ParsedQuery:
+        type_info = TypeInfo(self.schema)
+        visitor = FieldToTypeMatcherVisitor(self.schema, type_info, query)
+
         if should_validate:
-            errors = validate(self.schema, document_ast)
+            key = self.__cache_key(query)
+            errors = self.__cached_errors(key)
+            if errors is None and self.single_pass:
+                errors = self.__validate_and_visit(document_ast, type_info, visitor, rules, skip)
+                self.__cache_errors(key, errors)
+                if errors:
+                    raise InvalidQueryError(errors)
+
+                return visitor.parsed
+
+            if errors is None:
+                errors = self.__validate(document_ast, rules, skip)
+                self.__cache_errors(key, errors)
+
             if errors:
                 raise InvalidQueryError(errors)
 
-        type_info = TypeInfo(self.schema)
-        visitor = FieldToTypeMatcherVisitor(self.schema, type_info, query)
-        visit(document_ast, TypeInfoVisitor(type_info, visitor))
+        visit(document_ast, TypeInfoVisitor(type_info, SharedFragmentsVisitor([visitor], skip)))
         result = visitor.parsed
         return result
+
+    def __skip_shared(self, query: str) -> Callable[[FragmentDefinitionNode], bool]:
+        shared = self.__shared_fragments
+
+        def skip(node: FragmentDefinitionNode) -> bool:
+            # Only definitions identical to the shared one, a document may define its own version of a fragment
+            source = shared.get(node.name.value)
+            return source is not None and node.loc is not None and query[node.loc.start:node.loc.end] == source
+
+        return skip
+
+    def __validate(self, document_ast, rules: Sequence[RuleType], skip: Callable[[FragmentDefinitionNode], bool]) -> List[GraphQLError]:
+        if not self.__shared_fragments:
+            return validate(self.schema, document_ast, rules)
+
+        assert_valid_schema(self.schema)
+        type_info = TypeInfo(self.schema)
+        context = ValidationContext(self.schema, document_ast, type_info)
+        visitors = [rule(context) for rule in rules]
+        visit(document_ast, TypeInfoVisitor(type_info, SharedFragmentsVisitor(visitors, skip)))
+        return context.errors
+
+    def __validate_and_visit(self, document_ast, type_info: TypeInfo, visitor: Visitor, rules: Sequence[RuleType],
+                             skip: Callable[[FragmentDefinitionNode], bool]) -> List[GraphQLError]:
+        # Runs the validation rules and the type matcher in a single traversal sharing one TypeInfo.
+        # The matcher goes last as ParallelVisitor stops dispatching a node once a visitor returns a value.
+        assert_valid_schema(self.schema)
+        context = ValidationContext(self.schema, document_ast, type_info)
+        visitors = [rule(context) for rule in rules]
+        try:
+            visit(document_ast, TypeInfoVisitor(type_info, SharedFragmentsVisitor([*visitors, visitor], skip)))
+        except Exception:
+            # Invalid documents can trip the matcher before every rule ran, validate alone to report all errors
+            errors = self.__validate(document_ast, rules, skip)
+            if errors:
+                return errors
+            raise
+
+        return context.errors
+
+    @staticmethod
+    def __cache_key(query: str) -> str:
+        return hashlib.sha256(query.encode()).hexdigest()
+
+    def __cached_errors(self, key: str) -> Optional[List[GraphQLError]]:
+        errors = self.__validation_cache.get(key)
+        if errors is not None:
+            self.__validation_cache.move_to_end(key)
+
+        return errors
+
+    def __cache_errors(self, key: str, errors: List[GraphQLError]):
+        self.__validation_cache[key] = errors
+        if len(self.__validation_cache) > VALIDATION_CACHE_SIZE:
+            self.__validation_cache.popitem(last=False)
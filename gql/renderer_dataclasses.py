@@ -1,15 +1,24 @@
-from graphql import GraphQLSchema
+from typing import Dict, List, Tuple
 
+from graphql import GraphQLSchema, DocumentNode
+
+from gql.clients.utils import hash_query
 from gql.config import Config
 from gql.utils_codegen import CodeChunk
-from gql.query_parser import ParsedQuery, ParsedField, ParsedObject, ParsedEnum, ParsedOperation, ParsedVariableDefinition
+from gql.selection import selection_plan
+from gql.query_parser import operation_asts, operation_documents, ParsedQuery, ParsedField, ParsedObject, ParsedEnum, ParsedOperation, ParsedVariableDefinition
+
+# Scalars whose JSON value is used as is
+PLAIN_TYPES = ('str', 'int', 'float', 'bool', 'Any')
 
 
 class DataclassesRenderer:
 
-    def __init__(self, schema: GraphQLSchema, config: Config):
+    def __init__(self, schema: GraphQLSchema, config: Config, shared: ParsedQuery = None):
         self.schema = schema
         self.config = config
+        # Fragments (and the enums they use) rendered once in config.shared_module, imported by the modules rendered
+        self.shared = shared
 
     def render(self, parsed_query: ParsedQuery):
         # We sort fragment nodes to be first and operations to be last because of dependecies
@@ -19,8 +28,14 @@ class DataclassesRenderer:
         buffer.write('from typing import Any, Callable, Mapping, List')
         buffer.write('from enum import Enum')
         buffer.write('from dataclasses import dataclass, field')
-        buffer.write('from dataclasses_json import dataclass_json')
-        buffer.write('from gql.clients import Client, AsyncIOClient')
+        # Heavy imports (dataclasses_json, marshmallow, the clients and their transports) are deferred to first use,
+        # importing many generated modules stays fast
+        runtime_imports = ['dataclass_json'] + [
+            name for name, enabled in (
+                ('datetime_field', self.shared is None), ('add_slots', self.config.slots), ('lazy_attributes', self.config.lazy)
+            ) if enabled
+        ]
+        buffer.write(f'from gql.runtime import {", ".join(runtime_imports)}')
         buffer.write('')
 
         if self.config.custom_header:
@@ -28,23 +43,77 @@ class DataclassesRenderer:
 
         buffer.write('')
 
-        self.__render_datetime_field(buffer)
+        if self.shared is None:
+            self.__render_datetime_field(buffer)
+        else:
+            buffer.write('from datetime import datetime')
+            buffer.write(f'from {self.config.shared_module} import {", ".join(self.__shared_names(parsed_query))}')
+            buffer.write('')
 
         # Enums
-        if parsed_query.enums:
-            self.__render_enum_field(buffer)
-            for enum in parsed_query.enums:
+        shared_enums = {enum.name for enum in self.shared.enums} if self.shared is not None else set()
+        enums = [enum for enum in parsed_query.enums if enum.name not in shared_enums]
+        if enums:
+            if not shared_enums:
+                self.__render_enum_field(buffer)
+            for enum in enums:
                 self.__render_enum(buffer, enum)
 
+        shared_fragments = self.__shared_fragments()
         sorted_objects = sorted(parsed_query.objects, key=lambda obj: 1 if isinstance(obj, ParsedOperation) else 0)
         for obj in sorted_objects:
-            if isinstance(obj, ParsedObject):
+            if isinstance(obj, ParsedObject) and obj.name not in shared_fragments:
                 self.__render_object(parsed_query, buffer, obj)
             elif isinstance(obj, ParsedOperation):
                 self.__render_operation(parsed_query, buffer, obj)
 
         return str(buffer)
 
+    def __shared_fragments(self) -> Dict[str, ParsedObject]:
+        if self.shared is None:
+            return {}
+
+        return {fragment.name: fragment for fragment in self.shared.objects if isinstance(fragment, ParsedObject)}
+
+    def __shared_names(self, parsed_query: ParsedQuery) -> List[str]:
+        # The shared fragments the module's classes inherit from (directly or through other fragments) and the shared
+        # enums of their fields, decoders of inherited fields reference both
+        shared_fragments = self.__shared_fragments()
+        fragments: List[str] = []
+        field_types = set()
+
+        def add_fragment(name: str):
+            if name in shared_fragments and name not in fragments:
+                fragments.append(name)
+                field_types.update(self.__item_type(field) for field in shared_fragments[name].fields)
+                for parent in shared_fragments[name].parents:
+                    add_fragment(parent)
+
+        def add_object(obj: ParsedObject):
+            for parent in obj.parents:
+                add_fragment(parent)
+            field_types.update(self.__item_type(field) for field in obj.fields)
+            for child in obj.children:
+                add_object(child)
+
+        for obj in parsed_query.objects:
+            if isinstance(obj, ParsedOperation):
+                for child in obj.children:
+                    add_object(child)
+            else:
+                add_object(obj)
+
+        helpers = ['DATETIME_FIELD', 'enum_field'] if self.shared.enums else ['DATETIME_FIELD']
+        enums = sorted(enum.name for enum in self.shared.enums if enum.name in field_types)
+        return helpers + sorted(fragments) + enums
+
+    def __enums(self, parsed_query: ParsedQuery) -> List[ParsedEnum]:
+        return parsed_query.enums + (self.shared.enums if self.shared is not None else [])
+
+    @staticmethod
+    def __item_type(field: ParsedField) -> str:
+        return field.type[len('List['):-1] if field.type.startswith('List[') else field.type
+
     @staticmethod
     def __render_enum_field(buffer: CodeChunk):
         with buffer.write_block('def enum_field(enum_type):'):
@@ -62,43 +131,60 @@ class DataclassesRenderer:
     def __render_datetime_field(buffer: CodeChunk):
         buffer.write('')
         buffer.write('from datetime import datetime')
-        buffer.write('from marshmallow import fields as marshmallow_fields')
-        buffer.write("DATETIME_FIELD = field(metadata={'dataclasses_json': {'encoder': datetime.isoformat, 'decoder': datetime.fromisoformat, 'mm_field': marshmallow_fields.DateTime(format='iso')}})")
+        buffer.write('DATETIME_FIELD = datetime_field()')
         buffer.write('')
 
-    def __render_object(self, parsed_query: ParsedQuery, buffer: CodeChunk, obj: ParsedObject):
-        class_parents = '' if not obj.parents else f'({", ".join(obj.parents)})'
-
+    def __render_class_decorators(self, buffer: CodeChunk, fragment: bool = False):
         buffer.write('@dataclass_json')
+        if fragment and self.config.slots:
+            # Fragments are only inherited from, several of them at times: the inheriting classes hold the slots
+            buffer.write('@add_slots(base=True)')
+        elif self.config.slots:
+            # Compact instances without a __dict__, for large responses. Lazy instances also hold the raw response.
+            buffer.write("@add_slots(extra=('__raw__',))" if self.config.lazy else '@add_slots')
+        if self.config.lazy:
+            buffer.write('@lazy_attributes')
         buffer.write('@dataclass')
+
+    def __render_object(self, parsed_query: ParsedQuery, buffer: CodeChunk, obj: ParsedObject, path: str = None):
+        class_parents = '' if not obj.parents else f'({", ".join(obj.parents)})'
+        # Objects rendered at the top of the module are fragments, the others are nested in an operation or fragment
+        fragment = path is None
+        path = path or obj.name
+
+        self.__render_class_decorators(buffer, fragment=fragment)
         with buffer.write_block(f'class {obj.name}{class_parents}:'):
             # render child objects
             for child_object in obj.children:
-                self.__render_object(parsed_query, buffer, child_object)
+                self.__render_object(parsed_query, buffer, child_object, path=f'{path}.{child_object.name}')
 
             # render fields
             sorted_fields = sorted(obj.fields, key=lambda f: 1 if f.nullable else 0)
             for field in sorted_fields:
                 self.__render_field(parsed_query, buffer, field)
 
-            # pass if not children or fields
-            if not (obj.children or obj.fields):
-                buffer.write('pass')
+            if obj.fields:
+                buffer.write('')
+
+            self.__render_decoder(parsed_query, buffer, obj, path)
 
         buffer.write('')
 
     def __render_operation(self, parsed_query: ParsedQuery, buffer: CodeChunk, parsed_op: ParsedOperation):
-        buffer.write('@dataclass_json')
-        buffer.write('@dataclass')
+        self.__render_class_decorators(buffer)
         with buffer.write_block(f'class {parsed_op.name}:'):
-            buffer.write('__QUERY__ = """')
-            buffer.write(parsed_query.query)
-            buffer.write('"""')
+            # The minified document holding only the fragments the operation uses is sent as is, so its hash (used for
+            # automatic persisted queries) can be computed here
+            document = operation_documents(parsed_query.query)[parsed_op.name]
+            buffer.write(f'__QUERY__ = {document!r}')
+            buffer.write(f"__QUERY_HASH__ = '{hash_query(document)}'")
+            # What the operation selects, for clients keeping a normalized entity store
+            buffer.write(f'__SELECTION__ = {self.__selection_plan(operation_asts(parsed_query.query)[parsed_op.name])!r}')
             buffer.write('')
 
             # Render children
             for child_object in parsed_op.children:
-                self.__render_object(parsed_query, buffer, child_object)
+                self.__render_object(parsed_query, buffer, child_object, path=f'{parsed_op.name}.{child_object.name}')
 
             # operation fields
             buffer.write('')
@@ -106,6 +192,14 @@ class DataclassesRenderer:
             buffer.write('errors: Any = None')
             buffer.write('')
 
+            response_obj = ParsedObject(
+                name=parsed_op.name,
+                fields=[ParsedField(name='data', type=f'{parsed_op.name}Data', nullable=True), ParsedField(name='errors', type='Any', nullable=True)],
+                children=parsed_op.children,
+            )
+            self.__render_decoder(parsed_query, buffer, response_obj, parsed_op.name)
+            buffer.write('')
+
             # Execution functions
             if parsed_op.variables:
                 vars_args = ', '.join([self.__render_variable_definition(var) for var in parsed_op.variables]) + ','
@@ -114,24 +208,202 @@ class DataclassesRenderer:
                 vars_args = ''
                 variables_dict = 'None'
 
+            # Queries can be served from the client's response cache, callers opt out or override the ttl per call
+            if parsed_op.type == 'query':
+                cache_args = ', cache: bool = True, cache_ttl: float = None'
+                cache_kwargs = ', cache=cache, cache_ttl=cache_ttl'
+            else:
+                cache_args = ''
+                cache_kwargs = ''
+
             buffer.write('@classmethod')
-            with buffer.write_block(f'def execute(cls, {vars_args} on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None):'):
-                buffer.write(f'client = Client(\'{self.config.endpoint}\')')
+            with buffer.write_block(f'def execute(cls, {vars_args} on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None{cache_args}):'):
+                buffer.write('from gql.clients import Client')
+                buffer.write(f'client = Client.shared(\'{self.config.endpoint}\')')
                 buffer.write(f'variables = {variables_dict}')
-                buffer.write('response_text = client.call(cls.__QUERY__, variables=variables, on_before_callback=on_before_callback)')
-                buffer.write('return cls.from_json(response_text)')
+                buffer.write(f'response = client.call(cls.__QUERY__, variables=variables, return_json=True, on_before_callback=on_before_callback{cache_kwargs}, query_hash=cls.__QUERY_HASH__, selection=cls.__SELECTION__)')
+                buffer.write('return cls.decode(response)')
 
             buffer.write('')
 
             buffer.write('@classmethod')
-            with buffer.write_block(f'async def execute_async(cls, {vars_args} on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None):'):
-                buffer.write(f'client = AsyncIOClient(\'{self.config.endpoint}\')')
+            with buffer.write_block(f'async def execute_async(cls, {vars_args} on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None{cache_args}):'):
+                buffer.write('from gql.clients import AsyncIOClient')
+                buffer.write(f'client = AsyncIOClient.shared(\'{self.config.endpoint}\')')
                 buffer.write(f'variables = {variables_dict}')
-                buffer.write(f'response_text = await client.call(cls.__QUERY__, variables=variables, on_before_callback=on_before_callback)')
-                buffer.write(f'return cls.from_json(response_text)')
+                buffer.write(f'response = await client.call(cls.__QUERY__, variables=variables, return_json=True, on_before_callback=on_before_callback{cache_kwargs}, query_hash=cls.__QUERY_HASH__, selection=cls.__SELECTION__)')
+                buffer.write('return cls.decode(response)')
+
+            buffer.write('')
+
+            list_paths = self.__list_paths(parsed_query, parsed_op)
+            if list_paths:
+                self.__render_stream(buffer, parsed_op, list_paths, vars_args, variables_dict)
 
             buffer.write('')
+
+    def __selection_plan(self, document_ast: DocumentNode):
+        # The operation's document as parsed for operation_documents, not parsed again from the minified text
+        return selection_plan(self.schema, document_ast, document_ast.definitions[0])
+
+    def __render_stream(self, buffer: CodeChunk, parsed_op: ParsedOperation, list_paths: List[Tuple[str, str]], vars_args: str, variables_dict: str):
+        # Large lists can be decoded item by item while the response is received instead of all at once at the end.
+        # `path` is the dotted path of a list field from the operation's data, like 'allFilms.edges'.
+        buffer.write('@staticmethod')
+        with buffer.write_block('def _stream_decoder(path: str):'):
+            for index, (list_path, decoder) in enumerate(list_paths):
+                with buffer.write_block(f"{'if' if index == 0 else 'elif'} path == '{list_path}':"):
+                    buffer.write(f'return {decoder}')
             buffer.write('')
+            buffer.write(f"raise ValueError(f'{{path}} is not a list field of {parsed_op.name}')")
+
+        buffer.write('')
+
+        for is_async in (False, True):
+            client_class, prefix = ('AsyncIOClient', 'async ') if is_async else ('Client', '')
+            buffer.write('@classmethod')
+            with buffer.write_block(f'{prefix}def execute_stream{"_async" if is_async else ""}(cls, path: str, {vars_args} on_before_callback: Callable[[Mapping[str, str], Mapping[str, str]], None] = None):'):
+                buffer.write('decode = cls._stream_decoder(path)')
+                buffer.write(f'from gql.clients import {client_class}')
+                buffer.write(f'client = {client_class}.shared(\'{self.config.endpoint}\')')
+                buffer.write(f'variables = {variables_dict}')
+                with buffer.write_block(f"{prefix}for item in client.stream(cls.__QUERY__, ['data', *path.split('.')], variables=variables, on_before_callback=on_before_callback):"):
+                    buffer.write('yield item if decode is None or item is None else decode(item)')
+
+            buffer.write('')
+
+    def __list_paths(self, parsed_query: ParsedQuery, parsed_op: ParsedOperation) -> List[Tuple[str, str]]:
+        # Dotted paths of the list fields reachable through objects from the operation's data, with their item decoders
+        data_obj = next((child for child in parsed_op.children if child.name == f'{parsed_op.name}Data'), None)
+        list_paths: List[Tuple[str, str]] = []
+
+        def collect(obj: ParsedObject, obj_path: str, prefix: str):
+            for field, owner, owner_path in self.__collect_fields(parsed_query, obj, obj_path).values():
+                decoder = self.__field_decoder(parsed_query, field, owner, owner_path)
+                if field.type.startswith('List['):
+                    list_paths.append((f'{prefix}{field.name}', decoder))
+                elif decoder is not None and decoder.endswith('.decode'):
+                    child = next(child for child in owner.children if child.name == field.type)
+                    collect(child, f'{owner_path}.{child.name}', f'{prefix}{field.name}.')
+
+        if data_obj is not None:
+            collect(data_obj, f'{parsed_op.name}.{data_obj.name}', '')
+
+        return list_paths
+
+    def __render_decoder(self, parsed_query: ParsedQuery, buffer: CodeChunk, obj: ParsedObject, path: str):
+        # Straight-line decoder from the parsed JSON response, nested classes are referenced by their qualified
+        # name as class bodies aren't visible from methods. Faster than dataclasses_json's reflective from_json.
+        fields = [
+            (field, self.__field_decoder(parsed_query, field, owner, owner_path))
+            for field, owner, owner_path in self.__collect_fields(parsed_query, obj, path).values()
+        ]
+
+        if self.config.lazy:
+            self.__render_lazy_decoder(buffer, obj, fields)
+            return
+
+        buffer.write('@classmethod')
+        with buffer.write_block(f"def decode(cls, data: Mapping[str, Any]) -> '{obj.name}':"):
+            arguments = []
+            for field, decoder in fields:
+                if decoder is None:
+                    arguments.append(f"{field.name}=data.get('{field.name}')")
+                else:
+                    arguments.append(f'{field.name}={self.__render_decode(buffer, field, decoder)}')
+
+            if not arguments:
+                buffer.write('return cls()')
+                return
+
+            with buffer.write_block('return cls('):
+                for argument in arguments:
+                    buffer.write(f'{argument},')
+            buffer.write(')')
+
+    def __render_lazy_decoder(self, buffer: CodeChunk, obj: ParsedObject, fields: List[Tuple[ParsedField, str]]):
+        # Scalars are set right away, nested objects and lists are left unset and decoded from the response kept in
+        # __raw__ by __getattr__ (only called for missing attributes) on first access, then cached on the instance.
+        lazy_fields = [(field, decoder) for field, decoder in fields if decoder is not None and self.__is_nested(field, decoder)]
+
+        buffer.write('@classmethod')
+        with buffer.write_block(f"def decode(cls, data: Mapping[str, Any]) -> '{obj.name}':"):
+            buffer.write('instance = cls.__new__(cls)')
+            if lazy_fields:
+                buffer.write('instance.__raw__ = data')
+            for field, decoder in fields:
+                if decoder is None:
+                    buffer.write(f"instance.{field.name} = data.get('{field.name}')")
+                elif not self.__is_nested(field, decoder):
+                    buffer.write(f'instance.{field.name} = {self.__render_decode(buffer, field, decoder)}')
+            buffer.write('return instance')
+
+        if not lazy_fields:
+            return
+
+        buffer.write('')
+        with buffer.write_block('def __getattr__(self, name: str):'):
+            for index, (field, decoder) in enumerate(lazy_fields):
+                with buffer.write_block(f"{'if' if index == 0 else 'elif'} name == '{field.name}':"):
+                    buffer.write(f'value = {self.__render_decode(buffer, field, decoder, source="self.__raw__")}')
+            with buffer.write_block('else:'):
+                buffer.write('raise AttributeError(name)')
+            buffer.write('')
+            buffer.write('setattr(self, name, value)')
+            buffer.write('return value')
+
+    @staticmethod
+    def __render_decode(buffer: CodeChunk, field: ParsedField, decoder: str, source: str = 'data') -> str:
+        # Writes the statements decoding a field from `source` and returns the expression holding its value
+        value = f'_{field.name}'
+        buffer.write(f"{value} = {source}.get('{field.name}')")
+        if field.type.startswith('List['):
+            buffer.write(f'_decode{value} = {decoder}')
+            return f'None if {value} is None else [None if item is None else _decode{value}(item) for item in {value}]'
+
+        return f'None if {value} is None else {decoder}({value})'
+
+    @staticmethod
+    def __is_nested(field: ParsedField, decoder: str) -> bool:
+        return field.type.startswith('List[') or decoder.endswith('.decode')
+
+    def __collect_fields(self, parsed_query: ParsedQuery, obj: ParsedObject, path: str) -> Dict[str, Tuple[ParsedField, ParsedObject, str]]:
+        # Inherited fragment fields come first and are overridden by the object's own, like dataclass fields are.
+        # Each field is kept with the class declaring it as that's where its nested classes live.
+        fragments = {
+            **self.__shared_fragments(),
+            **{fragment.name: fragment for fragment in parsed_query.objects if isinstance(fragment, ParsedObject)},
+        }
+        fields: Dict[str, Tuple[ParsedField, ParsedObject, str]] = {}
+
+        def collect(current: ParsedObject, current_path: str, seen: List[str]):
+            for parent in current.parents:
+                if parent in fragments and parent not in seen:
+                    seen.append(parent)
+                    collect(fragments[parent], parent, seen)
+
+            for field in current.fields:
+                fields[field.name] = (field, current, current_path)
+
+        collect(obj, path, [])
+        return fields
+
+    def __field_decoder(self, parsed_query: ParsedQuery, field: ParsedField, owner: ParsedObject, owner_path: str):
+        field_type = self.__item_type(field)
+        if field_type in PLAIN_TYPES:
+            return None
+
+        if field_type == 'DateTime':
+            return 'datetime.fromisoformat'
+
+        if any(enum.name == field_type for enum in self.__enums(parsed_query)):
+            return field_type
+
+        if any(child.name == field_type for child in owner.children):
+            return f'{owner_path}.{field_type}.decode'
+
+        # Custom scalars are left as they were received
+        return None
 
     @staticmethod
     def __render_variable_definition(var: ParsedVariableDefinition):
@@ -140,9 +412,8 @@ class DataclassesRenderer:
 
         return f'{var.name}: {var.type} = {var.default_value or "None"}'
 
-    @staticmethod
-    def __render_field(parsed_query: ParsedQuery, buffer: CodeChunk, field: ParsedField):
-        enum_names = [e.name for e in parsed_query.enums]
+    def __render_field(self, parsed_query: ParsedQuery, buffer: CodeChunk, field: ParsedField):
+        enum_names = [e.name for e in self.__enums(parsed_query)]
         is_enum = field.type in enum_names
         suffix = ''
         field_type = field.type
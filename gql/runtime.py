@@ -0,0 +1,104 @@
+# Helpers used by generated modules at runtime.
+# Importing generated modules should stay cheap, so dataclasses_json and marshmallow are only imported once a class
+# actually uses them (generated decode methods and clients don't).
+from dataclasses import Field, field, fields
+from datetime import datetime
+from functools import partial
+from typing import Any, List, Tuple
+
+# Classes decorated before dataclasses_json was imported, registered as its mixin's virtual subclasses once it is
+_PENDING_REGISTRATION: List[type] = []
+
+
+def _json_mixin():
+    from dataclasses_json import DataClassJsonMixin
+
+    while _PENDING_REGISTRATION:
+        DataClassJsonMixin.register(_PENDING_REGISTRATION.pop())
+    return DataClassJsonMixin
+
+
+def _json_method(name: str, is_classmethod: bool):
+    def method(self_or_cls, *args, **kwargs):
+        mixin_method = getattr(_json_mixin(), name)
+        return (mixin_method.__func__ if is_classmethod else mixin_method)(self_or_cls, *args, **kwargs)
+
+    method.__name__ = method.__qualname__ = name
+    return classmethod(method) if is_classmethod else method
+
+
+# The methods dataclasses_json.dataclass_json adds. Later 0.2.x releases implement to_json and from_json with to_dict
+# and from_dict, which older ones don't have.
+_JSON_METHODS = {
+    name: _json_method(name, is_classmethod)
+    for name, is_classmethod in (('to_json', False), ('from_json', True), ('to_dict', False), ('from_dict', True), ('schema', True))
+}
+
+
+def dataclass_json(cls):
+    # Same methods as dataclasses_json.dataclass_json, importing it on first use
+    for name, method in _JSON_METHODS.items():
+        setattr(cls, name, method)
+    _PENDING_REGISTRATION.append(cls)
+    return cls
+
+
+class _DateTimeMetadata(dict):
+    # dataclasses_json metadata building the marshmallow field (only needed by `schema()`) when it is first read
+    def __init__(self):
+        super().__init__(encoder=datetime.isoformat, decoder=datetime.fromisoformat)
+
+    def __missing__(self, key: str) -> Any:
+        if key != 'mm_field':
+            raise KeyError(key)
+
+        from marshmallow import fields as marshmallow_fields
+        self[key] = marshmallow_fields.DateTime(format='iso')
+        return self[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def __contains__(self, key) -> bool:
+        return key == 'mm_field' or super().__contains__(key)
+
+
+def datetime_field() -> Field:
+    return field(metadata={'dataclasses_json': _DateTimeMetadata()})
+
+
+def add_slots(cls=None, *, extra: Tuple[str, ...] = (), base: bool = False):
+    # Rebuilds a dataclass with __slots__ so instances don't carry a __dict__ (dataclass(slots=True) needs python 3.10).
+    # Must be applied right on top of @dataclass. Fields already slotted by a base class aren't repeated.
+    # `extra` adds slots for attributes that aren't fields. Usable as @add_slots or @add_slots(extra=..., base=...).
+    # Classes only used as bases (fragments) take `base`: they get empty __slots__ and the classes inheriting from them
+    # hold the slots, as only one of several bases may add slots to the instance layout.
+    if cls is None:
+        return partial(add_slots, extra=extra, base=base)
+
+    inherited = set()
+    for parent in cls.__mro__[1:]:
+        inherited.update(getattr(parent, '__slots__', ()))
+
+    field_names = tuple(field.name for field in fields(cls) if field.name not in inherited)
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = () if base else field_names + tuple(name for name in extra if name not in inherited)
+    for name in field_names:
+        # Defaults live in the generated __init__, the class attributes would clash with the slots
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+
+    slotted = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted.__qualname__ = cls.__qualname__
+    return slotted
+
+
+def lazy_attributes(cls):
+    # Drops the class level defaults @dataclass leaves behind, so unset fields of lazily decoded instances reach
+    # __getattr__ instead of resolving to the class attribute. The defaults still apply through __init__.
+    for dataclass_field in fields(cls):
+        if dataclass_field.name in cls.__dict__:
+            delattr(cls, dataclass_field.name)
+
+    return cls
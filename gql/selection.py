@@ -0,0 +1,119 @@
+from typing import Any, Dict, Optional, Tuple
+
+from graphql import GraphQLSchema, DocumentNode, OperationDefinitionNode, FragmentDefinitionNode, FragmentSpreadNode, \
+    FieldNode, SelectionSetNode, VariableNode, ListValueNode, ObjectValueNode, ValueNode, \
+    GraphQLObjectType, get_named_type, is_abstract_type, is_composite_type, value_from_ast_untyped
+
+from gql.clients.store import VARIABLE_MARKER
+
+# Describes what an operation selects so the clients' entity store can split responses into entities and answer
+# operations from it. Plans are plain tuples (written as literals in generated modules):
+#   selection: (type name, response key of the `id` field or None, fields)
+#   field: (response key, field name, arguments or None, selection or None for leaves)
+# Arguments are literal values where variables are replaced by ('$', variable name).
+SelectionT = Tuple[str, Optional[str], Tuple['FieldT', ...]]
+FieldT = Tuple[str, str, Optional[Dict[str, Any]], Optional[SelectionT]]
+
+
+class UnsupportedSelection(Exception):
+    pass
+
+
+def selection_plan(schema: GraphQLSchema, document_ast: DocumentNode, operation: OperationDefinitionNode) -> Optional[SelectionT]:
+    # None when the operation can't be read from the store: directives and type conditions narrower than the
+    # field's type decide at execution what is selected, and entities of an interface or union type selected without
+    # their __typename can't be keyed.
+    fragments = {
+        definition.name.value: definition
+        for definition in document_ast.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    root_type = {
+        'query': schema.query_type,
+        'mutation': schema.mutation_type,
+        'subscription': schema.subscription_type,
+    }[operation.operation.value]
+
+    try:
+        return _selection(root_type, operation.selection_set, fragments)
+    except UnsupportedSelection:
+        return None
+
+
+def _selection(parent_type: GraphQLObjectType, selection_set: SelectionSetNode, fragments: Dict[str, FragmentDefinitionNode]) -> SelectionT:
+    fields: Dict[str, FieldT] = {}
+    _collect_fields(parent_type, selection_set, fragments, fields)
+
+    id_key = next((key for key, (_, name, arguments, _) in fields.items() if name == 'id' and not arguments), None)
+    if id_key is not None and is_abstract_type(parent_type) and fields.get('__typename', (None, None))[1] != '__typename':
+        # Entities are keyed by their concrete type, which an interface or union field only gives through __typename.
+        # Keyed by the field's type instead, the same entity would be stored twice and read stale.
+        raise UnsupportedSelection()
+
+    return parent_type.name, id_key, tuple(fields.values())
+
+
+def _collect_fields(parent_type, selection_set: SelectionSetNode, fragments: Dict[str, FragmentDefinitionNode], fields: Dict[str, FieldT]):
+    for node in selection_set.selections:
+        if node.directives:
+            raise UnsupportedSelection()
+
+        if isinstance(node, FieldNode):
+            _add_field(parent_type, node, fragments, fields)
+            continue
+
+        if isinstance(node, FragmentSpreadNode):
+            fragment = fragments[node.name.value]
+            type_condition, fragment_selection_set = fragment.type_condition, fragment.selection_set
+            if fragment.directives:
+                raise UnsupportedSelection()
+        else:
+            type_condition, fragment_selection_set = node.type_condition, node.selection_set
+
+        if type_condition is not None and type_condition.name.value != parent_type.name:
+            raise UnsupportedSelection()
+
+        _collect_fields(parent_type, fragment_selection_set, fragments, fields)
+
+
+def _add_field(parent_type, node: FieldNode, fragments: Dict[str, FragmentDefinitionNode], fields: Dict[str, FieldT]):
+    name = node.name.value
+    key = node.alias.value if node.alias else name
+    arguments = {argument.name.value: _argument_value(argument.value) for argument in node.arguments} or None
+
+    selection = None
+    if node.selection_set is not None:
+        field_type = get_named_type(parent_type.fields[name].type)
+        if not is_composite_type(field_type):  # pragma: no cover (rejected by validation)
+            raise UnsupportedSelection()
+
+        selection = _selection(field_type, node.selection_set, fragments)
+        if key in fields and fields[key][3] is not None:
+            # The same field selected in several places (through fragments usually) gets the union of the selections
+            selection = _merge_selections(fields[key][3], selection)
+
+    fields[key] = (key, name, arguments, selection)
+
+
+def _merge_selections(first: SelectionT, second: SelectionT) -> SelectionT:
+    fields = {field[0]: field for field in first[2]}
+    for field in second[2]:
+        existing = fields.get(field[0])
+        if existing is not None and existing[3] is not None and field[3] is not None:
+            field = (*field[:3], _merge_selections(existing[3], field[3]))
+        fields[field[0]] = field
+
+    return first[0], first[1] or second[1], tuple(fields.values())
+
+
+def _argument_value(node: ValueNode) -> Any:
+    if isinstance(node, VariableNode):
+        return VARIABLE_MARKER, node.name.value
+
+    if isinstance(node, ListValueNode):
+        return [_argument_value(value) for value in node.values]
+
+    if isinstance(node, ObjectValueNode):
+        return {field.name.value: _argument_value(field.value) for field in node.fields}
+
+    return value_from_ast_untyped(node)
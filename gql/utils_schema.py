@@ -1,7 +1,26 @@
+import io
 import os
 import json
+import pickle
+import hashlib
+import logging
+from glob import glob
+from typing import Dict, Optional, Set, Tuple
+
 import requests
-from graphql import get_introspection_query, build_client_schema
+import graphql
+from graphql import GraphQLSchema, GraphQLNamedType, GraphQLField, TypeInfo, TypeInfoVisitor, Visitor, get_introspection_query, \
+    build_client_schema, introspection_types, specified_scalar_types, get_named_type, is_enum_type, is_input_object_type, \
+    is_interface_type, is_object_type, is_union_type, parse, visit
+
+# Bump whenever the pickled layout changes so stale cache entries are ignored
+SCHEMA_CACHE_VERSION = 1
+SCHEMA_CACHE_PATTERN = 'schema-*.pickle'
+
+# graphql-core module level singletons are pickled by name and resolved back to the same objects on load
+_BUILTIN_TYPES = {**introspection_types, **specified_scalar_types}
+
+logger = logging.getLogger(__name__)
 
 
 def load_introspection_from_server(url):
@@ -18,6 +37,242 @@ def load_introspection_from_file(filename):
         return json.load(fin)
 
 
-def load_schema(uri):
-    introspection = load_introspection_from_file(uri) if os.path.isfile(uri) else load_introspection_from_server(uri)
-    return build_client_schema(introspection)
+def schema_cache_key(source: bytes) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(f'{SCHEMA_CACHE_VERSION}:{graphql.__version__}:'.encode())
+    hasher.update(source)
+    return hasher.hexdigest()
+
+
+def schema_cache_filename(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, SCHEMA_CACHE_PATTERN.replace('*', key))
+
+
+def clear_schema_cache(cache_dir: str) -> int:
+    removed = 0
+    for filename in glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN)):
+        os.remove(filename)
+        removed += 1
+
+    return removed
+
+
+def _identity(value):
+    return value
+
+
+def _freeze_schema(schema: GraphQLSchema):
+    # build_client_schema wires types together with lambda thunks which can't be pickled.
+    # Resolve every thunk once and store the result in its place.
+    for graphql_type in schema.type_map.values():
+        if graphql_type.name in _BUILTIN_TYPES:
+            continue
+
+        for attr in ('fields', 'interfaces', 'types'):
+            if hasattr(graphql_type, f'_{attr}'):
+                setattr(graphql_type, f'_{attr}', getattr(graphql_type, attr))
+
+        serialize = getattr(graphql_type, 'serialize', None)
+        if serialize is not None and serialize.__name__ == '<lambda>':
+            graphql_type.serialize = _identity
+
+
+class _SchemaPickler(pickle.Pickler):
+    BUILTIN_IDS = {id(graphql_type): name for name, graphql_type in _BUILTIN_TYPES.items()}
+
+    def persistent_id(self, obj):  # pylint:disable=method-hidden
+        return self.BUILTIN_IDS.get(id(obj))
+
+
+class _SchemaUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return _BUILTIN_TYPES[pid]
+
+
+def dump_schema(schema: GraphQLSchema) -> bytes:
+    _freeze_schema(schema)
+    buffer = io.BytesIO()
+    _SchemaPickler(buffer, pickle.HIGHEST_PROTOCOL).dump(schema)
+    return buffer.getvalue()
+
+
+def load_dumped_schema(data: bytes) -> GraphQLSchema:
+    return _SchemaUnpickler(io.BytesIO(data)).load()
+
+
+def read_cached_schema(filename: str) -> Optional[GraphQLSchema]:
+    try:
+        with open(filename, 'rb') as fin:
+            schema = _SchemaUnpickler(fin).load()
+    except (OSError, pickle.UnpicklingError, AttributeError, EOFError, ImportError, IndexError, KeyError, TypeError,
+            ValueError):
+        # ValueError covers entries pickled with a protocol this interpreter doesn't support
+        return None
+
+    return schema if isinstance(schema, GraphQLSchema) else None
+
+
+def remove_stale_schemas(cache_dir: str, keep: str) -> int:
+    removed = 0
+    for filename in glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN)):
+        if os.path.abspath(filename) == os.path.abspath(keep):
+            continue
+
+        try:
+            os.remove(filename)
+            removed += 1
+        except OSError:
+            pass
+
+    return removed
+
+
+def write_cached_schema(filename: str, schema: GraphQLSchema):
+    # The cache is an optimization only, a failed write leaves the schema usable and the build going
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    try:
+        data = dump_schema(schema)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(tmp_filename, 'wb') as outfile:
+            outfile.write(data)
+
+        os.replace(tmp_filename, filename)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError, RecursionError) as exc:
+        logger.warning('Could not write the schema cache %s: %s', filename, exc)
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        return
+
+    # Entries for earlier versions of the schema are never read again
+    remove_stale_schemas(os.path.dirname(filename) or '.', keep=filename)
+
+
+def load_introspection_source(uri) -> bytes:
+    if os.path.isfile(uri):
+        with open(uri, 'rb') as fin:
+            return fin.read()
+
+    return json.dumps(load_introspection_from_server(uri)).encode()
+
+
+def load_schema_with_hash(uri, cache_dir: str = None) -> Tuple[GraphQLSchema, str]:
+    source = load_introspection_source(uri)
+    key = schema_cache_key(source)
+    if not cache_dir:
+        return build_client_schema(json.loads(source)), key
+
+    cache_filename = schema_cache_filename(cache_dir, key)
+    schema = read_cached_schema(cache_filename)
+    if schema is None:
+        schema = build_client_schema(json.loads(source))
+        write_cached_schema(cache_filename, schema)
+
+    return schema, key
+
+
+def load_schema(uri, cache_dir: str = None):
+    schema, _key = load_schema_with_hash(uri, cache_dir=cache_dir)
+    return schema
+
+
+def _type_signature(graphql_type: GraphQLNamedType) -> str:
+    # Everything about a type except its output fields, which get a coordinate each
+    if is_enum_type(graphql_type):
+        return f'enum:{sorted((name, repr(value.value)) for name, value in graphql_type.values.items())}'
+    if is_input_object_type(graphql_type):
+        return f'input:{sorted((name, str(input_field.type), repr(input_field.default_value)) for name, input_field in graphql_type.fields.items())}'
+    if is_union_type(graphql_type):
+        return f'union:{sorted(possible_type.name for possible_type in graphql_type.types)}'
+    if is_object_type(graphql_type):
+        return f'object:{sorted(interface.name for interface in graphql_type.interfaces)}'
+    if is_interface_type(graphql_type):
+        return 'interface'
+    return 'scalar'
+
+
+def _field_signature(graphql_field: GraphQLField) -> str:
+    args = sorted((name, str(arg.type), repr(arg.default_value)) for name, arg in graphql_field.args.items())
+    return f'{graphql_field.type}:{args}'
+
+
+def schema_coordinates(schema: GraphQLSchema) -> Dict[str, str]:
+    # Maps 'Type' and 'Type.field' coordinates to a signature of their definition
+    coordinates = {}
+    for name, graphql_type in schema.type_map.items():
+        if name.startswith('__'):
+            continue
+
+        coordinates[name] = _type_signature(graphql_type)
+        if is_object_type(graphql_type) or is_interface_type(graphql_type):
+            for field_name, graphql_field in graphql_type.fields.items():
+                coordinates[f'{name}.{field_name}'] = _field_signature(graphql_field)
+
+    for root_name in ('query', 'mutation', 'subscription'):
+        root_type = getattr(schema, f'{root_name}_type')
+        coordinates[f'schema.{root_name}'] = root_type.name if root_type else ''
+
+    return coordinates
+
+
+def diff_schemas(old_schema: GraphQLSchema, new_schema: GraphQLSchema) -> Set[str]:
+    old_coordinates = schema_coordinates(old_schema)
+    new_coordinates = schema_coordinates(new_schema)
+    return {
+        coordinate for coordinate in old_coordinates.keys() | new_coordinates.keys()
+        if old_coordinates.get(coordinate) != new_coordinates.get(coordinate)
+    }
+
+
+class SchemaUsageVisitor(Visitor):
+
+    def __init__(self, schema: GraphQLSchema, type_info: TypeInfo):
+        self.schema = schema
+        self.type_info = type_info
+        self.coordinates: Set[str] = set()
+
+    def add_type(self, graphql_type):
+        named_type = get_named_type(graphql_type)
+        if not named_type or named_type.name in self.coordinates:
+            return
+
+        self.coordinates.add(named_type.name)
+        if is_input_object_type(named_type):
+            for input_field in named_type.fields.values():
+                self.add_type(input_field.type)
+
+    def enter_operation_definition(self, node, *_args):
+        self.coordinates.add(f'schema.{node.operation.value}')
+        return node
+
+    def enter_field(self, node, *_args):
+        parent_type = self.type_info.get_parent_type()
+        if parent_type and not node.name.value.startswith('__'):
+            self.coordinates.add(f'{parent_type.name}.{node.name.value}')
+        self.add_type(self.type_info.get_type())
+        return node
+
+    def enter_argument(self, node, *_args):
+        self.add_type(self.type_info.get_input_type())
+        return node
+
+    def enter_variable_definition(self, node, *_args):
+        self.add_type(self.type_info.get_input_type())
+        return node
+
+    def enter_inline_fragment(self, node, *_args):
+        self.add_type(self.type_info.get_type())
+        return node
+
+    def enter_fragment_definition(self, node, *_args):
+        self.add_type(self.type_info.get_type())
+        return node
+
+
+def document_coordinates(schema: GraphQLSchema, query: str) -> Set[str]:
+    # Schema coordinates (see schema_coordinates) a document depends on
+    type_info = TypeInfo(schema)
+    visitor = SchemaUsageVisitor(schema, type_info)
+    visit(parse(query), TypeInfoVisitor(type_info, visitor))
+    return visitor.coordinates
@@ -0,0 +1,112 @@
+import os
+import re
+import threading
+from typing import Callable, Dict, Hashable, Pattern, Tuple
+
+MAGIC_CHARS = re.compile(r'[*?[]')
+
+
+# Splits a glob into its longest literal directory prefix and the remaining (relative) pattern
+def split_glob(pattern: str) -> Tuple[str, str]:
+    parts = pattern.replace(os.sep, '/').split('/')
+    for index, part in enumerate(parts):
+        if MAGIC_CHARS.search(part):
+            return '/'.join(parts[:index]) or '.', '/'.join(parts[index:])
+
+    return '/'.join(parts[:-1]) or '.', parts[-1]
+
+
+def _translate_segment(segment: str) -> str:
+    regex = ''
+    index = 0
+    while index < len(segment):
+        char = segment[index]
+        index += 1
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = segment.find(']', index + 1 if segment[index:index + 1] in ('!', ']') else index)
+            if end == -1:
+                regex += re.escape(char)
+                continue
+
+            body = segment[index:end].replace('\\', '\\\\')
+            index = end + 1
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += f'[{body}]'
+        else:
+            regex += re.escape(char)
+
+    # Like glob, wildcards don't match hidden files (editor swap/lock files for instance)
+    if MAGIC_CHARS.match(segment):
+        regex = r'(?!\.)' + regex
+
+    return regex
+
+
+def translate_glob(pattern: str) -> str:
+    regex = ''
+    segments = pattern.split('/')
+    for index, segment in enumerate(segments):
+        is_last = index == len(segments) - 1
+        if segment == '**':
+            regex += r'(?:(?!\.)[^/]+/)*' if not is_last else r'(?:(?!\.)[^/]+/)*(?!\.)[^/]*'
+        else:
+            regex += _translate_segment(segment) + ('' if is_last else '/')
+
+    return fr'\A{regex}\Z'
+
+
+class GlobMatcher:
+    def __init__(self, pattern: str):
+        root, rest = split_glob(pattern)
+        self.root = os.path.abspath(root)
+        self.recursive = '/' in rest
+        self.regex: Pattern = re.compile(translate_glob(rest))
+
+    def matches(self, path: str) -> bool:
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative.startswith(os.pardir):
+            return False
+
+        return bool(self.regex.match(relative.replace(os.sep, '/')))
+
+
+# Coalesces bursts of triggers for the same key into one callback, fired once the key has been quiet for `delay` seconds
+class Debouncer:
+    def __init__(self, delay: float, callback: Callable[[Hashable], None]):
+        self.delay = delay
+        self.callback = callback
+        self.__timers: Dict[Hashable, threading.Timer] = {}
+        self.__timers_lock = threading.Lock()
+        self.__callback_lock = threading.Lock()
+
+    def trigger(self, key: Hashable):
+        with self.__timers_lock:
+            timer = self.__timers.get(key)
+            if timer:
+                timer.cancel()
+
+            timer = threading.Timer(self.delay, self.__fire, args=(key,))
+            timer.daemon = True
+            self.__timers[key] = timer
+            timer.start()
+
+    def cancel(self):
+        with self.__timers_lock:
+            for timer in self.__timers.values():
+                timer.cancel()
+            self.__timers.clear()
+
+    def __fire(self, key: Hashable):
+        with self.__timers_lock:
+            if self.__timers.get(key) is not threading.current_thread():
+                return
+            del self.__timers[key]
+
+        # Callbacks share the parser and the terminal so they run one at a time
+        with self.__callback_lock:
+            self.callback(key)
@@ -1,4 +1,5 @@
 import os
+import sys
 import pytest
 from types import ModuleType
 
@@ -37,10 +38,18 @@ def github_parser(github_schema):
 
 @pytest.fixture
 def module_compiler():
+    loaded = []
+
     def load_module(code, module_name=None):
         compiled = compile(code, '', 'exec')
-        module = ModuleType(module_name or 'testmodule')
+        module = ModuleType(module_name or f'testmodule_{len(loaded)}')
+        # Registered like an imported module, dataclasses_json resolves type hints through sys.modules
+        sys.modules[module.__name__] = module
+        loaded.append(module.__name__)
         exec(compiled, module.__dict__)
         return module
 
-    return load_module
+    yield load_module
+
+    for module_name in loaded:
+        sys.modules.pop(module_name, None)
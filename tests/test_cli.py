@@ -0,0 +1,413 @@
+import os
+import json
+import threading
+import pytest
+from watchdog.events import FileModifiedEvent, FileMovedEvent
+from click.testing import CliRunner
+
+import gql.cli
+from gql.cli import cli, write_if_changed, QueryFilesHandler
+from gql.config import Config
+from gql.utils_schema import load_schema
+
+SWAPI_SCHEMA_FILENAME = os.path.join(os.path.dirname(__file__), 'fixtures/swapi-schema.graphql')
+GITHUB_SCHEMA_FILENAME = os.path.join(os.path.dirname(__file__), 'fixtures/github-schema.graphql')
+
+FILM_QUERY = """
+query GetFilm{index}($id: ID!) {{
+  film(id: $id) {{
+    title
+    director
+  }}
+}}
+"""
+
+
+@pytest.fixture
+def project(tmpdir):
+    src = tmpdir.mkdir('src')
+    for index in range(6):
+        src.join(f'get_film_{index}.graphql').write(FILM_QUERY.format(index=index))
+
+    src.join('invalid.graphql').write('query Invalid { film(id: "1") { nonExistingField } }')
+
+    config = Config(schema=SWAPI_SCHEMA_FILENAME, endpoint='http://localhost', documents=str(src.join('**/*.graphql')))
+    config.save(str(tmpdir.join('.gql.json')))
+
+    return tmpdir
+
+
+def run_cli(project, *args):
+    runner = CliRunner()
+    with project.as_cwd():
+        result = runner.invoke(cli, ['run', *args], catch_exceptions=False)
+
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_run(project):
+    output = run_cli(project)
+
+    assert output.count('Success!') == 6
+    assert output.count('Failed!') == 1
+    assert project.join('src', 'get_film_0.py').check()
+    assert not project.join('src', 'invalid.py').check()
+
+
+def test_run_multiple_operations_document(project):
+    project.join('src', 'films.graphql').write(FILM_QUERY.format(index='A') + FILM_QUERY.format(index='B'))
+    run_cli(project)
+
+    generated = project.join('src', 'films.py').read()
+    assert 'class GetFilmA:' in generated
+    assert 'class GetFilmB:' in generated
+
+
+def test_run_parallel_matches_serial(project):
+    serial_output = run_cli(project, '--no-cache', '--jobs', '1')
+    serial_files = {fname: project.join('src', fname).read() for fname in os.listdir(str(project.join('src')))}
+    for generated in project.join('src').listdir('*.py'):
+        generated.remove()
+
+    parallel_output = run_cli(project, '--no-cache', '--jobs', '3')
+    parallel_files = {fname: project.join('src', fname).read() for fname in os.listdir(str(project.join('src')))}
+
+    assert parallel_output == serial_output
+    assert parallel_files == serial_files
+
+
+def test_run_parallel_loads_schema_once(project, mocker):
+    import gql.utils_schema
+
+    # Records the process of every schema load, workers share a file with the main process
+    loads = project.join('schema_loads')
+    load_introspection_source = gql.utils_schema.load_introspection_source
+
+    def recording_load(uri):
+        with open(str(loads), 'a') as outfile:
+            outfile.write(f'{os.getpid()}\n')
+        return load_introspection_source(uri)
+
+    mocker.patch('gql.utils_schema.load_introspection_source', side_effect=recording_load)
+    run_cli(project, '--no-cache', '--jobs', '3')
+
+    assert loads.read().split() == [str(os.getpid())]
+    assert project.join('src', 'get_film_5.py').check()
+
+
+def test_run_output_sorted_by_filename(project):
+    output = run_cli(project, '--jobs', '2')
+
+    parsed_files = [line.split(' ')[1] for line in output.splitlines() if line.startswith('Parsing')]
+    assert parsed_files == sorted(parsed_files)
+
+
+def test_run_skips_unchanged_files(project):
+    run_cli(project)
+    mtime = project.join('src', 'get_film_0.py').mtime()
+
+    output = run_cli(project)
+    parsed_files = [line.split(' ')[1] for line in output.splitlines() if line.startswith('Parsing')]
+    assert [os.path.basename(fname) for fname in parsed_files] == ['invalid.graphql']
+    assert 'Regenerated 0 file(s), skipped 6 unchanged file(s)' in output
+    assert 'Failed to compile 1 file(s)' in output
+    assert project.join('src', 'get_film_0.py').mtime() == mtime
+
+
+def test_run_regenerates_changed_files(project):
+    run_cli(project)
+    project.join('src', 'get_film_1.graphql').write(FILM_QUERY.format(index=1).replace('director', 'episodeId'))
+    project.join('src', 'get_film_2.py').remove()
+
+    output = run_cli(project)
+    assert 'get_film_1.graphql ... Success!' in output
+    assert 'get_film_2.graphql ... Success!' in output
+    assert 'Regenerated 2 file(s), skipped 4 unchanged file(s)' in output
+    assert 'episodeId' in project.join('src', 'get_film_1.py').read()
+
+
+def test_run_regenerates_all_when_config_changes(project):
+    run_cli(project)
+    config = Config.load(str(project.join('.gql.json')))
+    Config(schema=config.schema, endpoint='http://elsewhere', documents=config.documents).save(str(project.join('.gql.json')))
+
+    output = run_cli(project)
+    assert 'Regenerated 6 file(s), skipped 0 unchanged file(s)' in output
+    assert 'Operation documents: 450 bytes as written, 318 bytes minified (-29%)' in output
+    assert 'http://elsewhere' in project.join('src', 'get_film_0.py').read()
+
+
+def test_run_regenerates_all_when_generator_changes(project, mocker):
+    run_cli(project)
+    assert 'skipped 6 unchanged file(s)' in run_cli(project)
+
+    # A new release (or a local edit) of the code generator changes its hash
+    mocker.patch('gql.cli.hash_generator', return_value='changed')
+    output = run_cli(project)
+    assert 'Regenerated 6 file(s), skipped 0 unchanged file(s)' in output
+
+
+def test_generator_hash_tracks_generator_sources():
+    from gql.manifest import GENERATOR_MODULES, hash_generator
+
+    assert 'gql.renderer_dataclasses' in GENERATOR_MODULES and 'gql.runtime' in GENERATOR_MODULES
+    assert hash_generator() == hash_generator()
+    assert len(hash_generator()) == 64
+
+
+def test_run_does_not_rewrite_identical_output(project):
+    run_cli(project)
+    target = project.join('src', 'get_film_0.py')
+    target.setmtime(1000000)
+
+    output = run_cli(project, '--no-cache')
+    assert output.count('Success! (unchanged)') == 6
+    assert target.mtime() == 1000000
+
+
+def test_write_if_changed(tmpdir):
+    target = tmpdir.join('out.py')
+
+    assert write_if_changed(str(target), 'a = 1')
+    assert not write_if_changed(str(target), 'a = 1')
+    assert write_if_changed(str(target), 'a = 2')
+    assert target.read() == 'a = 2'
+    assert tmpdir.listdir() == [target]
+
+
+def track_processing(handler: QueryFilesHandler, count: int) -> threading.Event:
+    # Set once the handler's debouncer has processed `count` paths
+    done = threading.Event()
+    processed = []
+    process = handler.debouncer.callback
+
+    def callback(key):
+        process(key)
+        processed.append(key)
+        if len(processed) == count:
+            done.set()
+
+    handler.debouncer.callback = callback
+    return done
+
+
+def test_watch_handler_debounces_matching_files(project, mocker):
+    process_file = mocker.patch('gql.cli.process_file')
+    config = Config.load(str(project.join('.gql.json')))
+    handler = QueryFilesHandler(config, load_schema(SWAPI_SCHEMA_FILENAME), debounce=0.05)
+    done = track_processing(handler, 2)
+
+    query_filename = str(project.join('src', 'get_film_0.graphql'))
+    for _ in range(3):
+        handler.on_any_event(FileModifiedEvent(query_filename))
+    handler.on_any_event(FileMovedEvent(str(project.join('src', '.get_film_1.graphql.tmp')), str(project.join('src', 'get_film_1.graphql'))))
+    handler.on_any_event(FileModifiedEvent(str(project.join('src', 'get_film_0.py'))))
+    handler.on_any_event(FileModifiedEvent(str(project.join('.gql.json'))))
+
+    assert done.wait(timeout=5)
+    processed = sorted(call[0][0] for call in process_file.call_args_list)
+    assert processed == [query_filename, str(project.join('src', 'get_film_1.graphql'))]
+
+
+def write_fragment_project(project):
+    fragments = project.join('src').mkdir('fragments')
+    fragments.join('planet.graphql').write('fragment PlanetFields on Planet { name }')
+    fragments.join('film.graphql').write('fragment FilmFields on Film { title planets { edges { node { ...PlanetFields } } } }')
+    project.join('src', 'get_film_fields.graphql').write('query GetFilmFields { film(id: "1") { ...FilmFields } }')
+
+
+def test_run_with_fragments_from_other_files(project):
+    write_fragment_project(project)
+
+    output = run_cli(project)
+    assert 'get_film_fields.graphql ... Success!' in output
+    assert 'fragments/planet.graphql' not in output
+    assert not project.join('src', 'fragments', 'planet.py').check()
+
+    rendered = project.join('src', 'get_film_fields.py').read()
+    assert 'fragment FilmFields on Film' in rendered
+    assert 'fragment PlanetFields on Planet' in rendered
+
+
+def test_run_reports_fragment_errors_in_their_own_file(project):
+    write_fragment_project(project)
+    planet = project.join('src', 'fragments', 'planet.graphql')
+    planet.write('# Planet fields\nfragment PlanetFields on Planet {\n  name\n  nonExistingField\n}\n')
+
+    output = run_cli(project)
+    assert 'get_film_fields.graphql ... Failed!' in output
+    assert f"Cannot query field 'nonExistingField' on type 'Planet'.\n\n{planet} (4:3)" in output
+    assert 'GraphQL request' not in output
+
+
+def test_run_regenerates_dependents_of_changed_fragments(project):
+    write_fragment_project(project)
+    run_cli(project)
+
+    project.join('src', 'fragments', 'planet.graphql').write('fragment PlanetFields on Planet { name climates }')
+
+    output = run_cli(project)
+    assert 'Regenerated 1 file(s), skipped 6 unchanged file(s)' in output
+    assert 'climates' in project.join('src', 'get_film_fields.py').read()
+
+
+def use_shared_module(project, shared_module='shared_fragments'):
+    config = Config.load(str(project.join('.gql.json')))
+    Config(schema=config.schema, endpoint=config.endpoint, documents=config.documents,
+           shared_module=shared_module).save(str(project.join('.gql.json')))
+
+
+def test_run_with_shared_fragments_module(project, monkeypatch):
+    write_fragment_project(project)
+    project.join('src', 'get_film_title.graphql').write('query GetFilmTitle { film(id: "1") { ...FilmFields } }')
+    use_shared_module(project)
+
+    output = run_cli(project)
+    assert 'shared fragments ... Success!' in output
+    shared = project.join('shared_fragments.py').read()
+    assert 'class PlanetFields' in shared
+    assert 'class FilmFields' in shared
+
+    rendered = project.join('src', 'get_film_fields.py').read()
+    assert 'from shared_fragments import DATETIME_FIELD, FilmFields' in rendered
+    assert 'class FilmFields' not in rendered
+    # The fragments are still sent along with the operation
+    assert 'fragment FilmFields on Film' in rendered
+
+    monkeypatch.syspath_prepend(str(project))
+    monkeypatch.syspath_prepend(str(project.join('src')))
+    import get_film_fields, get_film_title  # pylint:disable=import-error
+    response = {'data': {'film': {'title': 'A New Hope', 'planets': {'edges': [{'node': {'name': 'Tatooine'}}]}}}}
+    film = get_film_fields.GetFilmFields.decode(response).data.film
+    assert isinstance(film, get_film_title.FilmFields)
+    assert film.planets.edges[0].node.name == 'Tatooine'
+
+
+ISSUE_AUTHORS_QUERY = """
+query {name} {{
+  viewer {{ issues(first: 5) {{ edges {{ node {{ authorAssociation }} }} }} }}
+}}
+"""
+
+
+def test_run_with_shared_enums(tmpdir, monkeypatch):
+    # Enums only operations select are rendered once too, in the shared module
+    src = tmpdir.mkdir('src')
+    src.join('issue_authors_a.graphql').write(ISSUE_AUTHORS_QUERY.format(name='IssueAuthorsA'))
+    src.join('issue_authors_b.graphql').write(ISSUE_AUTHORS_QUERY.format(name='IssueAuthorsB'))
+    Config(schema=GITHUB_SCHEMA_FILENAME, endpoint='http://localhost', documents=str(src.join('**/*.graphql')),
+           shared_module='shared_enums').save(str(tmpdir.join('.gql.json')))
+
+    output = run_cli(tmpdir)
+    assert 'shared fragments ... Success!' in output
+    assert 'class CommentAuthorAssociation(Enum):' in tmpdir.join('shared_enums.py').read()
+    for name in ('issue_authors_a', 'issue_authors_b'):
+        rendered = src.join(f'{name}.py').read()
+        assert 'from shared_enums import DATETIME_FIELD, enum_field, CommentAuthorAssociation' in rendered
+        assert 'class CommentAuthorAssociation' not in rendered
+        assert 'def enum_field' not in rendered
+
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.syspath_prepend(str(src))
+    import issue_authors_a, issue_authors_b  # pylint:disable=import-error
+    response = {'data': {'viewer': {'issues': {'edges': [{'node': {'authorAssociation': 'OWNER'}}]}}}}
+    first = issue_authors_a.IssueAuthorsA.decode(response).data.viewer.issues.edges[0].node.authorAssociation
+    second = issue_authors_b.IssueAuthorsB.decode(response).data.viewer.issues.edges[0].node.authorAssociation
+    assert first is second is issue_authors_a.CommentAuthorAssociation.OWNER
+
+
+def test_run_parallel_with_shared_fragments_module(project):
+    write_fragment_project(project)
+    use_shared_module(project)
+
+    run_cli(project, '--no-cache', '--jobs', '1')
+    serial = project.join('src', 'get_film_fields.py').read()
+    project.join('src', 'get_film_fields.py').remove()
+
+    run_cli(project, '--no-cache', '--jobs', '3')
+    assert project.join('src', 'get_film_fields.py').read() == serial
+
+
+def test_run_without_shared_fragments_module_on_invalid_fragments(project):
+    write_fragment_project(project)
+    project.join('src', 'fragments', 'broken.graphql').write('fragment Broken on Film { nonExistingField }')
+    use_shared_module(project)
+
+    output = run_cli(project)
+    assert 'shared fragments ... Failed!' in output
+    assert f"{project.join('src', 'fragments', 'broken.graphql')} (1:27)" in output
+    assert 'get_film_fields.graphql ... Success!' in output
+    assert 'class FilmFields' in project.join('src', 'get_film_fields.py').read()
+
+
+def test_watch_handler_regenerates_fragment_dependents(project, mocker):
+    write_fragment_project(project)
+    config = Config.load(str(project.join('.gql.json')))
+    handler = QueryFilesHandler(config, load_schema(SWAPI_SCHEMA_FILENAME), debounce=0)
+    process_file = mocker.patch('gql.cli.process_file')
+
+    project.join('src', 'fragments', 'planet.graphql').write('fragment PlanetFields on Planet { name climates }')
+    handler.process(str(project.join('src', 'fragments', 'planet.graphql')))
+
+    assert [call[0][0] for call in process_file.call_args_list] == [str(project.join('src', 'get_film_fields.graphql'))]
+    assert 'climates' in process_file.call_args[1]['query']
+
+
+def test_watch_handler_reloads_schema_and_rebuilds_affected_documents(project, mocker):
+    with open(SWAPI_SCHEMA_FILENAME, 'r') as fin:
+        introspection = json.load(fin)
+    schema_file = project.join('schema.json')
+    schema_file.write(json.dumps(introspection))
+    project.join('src', 'get_planet.graphql').write('query GetPlanet { planet(id: "1") { name } }')
+
+    config = Config.load(str(project.join('.gql.json')))
+    config = Config(schema=str(schema_file), endpoint=config.endpoint, documents=config.documents)
+    handler = QueryFilesHandler(config, load_schema(str(schema_file)), debounce=0)
+
+    for graphql_type in introspection['__schema']['types']:
+        if graphql_type['name'] == 'Film':
+            graphql_type['fields'] = [field for field in graphql_type['fields'] if field['name'] != 'director']
+    schema_file.write(json.dumps(introspection))
+
+    process_file = mocker.spy(gql.cli, 'process_file')
+    done = track_processing(handler, 1)
+    handler.on_any_event(FileModifiedEvent(str(schema_file)))
+    assert done.wait(timeout=5)
+
+    processed = [os.path.basename(call[0][0]) for call in process_file.call_args_list]
+    assert processed == [f'get_film_{index}.graphql' for index in range(6)]
+    assert all(call[1]['query'] for call in process_file.call_args_list)
+    assert 'director' not in handler.schema.type_map['Film'].fields
+    assert handler.failed == {str(project.join('src', f'get_film_{index}.graphql')) for index in range(6)}
+
+
+def test_export_persisted_queries(project):
+    project.join('src', 'invalid.graphql').remove()
+    runner = CliRunner()
+    with project.as_cwd():
+        result = runner.invoke(cli, ['export-persisted-queries', '-o', 'queries.json'], catch_exceptions=False)
+        run_cli(project)
+
+    assert result.exit_code == 0, result.output
+    assert 'Exported 6 operation(s)' in result.output
+
+    manifest = json.loads(project.join('queries.json').read())
+    assert manifest['format'] == 'apollo-persisted-query-manifest'
+    assert [operation['name'] for operation in manifest['operations']] == [f'GetFilm{index}' for index in range(6)]
+
+    # The ids match the hashes generated code sends
+    operation = manifest['operations'][0]
+    assert operation['type'] == 'query'
+    assert operation['body'] == 'query GetFilm0($id:ID!){film(id:$id){title director}}'
+    assert f"__QUERY_HASH__ = '{operation['id']}'" in project.join('src', 'get_film_0.py').read()
+
+
+def test_export_persisted_queries_fails_on_invalid_documents(project):
+    runner = CliRunner()
+    with project.as_cwd():
+        result = runner.invoke(cli, ['export-persisted-queries'])
+
+    assert result.exit_code != 0
+    assert 'invalid.graphql ... Failed!' in result.output
+    assert not project.join('persisted-queries.json').check()
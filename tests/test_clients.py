@@ -0,0 +1,779 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from graphql import parse, get_operation_ast
+
+import gql.clients
+from gql.clients import Client, AsyncIOClient, BatchError, EntityStore, MemoryCache, StdlibJSONCodec, OrjsonCodec, default_codec
+from gql.clients import codec as codec_module
+from gql.clients.streaming import ListStreamParser, ResponseErrors, StreamError
+from gql.clients.utils import is_query, hash_query
+from gql.selection import selection_plan
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_clients():
+    yield
+    Client.close_shared()
+    Client._Client__shared_options.clear()  # pylint:disable=protected-access
+    AsyncIOClient._AsyncIOClient__shared_options.clear()  # pylint:disable=protected-access
+
+
+def sent_payload(post_kwargs):
+    return json.loads(post_kwargs['data'])
+
+
+def test_client_call_uses_pooled_session(mocker):
+    client = Client('http://localhost/graphql', headers={'Authorization': 'token'}, timeout=5)
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.text = '{"data": {}}'
+
+    assert client.call('query A { a }', variables={'id': 1}) == '{"data": {}}'
+    assert client.call('query A { a }') == '{"data": {}}'
+
+    assert post.call_count == 2
+    args, kwargs = post.call_args_list[0]
+    assert args == ('http://localhost/graphql',)
+    assert sent_payload(kwargs) == {'query': 'query A { a }', 'variables': {'id': 1}}
+    assert kwargs['headers']['Authorization'] == 'token'
+    assert kwargs['timeout'] == 5
+
+
+def test_client_pool_configuration():
+    client = Client('http://localhost/graphql', pool_size=3, retries=2)
+    adapter = client.session.get_adapter('http://localhost/graphql')
+
+    assert adapter._pool_maxsize == 3
+    assert adapter.max_retries.total == 2
+    assert adapter.max_retries.read is False
+
+
+def test_client_on_before_callback(mocker):
+    client = Client('http://localhost/graphql')
+    post = mocker.patch.object(client.session, 'post')
+
+    def on_before_callback(payload, headers):
+        payload['operationName'] = 'A'
+        headers['X-Trace'] = '1'
+
+    client.call('query A { a }', on_before_callback=on_before_callback)
+
+    kwargs = post.call_args[1]
+    assert sent_payload(kwargs)['operationName'] == 'A'
+    assert kwargs['headers']['X-Trace'] == '1'
+
+
+def test_shared_client_per_endpoint():
+    first = Client.shared('http://localhost/graphql', timeout=1)
+    second = Client.shared('http://localhost/graphql', timeout=2)
+    other = Client.shared('http://elsewhere/graphql')
+
+    assert first is second
+    assert first.timeout == 1
+    assert other is not first
+
+
+def test_shared_client_configure():
+    Client.configure('http://localhost/graphql', timeout=3, pool_size=4)
+
+    client = Client.shared('http://localhost/graphql')
+    assert client.timeout == 3
+    assert client.session.get_adapter('http://localhost/graphql')._pool_maxsize == 4
+    assert Client.shared('http://elsewhere/graphql').timeout is None
+
+
+def test_shared_client_rebuilt_with_its_settings_after_fork(mocker):
+    parent = Client.shared('http://localhost/graphql', timeout=1)
+
+    # A forked child sees another pid, it gets its own client (and pool) configured like the parent's
+    mocker.patch('os.getpid', return_value=os.getpid() + 1)
+    child = Client.shared('http://localhost/graphql')
+    assert child is not parent
+    assert child.timeout == 1
+    assert Client.shared('http://localhost/graphql') is child
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_shared_client_per_loop_and_endpoint():
+    async def get_clients():
+        first = AsyncIOClient.shared('http://localhost/graphql', limit=5)
+        second = AsyncIOClient.shared('http://localhost/graphql')
+        other = AsyncIOClient.shared('http://elsewhere/graphql')
+        await AsyncIOClient.close_shared()
+        return first, second, other
+
+    first, second, other = run_async(get_clients())
+    assert first is second
+    assert first.limit == 5
+    assert other is not first
+
+    next_loop_client, _, _ = run_async(get_clients())
+    assert next_loop_client is not first
+
+
+def test_async_shared_client_configured_outside_the_loop():
+    registry = AsyncIOClient._AsyncIOClient__shared  # pylint:disable=protected-access
+    AsyncIOClient.configure('http://localhost/graphql', limit=200, timeout=10, batch_window=0.005)
+
+    # Settings given to shared() before the loop runs apply to the clients of the loops run later too
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        AsyncIOClient.shared('http://elsewhere/graphql', limit=50)
+        # Nothing is scheduled on a loop that isn't running
+        assert not asyncio.all_tasks(loop)
+    finally:
+        registry.pop(loop, None)
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    async def get_clients():
+        return AsyncIOClient.shared('http://localhost/graphql'), AsyncIOClient.shared('http://elsewhere/graphql')
+
+    client, other = asyncio.run(get_clients())
+    assert (client.limit, client.timeout, client.batch_window) == (200, 10, 0.005)
+    assert other.limit == 50
+    assert not registry
+
+
+def test_async_shared_clients_released_with_their_loop():
+    registry = AsyncIOClient._AsyncIOClient__shared  # pylint:disable=protected-access
+    sessions = []
+
+    async def open_session():
+        sessions.append(AsyncIOClient.shared('http://localhost/graphql').session)
+        assert len(registry) == 1
+
+    # asyncio.run shuts the loop's async generators down before closing it, the shared clients are closed then
+    for _ in range(5):
+        asyncio.run(open_session())
+        assert not registry
+
+    assert all(session.closed for session in sessions)
+
+    # Loops closed without that step are dropped the next time a shared client is needed
+    async def get_client():
+        AsyncIOClient.shared('http://localhost/graphql')
+
+    for _ in range(3):
+        run_async(get_client())
+
+    assert len(registry) == 1
+    asyncio.run(open_session())
+    assert not registry
+
+
+def test_async_client_session_configuration():
+    async def open_session():
+        async with AsyncIOClient('http://localhost/graphql', limit=7, limit_per_host=3, dns_cache_ttl=60, timeout=2) as client:
+            session = client.session
+            assert client.session is session
+            assert session.connector.limit == 7
+            assert session.connector.limit_per_host == 3
+            assert session.connector.use_dns_cache
+            assert session.timeout.total == 2
+
+        return session
+
+    session = run_async(open_session())
+    assert session.closed
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.__text = text
+
+    async def json(self):
+        return json.loads(self.__text)
+
+    async def read(self):
+        return self.__text.encode('utf-8')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    async def text(self):
+        return self.__text
+
+
+def test_async_client_call(mocker):
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql') as client:
+            post = mocker.patch.object(client.session, 'post', return_value=FakeResponse('{"data": {}}'))
+            result = await client.call('query A { a }', variables={'id': 1})
+            return result, post
+
+    result, post = run_async(call())
+    assert result == '{"data": {}}'
+    assert sent_payload(post.call_args[1]) == {'query': 'query A { a }', 'variables': {'id': 1}}
+
+
+def batch_echo_post(requests):
+    def post(_endpoint, **kwargs):
+        payloads = sent_payload(kwargs)
+        requests.append(payloads)
+        return FakeResponse(json.dumps([{'data': {'id': payload['variables']['id']}} for payload in payloads]))
+
+    return post
+
+
+def test_async_client_batches_concurrent_calls(mocker):
+    requests = []
+
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql', batch_window=0.01, max_batch_size=3) as client:
+            mocker.patch.object(client.session, 'post', side_effect=batch_echo_post(requests))
+            return await asyncio.gather(*[
+                client.call('query A($id: Int) { a(id: $id) }', variables={'id': index}, return_json=bool(index % 2))
+                for index in range(5)
+            ])
+
+    results = run_async(call())
+    assert [len(batch) for batch in requests] == [3, 2]
+    assert json.loads(results[0]) == {'data': {'id': 0}}
+    assert results[1] == {'data': {'id': 1}}
+    assert [json.loads(result)['data']['id'] if isinstance(result, str) else result['data']['id'] for result in results] == list(range(5))
+
+
+def test_async_client_batch_size_mismatch(mocker):
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql', batch_window=0.01) as client:
+            mocker.patch.object(client.session, 'post', return_value=FakeResponse('[]'))
+            return await client.call('query A { a }')
+
+    with pytest.raises(BatchError):
+        run_async(call())
+
+
+@pytest.mark.parametrize('document, expected', [
+    ('query A { a }', True),
+    ('{ a }', True),
+    ('query A { ...F } fragment F on T { b }', True),
+    ('fragment query on T { a } query A { ...query }', True),
+    ('# mutation\nquery A { a(text: "mutation { b }") }', True),
+    ('mutation M { a }', False),
+    ('subscription S { a }', False),
+    ('query A { a } mutation M { b }', False),
+    ('fragment F on T { a }', False),
+])
+def test_is_query(document, expected):
+    assert is_query(document) is expected
+
+
+def slow_echo_post(requests, delay=0.01):
+    async def respond(payload):
+        await asyncio.sleep(delay)
+        return json.dumps({'data': payload.get('variables')})
+
+    class SlowResponse(FakeResponse):
+        def __init__(self, payload):
+            super().__init__(None)
+            self.payload = payload
+
+        async def text(self):
+            return await respond(self.payload)
+
+        async def json(self):
+            return json.loads(await self.text())
+
+        async def read(self):
+            return (await self.text()).encode('utf-8')
+
+    def post(_endpoint, **kwargs):
+        requests.append(sent_payload(kwargs))
+        return SlowResponse(sent_payload(kwargs))
+
+    return post
+
+
+def test_async_client_deduplicates_concurrent_queries(mocker):
+    requests = []
+
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql') as client:
+            mocker.patch.object(client.session, 'post', side_effect=slow_echo_post(requests))
+            results = await asyncio.gather(
+                client.call('query A($id: Int) { a(id: $id) }', variables={'id': 1}),
+                client.call('query A($id: Int) { a(id: $id) }', variables={'id': 1}),
+                client.call('query A($id: Int) { a(id: $id) }', variables={'id': 2}),
+                client.call('mutation M($id: Int) { m(id: $id) }', variables={'id': 1}),
+                client.call('mutation M($id: Int) { m(id: $id) }', variables={'id': 1}),
+            )
+            # Nothing is cached once the request completed
+            results.append(await client.call('query A($id: Int) { a(id: $id) }', variables={'id': 1}))
+            return results
+
+    results = run_async(call())
+    assert len(requests) == 5
+    assert results == [
+        '{"data": {"id": 1}}', '{"data": {"id": 1}}', '{"data": {"id": 2}}',
+        '{"data": {"id": 1}}', '{"data": {"id": 1}}', '{"data": {"id": 1}}',
+    ]
+
+
+def test_async_client_deduplication_can_be_disabled(mocker):
+    requests = []
+
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql', deduplicate=False) as client:
+            mocker.patch.object(client.session, 'post', side_effect=slow_echo_post(requests))
+            await asyncio.gather(*[client.call('query A { a }') for _ in range(3)])
+
+    run_async(call())
+    assert len(requests) == 3
+
+
+def test_client_deduplicates_concurrent_queries(mocker):
+    client = Client('http://localhost/graphql')
+    release = threading.Event()
+
+    def post(_endpoint, **kwargs):
+        release.wait(1)
+        response = mocker.Mock()
+        response.text = json.dumps(sent_payload(kwargs))
+        return response
+
+    post = mocker.patch.object(client.session, 'post', side_effect=post)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(client.call, 'query A { a }') for _ in range(3)]
+        futures.append(executor.submit(client.call, 'mutation M { m }'))
+        while post.call_count < 2:
+            release.wait(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert post.call_count == 2
+    assert results[:3] == ['{"query": "query A { a }"}'] * 3
+
+
+def test_client_deduplicated_errors_are_shared(mocker):
+    client = Client('http://localhost/graphql')
+    release = threading.Event()
+
+    def post(_endpoint, **_kwargs):
+        release.wait(1)
+        raise ConnectionError('down')
+
+    mocker.patch.object(client.session, 'post', side_effect=post)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(client.call, 'query A { a }') for _ in range(2)]
+        release.wait(0.05)
+        release.set()
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result()
+
+
+def test_memory_cache_lru_eviction():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+    assert cache.stats.evictions == 1
+    assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+    assert cache.stats.hit_rate == 0.75
+
+
+def test_memory_cache_size_bound():
+    cache = MemoryCache(max_bytes=10)
+    cache.set('a', 'x' * 4)
+    cache.set('b', 'y' * 4)
+    cache.set('c', 'z' * 4)
+    cache.set('huge', 'w' * 11)
+
+    assert len(cache) == 2
+    assert cache.size == 8
+    assert cache.get('a') is None
+    assert cache.get('huge') is None
+
+
+def test_memory_cache_ttl(mocker):
+    now = mocker.patch('gql.clients.cache.time.monotonic', return_value=100)
+    cache = MemoryCache(ttl=10)
+    cache.set('a', '1')
+    cache.set('b', '2', ttl=30)
+
+    now.return_value = 111
+    assert cache.get('a') is None
+    assert cache.get('b') == '2'
+    assert cache.stats.expirations == 1
+    assert len(cache) == 1
+
+
+def test_client_caches_query_responses(mocker):
+    cache = MemoryCache()
+    client = Client('http://localhost/graphql', cache=cache)
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.text = '{"data": {"a": 1}}'
+
+    assert client.call('query A { a }') == '{"data": {"a": 1}}'
+    assert client.call('query A { a }') == '{"data": {"a": 1}}'
+    assert client.call('query A { a }', return_json=True) == {'data': {'a': 1}}
+    assert post.call_count == 1
+
+    client.call('query A { a }', variables={'id': 1})
+    client.call('query A { a }', cache=False)
+    client.call('mutation M { m }')
+    client.call('mutation M { m }')
+    assert post.call_count == 5
+    assert len(cache) == 2
+
+
+def test_client_doesnt_cache_errors(mocker):
+    client = Client('http://localhost/graphql', cache=MemoryCache())
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.text = '{"data": null, "errors": [{"message": "boom"}]}'
+
+    client.call('query A { a }')
+    client.call('query A { a }')
+    assert post.call_count == 2
+
+
+def test_async_client_caches_query_responses(mocker):
+    requests = []
+
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql', cache=MemoryCache()) as client:
+            mocker.patch.object(client.session, 'post', side_effect=slow_echo_post(requests))
+            first = await client.call('query A($id: Int) { a(id: $id) }', variables={'id': 1}, return_json=True)
+            second = await client.call('query A($id: Int) { a(id: $id) }', variables={'id': 1}, return_json=True)
+            return first, second, client.cache.stats
+
+    first, second, stats = run_async(call())
+    assert len(requests) == 1
+    assert first == second == {'data': {'id': 1}}
+    assert first is not second
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+def apq_post(requests, known):
+    # Fake APQ server: knows the hashes in `known` and registers the queries it is sent
+    def post(_endpoint, **kwargs):
+        payload = sent_payload(kwargs)
+        requests.append(payload)
+        query_hash = payload['extensions']['persistedQuery']['sha256Hash']
+        if 'query' in payload:
+            known.add(query_hash)
+        elif query_hash not in known:
+            return FakeResponse('{"errors": [{"message": "PersistedQueryNotFound"}]}')
+
+        return FakeResponse('{"data": {"a": 1}}')
+
+    return post
+
+
+def test_async_client_persisted_queries(mocker):
+    requests = []
+    known = set()
+
+    async def call():
+        async with AsyncIOClient('http://localhost/graphql', persisted_queries=True) as client:
+            mocker.patch.object(client.session, 'post', side_effect=apq_post(requests, known))
+            first = await client.call('query A { a }', return_json=True)
+            second = await client.call('query A { a }', return_json=True)
+            return first, second
+
+    first, second = run_async(call())
+    assert first == second == {'data': {'a': 1}}
+    assert ['query' in payload for payload in requests] == [False, True, False]
+    assert requests[0]['extensions']['persistedQuery'] == {'version': 1, 'sha256Hash': hash_query('query A { a }')}
+
+
+def test_client_persisted_queries_uses_given_hash(mocker):
+    client = Client('http://localhost/graphql', persisted_queries=True)
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.text = '{"data": {"a": 1}}'
+
+    assert client.call('query A { a }', query_hash='abc') == '{"data": {"a": 1}}'
+    assert sent_payload(post.call_args[1]) == {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': 'abc'}}}
+
+
+def test_client_persisted_queries_not_supported(mocker):
+    client = Client('http://localhost/graphql', persisted_queries=True)
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.text = '{"errors": [{"message": "x", "extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}]}'
+
+    client.call('query A { a }')
+    assert sent_payload(post.call_args[1]) == {'query': 'query A { a }'}
+    assert not client.persisted_queries
+
+
+@pytest.mark.parametrize('codec_class', [StdlibJSONCodec, OrjsonCodec])
+def test_codecs_round_trip(codec_class):
+    if codec_class is OrjsonCodec and codec_module.orjson is None:
+        pytest.skip('orjson is not installed')
+
+    codec = codec_class()
+    payload = {'query': 'query A { a }', 'variables': {'name': 'Luke ✨', 'ids': [1, 2]}}
+    encoded = codec.dumps(payload)
+
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == payload
+    assert codec.loads(encoded.decode('utf-8')) == payload
+
+
+def test_default_codec_falls_back_to_stdlib(mocker):
+    mocker.patch.object(codec_module, 'orjson', None)
+    assert isinstance(default_codec(), StdlibJSONCodec)
+    with pytest.raises(ImportError):
+        OrjsonCodec()
+
+
+def test_transports_are_imported_on_first_use():
+    script = (
+        'import sys; import gql.clients; loaded = lambda: [name for name in ("requests", "aiohttp") if name in sys.modules]; '
+        'print(loaded()); gql.clients.Client; print(loaded()); from gql.clients import AsyncIOClient; print(loaded())'
+    )
+    env = {**os.environ, 'PYTHONPATH': os.path.dirname(os.path.dirname(__file__))}
+    output = subprocess.run([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE, check=True).stdout
+    assert output.decode().split('\n')[:3] == ["[]", "['requests']", "['requests', 'aiohttp']"]
+
+    with pytest.raises(AttributeError):
+        gql.clients.NoSuchClient  # pylint:disable=pointless-statement
+
+
+def test_client_decodes_response_bytes_with_codec(mocker):
+    codec = mocker.Mock(wraps=StdlibJSONCodec())
+    client = Client('http://localhost/graphql', codec=codec)
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.content = b'{"data": {"a": 1}}'
+
+    assert client.call('query A { a }', variables={'id': 1}, return_json=True) == {'data': {'a': 1}}
+    codec.dumps.assert_called_once_with({'query': 'query A { a }', 'variables': {'id': 1}})
+    codec.loads.assert_called_once_with(b'{"data": {"a": 1}}')
+
+
+def split_randomly(data, seed):
+    rand = random.Random(seed)
+    chunks = []
+    while data:
+        size = rand.randint(1, 8)
+        chunks.append(data[:size])
+        data = data[size:]
+    return chunks
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_list_stream_parser(seed):
+    document = {
+        'data': {
+            'skip': [{'edges': [1]}],
+            'all': {'edges': [{'node': {'name': 'Luke "\\\\ ]}', 'tags': ['a', None]}}, None, 3.5, 'x,y', True, []]},
+        },
+        'errors': [{'message': 'partial'}],
+    }
+    parser = ListStreamParser([('data', 'all', 'edges'), ('errors',)])
+
+    elements = []
+    for chunk in split_randomly(json.dumps(document, indent=1).encode('utf-8'), seed):
+        elements.extend(parser.feed(chunk))
+    elements.extend(parser.close())
+
+    assert elements == [
+        *((('data', 'all', 'edges'), edge) for edge in document['data']['all']['edges']),
+        (('errors',), {'message': 'partial'}),
+    ]
+
+
+def test_list_stream_parser_incomplete_document():
+    parser = ListStreamParser([('data', 'all')])
+    assert parser.feed(b'{"data": {"all": [1, 2') == [(('data', 'all'), 1)]
+    with pytest.raises(StreamError):
+        parser.close()
+
+
+class FakeStreamResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.content = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    async def iter_chunked(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+STREAMED_RESPONSE = split_randomly(b'{"data": {"all": {"edges": [{"id": 1}, {"id": 2}, null]}}}', seed=0)
+
+
+def test_client_stream(mocker):
+    client = Client('http://localhost/graphql')
+    post = mocker.patch.object(client.session, 'post', return_value=FakeStreamResponse(STREAMED_RESPONSE))
+
+    items = client.stream('query A { all { edges { id } } }', ['data', 'all', 'edges'], variables={'first': 3})
+
+    assert list(items) == [{'id': 1}, {'id': 2}, None]
+    kwargs = post.call_args[1]
+    assert kwargs['stream'] is True
+    assert sent_payload(kwargs) == {'query': 'query A { all { edges { id } } }', 'variables': {'first': 3}}
+
+
+def test_client_stream_raises_response_errors(mocker):
+    client = Client('http://localhost/graphql')
+    mocker.patch.object(client.session, 'post', return_value=FakeStreamResponse([
+        b'{"data": {"all": [1, 2]}, "errors": [{"message": "Too many"}]}',
+    ]))
+
+    items = []
+    with pytest.raises(ResponseErrors) as error:
+        for item in client.stream('query A { all }', ['data', 'all']):
+            items.append(item)
+
+    assert items == [1, 2]
+    assert error.value.errors == [{'message': 'Too many'}]
+
+
+def test_async_client_stream(mocker):
+    async def stream():
+        async with AsyncIOClient('http://localhost/graphql') as client:
+            post = mocker.patch.object(client.session, 'post', return_value=FakeStreamResponse(STREAMED_RESPONSE))
+            items = [item async for item in client.stream('query A { all { edges { id } } }', ['data', 'all', 'edges'])]
+            return items, post.call_args[1]
+
+    items, kwargs = run_async(stream())
+    assert items == [{'id': 1}, {'id': 2}, None]
+    assert sent_payload(kwargs) == {'query': 'query A { all { edges { id } } }'}
+
+
+def store_plan(schema, query):
+    document_ast = parse(query)
+    return selection_plan(schema, document_ast, get_operation_ast(document_ast))
+
+
+FILM_QUERY = 'query GetFilm($id: ID!) { film(id: $id) { id title director } }'
+
+
+def test_entity_store_merges_entities(swapi_schema):
+    store = EntityStore()
+    film = store_plan(swapi_schema, FILM_QUERY)
+    films = store_plan(swapi_schema, 'query AllFilms { allFilms { edges { node { id title } } } }')
+
+    store.write(film, {'film': {'id': '1', 'title': 'A New Hope', 'director': 'George Lucas'}}, {'id': '1'})
+    edges = [{'node': {'id': '1', 'title': 'Episode IV'}}, {'node': {'id': '2', 'title': 'Episode V'}}]
+    store.write(films, {'allFilms': {'edges': edges}})
+
+    # The film's title was updated by the second response, its director kept from the first
+    assert store.read(film, {'id': '1'}) == {'film': {'id': '1', 'title': 'Episode IV', 'director': 'George Lucas'}}
+    assert store.read(store_plan(swapi_schema, 'query T { film(id: "1") { title } }')) == {'film': {'title': 'Episode IV'}}
+    assert store.read(films) == {'allFilms': {'edges': edges}}
+
+    # Fields or arguments that were never received aren't answered
+    assert store.read(film, {'id': '2'}) is None
+    assert store.read(store_plan(swapi_schema, 'query T { film(id: "1") { title episodeId } }')) is None
+    assert store.stats.hits == 3
+    assert store.stats.misses == 2
+
+
+def test_entity_store_eviction(swapi_schema):
+    store = EntityStore(max_records=4)
+    film = store_plan(swapi_schema, FILM_QUERY)
+
+    for film_id in ('1', '2', '3'):
+        store.write(film, {'film': {'id': film_id, 'title': 'Title', 'director': 'George Lucas'}}, {'id': film_id})
+
+    # Each film is a root field and an entity
+    assert len(store) == 4
+    assert store.stats.evictions == 2
+    assert store.read(film, {'id': '1'}) is None
+    assert store.read(film, {'id': '3'}) is not None
+
+    store.evict('Film', '3')
+    assert store.read(film, {'id': '3'}) is None
+
+
+def test_entity_store_entities_through_interface_fields(github_schema):
+    store = EntityStore()
+    owner = store_plan(github_schema, 'query O { repositoryOwner(login: "u") { __typename id login } }')
+    user = store_plan(github_schema, 'query U { user(login: "u") { id login } }')
+
+    # The same user reached through an interface field and a concrete one is a single entity
+    store.write(owner, {'repositoryOwner': {'__typename': 'User', 'id': 'U1', 'login': 'old'}})
+    store.write(user, {'user': {'id': 'U1', 'login': 'new'}})
+    # Both root fields refer to one User record
+    assert len(store) == 3
+    assert store.read(owner) == {'repositoryOwner': {'__typename': 'User', 'id': 'U1', 'login': 'new'}}
+    assert store.read(user) == {'user': {'id': 'U1', 'login': 'new'}}
+
+    store.write(owner, {'repositoryOwner': {'__typename': 'User', 'id': 'U1', 'login': 'newest'}})
+    assert store.read(user) == {'user': {'id': 'U1', 'login': 'newest'}}
+
+
+def test_client_answers_queries_from_entity_store(mocker, swapi_schema):
+    client = Client('http://localhost/graphql', store=EntityStore())
+    post = mocker.patch.object(client.session, 'post')
+    post.return_value.content = b'{"data": {"film": {"id": "1", "title": "A New Hope", "director": "George Lucas"}}}'
+    film = store_plan(swapi_schema, FILM_QUERY)
+
+    first = client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film)
+    assert client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film) == first
+    assert json.loads(client.call(FILM_QUERY, variables={'id': '1'}, selection=film)) == first
+    assert post.call_count == 1
+
+    client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film, cache=False)
+    client.call(FILM_QUERY, variables={'id': '1'}, return_json=True)
+    assert post.call_count == 3
+
+    # Mutations update the entities they return
+    mutation = 'mutation M { updateFilm { id title } }'
+    post.return_value.content = b'{"data": {"updateFilm": {"id": "1", "title": "Star Wars"}}}'
+    client.call(mutation, return_json=True, selection=('Mutation', None, (('updateFilm', 'updateFilm', None, ('Film', 'id', (
+        ('id', 'id', None, None), ('title', 'title', None, None),
+    ))),)))
+    assert client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film)['data']['film']['title'] == 'Star Wars'
+    assert post.call_count == 4
+
+
+def test_async_client_answers_queries_from_entity_store(mocker, swapi_schema):
+    film = store_plan(swapi_schema, FILM_QUERY)
+
+    async def call_twice():
+        async with AsyncIOClient('http://localhost/graphql', store=EntityStore()) as client:
+            post = mocker.patch.object(client.session, 'post', return_value=FakeResponse('{"data": {"film": {"id": "1", "title": "A New Hope", "director": "George Lucas"}}}'))
+            first = await client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film)
+            second = await client.call(FILM_QUERY, variables={'id': '1'}, return_json=True, selection=film)
+            return first, second, post.call_count
+
+    first, second, call_count = run_async(call_twice())
+    assert first == second
+    assert call_count == 1
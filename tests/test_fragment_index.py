@@ -0,0 +1,99 @@
+from graphql import GraphQLError
+
+from gql.fragment_index import FragmentIndex
+
+PLANET_FRAGMENT = """
+fragment PlanetFields on Planet {
+  name
+}
+"""
+
+CHARACTER_FRAGMENT = """
+fragment CharacterFields on Person {
+  name
+  homeworld { ...PlanetFields }
+}
+"""
+
+GET_PERSON_QUERY = """
+query GetPerson {
+  person(id: "luke") { ...CharacterFields }
+}
+"""
+
+GET_PLANET_QUERY = """
+query GetPlanet {
+  planet(id: "tatooine") { ...PlanetFields }
+}
+"""
+
+
+def build_index():
+    index = FragmentIndex()
+    index.update('planet.graphql', PLANET_FRAGMENT)
+    index.update('character.graphql', CHARACTER_FRAGMENT)
+    index.update('get_person.graphql', GET_PERSON_QUERY)
+    index.update('get_planet.graphql', GET_PLANET_QUERY)
+    return index
+
+
+def test_fragment_index_definitions():
+    index = build_index()
+
+    assert index.defined_in('character.graphql') == {'CharacterFields'}
+    assert index.has_operations('get_person.graphql')
+    assert not index.has_operations('planet.graphql')
+    assert index.fragment('PlanetFields').filename == 'planet.graphql'
+
+
+def test_fragment_index_external_fragments_in_dependency_order():
+    index = build_index()
+
+    fragments = index.external_fragments('get_person.graphql')
+    assert [fragment.name for fragment in fragments] == ['PlanetFields', 'CharacterFields']
+
+    source = index.document_source('get_person.graphql')
+    assert source.index('query GetPerson') < source.index('fragment PlanetFields') < source.index('fragment CharacterFields')
+
+
+def test_fragment_index_source_map_locates_errors():
+    index = build_index()
+    source, source_map = index.document_source_map('get_person.graphql')
+    assert source == index.document_source('get_person.graphql')
+
+    # Errors in the combined document point into the file the definition was read from
+    error = source_map.locate(GraphQLError('Error', positions=[source.index('homeworld')]))
+    assert error.source.name == 'character.graphql'
+    assert error.locations[0].line == 4
+    assert error.locations[0].column == 3
+
+    error = source_map.locate(GraphQLError('Error', positions=[source.index('person')]))
+    assert error.source.name == 'get_person.graphql'
+    assert error.locations[0].line == 3
+
+
+def test_fragment_index_transitive_dependents():
+    index = build_index()
+
+    assert index.dependents({'PlanetFields'}) == {'character.graphql', 'get_person.graphql', 'get_planet.graphql'}
+    assert index.dependents({'CharacterFields'}) == {'get_person.graphql'}
+    assert index.dependents({'Unknown'}) == set()
+
+
+def test_fragment_index_update_and_remove():
+    index = build_index()
+
+    index.update('get_planet.graphql', 'query GetPlanet { planet(id: "tatooine") { name } }')
+    assert index.dependents({'PlanetFields'}) == {'character.graphql', 'get_person.graphql'}
+
+    index.remove('character.graphql')
+    assert index.fragment('CharacterFields') is None
+    assert index.external_fragments('get_person.graphql') == []
+
+
+def test_fragment_index_tolerates_syntax_errors():
+    index = FragmentIndex()
+    index.update('broken.graphql', 'query Broken { ')
+
+    assert index.defined_in('broken.graphql') == set()
+    assert index.document_source('broken.graphql') == 'query Broken { '
@@ -1,7 +1,8 @@
 import pytest
 from deepdiff import DeepDiff
 from dataclasses import asdict
-from gql.query_parser import QueryParser, ParsedQuery, ParsedOperation, ParsedObject, ParsedEnum, ParsedField, ParsedVariableDefinition, AnonymousQueryError, InvalidQueryError
+from gql.query_parser import QueryParser, ParsedQuery, ParsedOperation, ParsedObject, ParsedEnum, ParsedField, ParsedVariableDefinition, AnonymousQueryError, InvalidQueryError, TRUSTED_VALIDATION_RULES, \
+    operation_documents
 
 
 def test_parser_fails_on_nameless_op(swapi_schema):
@@ -565,3 +566,188 @@ def test_parser_mutation(swapi_schema):
 
     assert bool(parsed)
     assert parsed_dict == expected, str(DeepDiff(parsed_dict, expected))
+
+
+def validation_calls(mocker):
+    from gql import query_parser
+    validate_spy = mocker.spy(query_parser, 'validate')
+    single_pass_spy = mocker.spy(query_parser, 'ValidationContext')
+    return lambda: validate_spy.call_count + single_pass_spy.call_count
+
+
+@pytest.mark.parametrize('single_pass', [True, False])
+def test_parser_caches_validation(swapi_schema, mocker, single_pass):
+    count_calls = validation_calls(mocker)
+    query = """
+        query GetFilm {
+          film(id: "1") { title }
+        }
+    """
+
+    parser = QueryParser(swapi_schema, single_pass=single_pass)
+    first = parser.parse(query)
+    second = parser.parse(query)
+
+    assert count_calls() == 1
+    assert asdict(first) == asdict(second)
+
+
+@pytest.mark.parametrize('single_pass', [True, False])
+def test_parser_caches_validation_errors(swapi_schema, mocker, single_pass):
+    count_calls = validation_calls(mocker)
+    query = 'query ShouldFail { film(id: "1") { nonExistingField } }'
+
+    parser = QueryParser(swapi_schema, single_pass=single_pass)
+    with pytest.raises(InvalidQueryError):
+        parser.parse(query)
+    calls = count_calls()
+
+    with pytest.raises(InvalidQueryError):
+        parser.parse(query)
+    assert count_calls() == calls
+
+
+def test_parser_single_pass_matches_two_passes(github_schema):
+    query = """
+        query MyIssues($first: Int!) {
+          viewer {
+            login
+            issues(first: $first) {
+              edges {
+                node {
+                  ...IssueFields
+                  author { login }
+                  authorAssociation
+                }
+              }
+            }
+          }
+        }
+
+        fragment IssueFields on Issue {
+          title
+          createdAt
+        }
+    """
+
+    single_pass = QueryParser(github_schema).parse(query)
+    two_passes = QueryParser(github_schema, single_pass=False).parse(query)
+
+    assert asdict(single_pass) == asdict(two_passes)
+
+
+def test_parser_single_pass_reports_all_errors(swapi_schema):
+    query = """
+        query ShouldFail($unused: String) {
+          film(id: "1") {
+            title { nested }
+            nonExistingField
+          }
+        }
+    """
+
+    with pytest.raises(InvalidQueryError) as single_pass_err:
+        QueryParser(swapi_schema).parse(query)
+    with pytest.raises(InvalidQueryError) as two_passes_err:
+        QueryParser(swapi_schema, single_pass=False).parse(query)
+
+    assert str(single_pass_err.value) == str(two_passes_err.value)
+
+
+def test_parser_trusted_validation_rules(swapi_schema):
+    unused_variable_query = """
+        query GetFilm($unused: String) {
+          film(id: "1") { title }
+        }
+    """
+
+    with pytest.raises(InvalidQueryError):
+        QueryParser(swapi_schema).parse(unused_variable_query)
+
+    trusted_parser = QueryParser(swapi_schema, validation_rules=TRUSTED_VALIDATION_RULES)
+    assert trusted_parser.parse(unused_variable_query)
+
+    with pytest.raises(InvalidQueryError):
+        trusted_parser.parse('query ShouldFail { film(id: "1") { nonExistingField } }')
+
+
+def test_operation_documents():
+    query = """
+        # Films with their planets
+        query GetFilm($id: ID!, $first: Int = 2) {
+          film(id: $id) {
+            ...FilmFields
+            title, director
+          }
+        }
+
+        fragment PlanetFields on Planet { name }
+
+        fragment FilmFields on Film {
+          planets(first: $first) { edges { node { ...PlanetFields } } }
+        }
+
+        fragment Unused on Film { title }
+    """
+
+    assert operation_documents(query) == {
+        'GetFilm': 'query GetFilm($id:ID!$first:Int=2){film(id:$id){...FilmFields title director}}'
+                   'fragment FilmFields on Film{planets(first:$first){edges{node{...PlanetFields}}}}'
+                   'fragment PlanetFields on Planet{name}',
+    }
+
+    # Formatting and the order of definitions don't change the document
+    reformatted = 'fragment FilmFields on Film { planets(first: $first) { edges { node { ...PlanetFields } } } }\n' \
+                  'fragment PlanetFields on Planet { name }\n' \
+                  'query GetFilm($id: ID!, $first: Int = 2) { film(id: $id) { ...FilmFields title director } }'
+    assert operation_documents(reformatted) == operation_documents(query)
+
+
+def test_parser_multiple_operations(swapi_schema):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) { ...FilmFields }
+        }
+
+        query GetFilmWithDirector($id: ID!) {
+          film(id: $id) { ...FilmFields director }
+        }
+
+        fragment FilmFields on Film { title }
+    """
+
+    parsed = QueryParser(swapi_schema).parse(query)
+
+    operations = [obj for obj in parsed.objects if isinstance(obj, ParsedOperation)]
+    fragments = [obj for obj in parsed.objects if isinstance(obj, ParsedObject)]
+    assert [operation.name for operation in operations] == ['GetFilm', 'GetFilmWithDirector']
+    assert [fragment.name for fragment in fragments] == ['FilmFields']
+    assert operations[1].children[0].children[0] == ParsedObject(
+        name='Film',
+        fields=[ParsedField(name='director', type='str', nullable=False)],
+        parents=['FilmFields'],
+    )
+
+    with pytest.raises(AnonymousQueryError):
+        QueryParser(swapi_schema).parse(query + '{ film(id: "1") { title } }')
+
+
+def test_parser_shared_fragments(swapi_schema):
+    fragments = 'fragment FilmFields on Film { title }\n\nfragment PlanetFields on Planet { name }'
+    parser = QueryParser(swapi_schema)
+
+    shared = parser.parse_fragments(fragments)
+    assert [obj.name for obj in shared.objects] == ['FilmFields', 'PlanetFields']
+    assert parser.shared_fragments == {'FilmFields': 'fragment FilmFields on Film { title }',
+                                       'PlanetFields': 'fragment PlanetFields on Planet { name }'}
+
+    # Shared fragments are neither validated nor rendered again, other definitions are
+    parsed = parser.parse('query GetFilm { film(id: "1") { ...FilmFields } }\n\nfragment FilmFields on Film { title }')
+    assert [obj.name for obj in parsed.objects] == ['GetFilm']
+    assert parsed.objects[0].children[0].children[0].parents == ['FilmFields']
+
+    parsed = parser.parse('query GetFilm { film(id: "1") { ...FilmFields } }\n\nfragment FilmFields on Film { director }')
+    assert [obj.name for obj in parsed.objects] == ['GetFilm', 'FilmFields']
+
+    with pytest.raises(InvalidQueryError):
+        parser.parse('query GetFilm { film(id: "1") { ...FilmFields } }\n\nfragment FilmFields on Film { nonExistingField }')
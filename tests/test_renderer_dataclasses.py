@@ -1,9 +1,14 @@
+import os
+import sys
+import subprocess
+import json
 import pytest
 from datetime import datetime
 
 from graphql import GraphQLEnumType, GraphQLEnumValue, GraphQLField, GraphQLNonNull, GraphQLString, GraphQLInt, \
     GraphQLArgument, GraphQLSchema, GraphQLObjectType
 
+from gql.clients import Client
 from gql.config import Config
 from gql.query_parser import QueryParser
 from gql.renderer_dataclasses import DataclassesRenderer
@@ -14,8 +19,8 @@ def swapi_dataclass_renderer(swapi_schema):
     return DataclassesRenderer(swapi_schema, Config(schema='schemaurl', endpoint='schemaurl', documents=''))
 
 @pytest.fixture
-def github_dataclass_renderer(swapi_schema):
-    return DataclassesRenderer(swapi_schema, Config(schema='schemaurl', endpoint='schemaurl', documents=''))
+def github_dataclass_renderer(github_schema):
+    return DataclassesRenderer(github_schema, Config(schema='schemaurl', endpoint='schemaurl', documents=''))
 
 
 def test_simple_query(swapi_dataclass_renderer, swapi_parser, module_compiler):
@@ -65,8 +70,8 @@ def test_simple_query_with_variables(swapi_dataclass_renderer, swapi_parser, mod
 
     m = module_compiler(rendered)
 
-    call_mock = mocker.patch.object(m.Client, 'call')
-    call_mock.return_value = """
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = json.loads("""
        {
            "data": {
                "returnOfTheJedi": {
@@ -75,7 +80,7 @@ def test_simple_query_with_variables(swapi_dataclass_renderer, swapi_parser, mod
                }
            }
        }
-    """
+    """)
 
     result = m.GetFilm.execute('luke')
     assert result
@@ -410,8 +415,8 @@ def test_simple_query_with_datetime(swapi_dataclass_renderer, swapi_parser, modu
 
     now = datetime.now()
 
-    call_mock = mocker.patch.object(m.Client, 'call')
-    call_mock.return_value = """
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = json.loads("""
        {
            "data": {
                "returnOfTheJedi": {
@@ -421,7 +426,7 @@ def test_simple_query_with_datetime(swapi_dataclass_renderer, swapi_parser, modu
                }
            }
        }
-    """ % now.isoformat()
+    """ % now.isoformat())
 
     result = m.GetFilm.execute('luke')
     assert result
@@ -470,8 +475,8 @@ def test_non_nullable_list(module_compiler, mocker):
 
     now = datetime.now()
 
-    call_mock = mocker.patch.object(m.Client, 'call')
-    call_mock.return_value = """
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = json.loads("""
        {
            "data": {
                "people": [
@@ -484,7 +489,7 @@ def test_non_nullable_list(module_compiler, mocker):
                ]
            }
        }
-    """
+    """)
 
     result = m.GetPeople.execute()
     assert result
@@ -494,3 +499,350 @@ def test_non_nullable_list(module_compiler, mocker):
     assert len(data.people) == 2
     assert data.people[0].name == 'eran'
     assert data.people[1].name == 'eran1'
+
+
+def test_execute_controls_response_cache(swapi_dataclass_renderer, swapi_parser, module_compiler, mocker):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) {
+            title
+          }
+        }
+    """
+
+    m = module_compiler(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = {'data': {'film': {'title': 'A New Hope'}}}
+
+    m.GetFilm.execute('1')
+    assert call_mock.call_args[1]['cache'] is True
+
+    m.GetFilm.execute('1', cache=False, cache_ttl=5)
+    assert call_mock.call_args[1]['cache'] is False
+    assert call_mock.call_args[1]['cache_ttl'] == 5
+
+
+def test_decode_matches_from_json(github_parser, github_dataclass_renderer, swapi_parser, swapi_dataclass_renderer, module_compiler):
+    issues_query = """
+        query MyIssues {
+          viewer {
+            issues(first: 5) {
+              edges {
+                node {
+                  author { login }
+                  authorAssociation
+                }
+              }
+            }
+          }
+        }
+    """
+    issues_response = """
+        {
+            "data": {
+                "viewer": {
+                    "issues": {
+                        "edges": [
+                            {"node": {"author": {"login": "whatever"}, "authorAssociation": "FIRST_TIMER"}},
+                            {"node": {"author": null, "authorAssociation": "OWNER"}}
+                        ]
+                    }
+                }
+            }
+        }
+    """
+    film_query = """
+        query GetFilm {
+          film(id: "1") {
+            ...FilmFields
+            planets { edges { node { name } } }
+          }
+        }
+
+        fragment FilmFields on Film {
+          title
+          director
+          releaseDate
+        }
+    """
+    film_response = """
+        {
+            "data": {
+                "film": {
+                    "title": "A New Hope",
+                    "director": "George Lucas",
+                    "releaseDate": "1977-05-25T00:00:00",
+                    "planets": {"edges": [{"node": {"name": "Tatooine"}}, {"node": {"name": "Alderaan"}}]}
+                }
+            },
+            "errors": [{"message": "partial"}]
+        }
+    """
+
+    for parser, renderer, query, response, name in [
+        (github_parser, github_dataclass_renderer, issues_query, issues_response, 'MyIssues'),
+        (swapi_parser, swapi_dataclass_renderer, film_query, film_response, 'GetFilm'),
+    ]:
+        m = module_compiler(renderer.render(parser.parse(query)))
+        operation = getattr(m, name)
+        assert operation.decode(json.loads(response)) == operation.from_json(response)
+
+    film = m.GetFilm.decode(json.loads(film_response)).data.film
+    assert isinstance(film, m.FilmFields)
+    assert isinstance(film.planets.edges[0].node, m.GetFilm.GetFilmData.Film.PlanetConnection.PlanetEdge.Planet)
+    assert film.releaseDate == datetime(1977, 5, 25)
+
+
+def test_decode_is_generated(swapi_dataclass_renderer, swapi_parser, module_compiler):
+    from dataclasses_json import DataClassJsonMixin
+
+    # Later dataclasses_json releases add their own from_dict to decorated classes, the generated decoder is kept apart
+    query = 'query GetFilm { film(id: "1") { title } }'
+    m = module_compiler(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+
+    assert not hasattr(DataClassJsonMixin, 'decode')
+    for cls in (m.GetFilm, m.GetFilm.GetFilmData, m.GetFilm.GetFilmData.Film):
+        assert cls.decode.__func__.__qualname__ == f'{cls.__qualname__}.decode'
+
+
+def test_slotted_classes(swapi_schema, swapi_parser, module_compiler):
+    query = """
+        query GetFilm {
+          film(id: "1") {
+            ...FilmFields
+            planets { edges { node { name } } }
+          }
+        }
+
+        fragment FilmFields on Film {
+          title
+          director
+        }
+    """
+    response = '{"data": {"film": {"title": "A New Hope", "director": "George Lucas", "planets": {"edges": [{"node": {"name": "Tatooine"}}]}}}}'
+
+    renderer = DataclassesRenderer(swapi_schema, Config(schema='schemaurl', endpoint='schemaurl', documents='', slots=True))
+    m = module_compiler(renderer.render(swapi_parser.parse(query)))
+
+    result = m.GetFilm.decode(json.loads(response))
+    assert result == m.GetFilm.from_json(response)
+
+    film = result.data.film
+    assert film.title == 'A New Hope'
+    assert film.planets.edges[0].node.name == 'Tatooine'
+    assert isinstance(film, m.FilmFields)
+    for obj in (result, result.data, film, film.planets.edges[0].node):
+        assert not hasattr(obj, '__dict__')
+
+    # Fragment classes are only bases, the classes inheriting from them hold the slots
+    assert m.FilmFields.__slots__ == ()
+    assert m.GetFilm.GetFilmData.Film.__slots__ == ('title', 'director', 'planets')
+    assert m.GetFilm.GetFilmData.Film.__qualname__ == 'GetFilm.GetFilmData.Film'
+    assert json.loads(result.to_json())['data']['film']['title'] == 'A New Hope'
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_slotted_classes_with_several_fragments(swapi_schema, swapi_parser, module_compiler, lazy):
+    query = """
+        query GetFilm {
+          film(id: "1") {
+            ...FilmTitle
+            ...FilmPeople
+          }
+        }
+
+        fragment FilmTitle on Film {
+          title
+        }
+
+        fragment FilmPeople on Film {
+          director
+          episodeId
+        }
+    """
+    response = {'data': {'film': {'title': 'A New Hope', 'director': 'George Lucas', 'episodeId': 4}}}
+
+    config = Config(schema='schemaurl', endpoint='schemaurl', documents='', slots=True, lazy=lazy)
+    m = module_compiler(DataclassesRenderer(swapi_schema, config).render(swapi_parser.parse(query)))
+
+    film = m.GetFilm.decode(response).data.film
+    assert (film.title, film.director, film.episodeId) == ('A New Hope', 'George Lucas', 4)
+    assert isinstance(film, m.FilmTitle)
+    assert isinstance(film, m.FilmPeople)
+    assert not hasattr(film, '__dict__')
+
+
+@pytest.mark.parametrize('slots', [False, True])
+def test_lazy_decoding(swapi_schema, swapi_parser, module_compiler, slots):
+    query = """
+        query GetFilm {
+          film(id: "1") {
+            ...FilmFields
+            planets { edges { node { name } } }
+          }
+        }
+
+        fragment FilmFields on Film {
+          title
+          releaseDate
+          producers
+        }
+    """
+    response = json.loads("""
+        {
+            "data": {
+                "film": {
+                    "title": "A New Hope",
+                    "releaseDate": "1977-05-25T00:00:00",
+                    "producers": ["Gary Kurtz", "Rick McCallum"],
+                    "planets": {"edges": [{"node": {"name": "Tatooine"}}, null]}
+                }
+            }
+        }
+    """)
+
+    config = Config(schema='schemaurl', endpoint='schemaurl', documents='')
+    eager = module_compiler(DataclassesRenderer(swapi_schema, config).render(swapi_parser.parse(query)))
+    config = Config(schema='schemaurl', endpoint='schemaurl', documents='', lazy=True, slots=slots)
+    lazy = module_compiler(DataclassesRenderer(swapi_schema, config).render(swapi_parser.parse(query)))
+
+    # The lazy decoder isn't replaced by the one dataclasses_json adds
+    assert lazy.GetFilm.GetFilmData.Film.decode.__func__.__qualname__ == 'GetFilm.GetFilmData.Film.decode'
+
+    data = lazy.GetFilm.decode(response).data
+    film = data.film
+    # Scalars are decoded right away, nested objects on first access and then cached
+    assert film.title == 'A New Hope'
+    assert film.releaseDate == datetime(1977, 5, 25)
+    if not slots:
+        assert 'planets' not in vars(film)
+    assert film.planets is film.planets
+    assert film.planets.edges[0].node.name == 'Tatooine'
+    assert film.planets.edges[1] is None
+    if not slots:
+        assert 'planets' in vars(film)
+
+    with pytest.raises(AttributeError):
+        film.unknown  # pylint:disable=pointless-statement
+
+    assert json.loads(lazy.GetFilm.decode(response).to_json()) == json.loads(eager.GetFilm.decode(response).to_json())
+
+    # Instances built directly are complete and never reach __getattr__
+    built = lazy.GetFilm.GetFilmData(film=None)
+    assert built.film is None
+
+
+def test_execute_stream(swapi_dataclass_renderer, swapi_parser, module_compiler, mocker):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) {
+            title
+            producers
+            planets { edges { node { name } } }
+          }
+        }
+    """
+
+    m = module_compiler(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+
+    stream_mock = mocker.patch.object(Client, 'stream')
+    stream_mock.return_value = iter([{'node': {'name': 'Tatooine'}}, None])
+
+    edges = list(m.GetFilm.execute_stream('film.planets.edges', '1'))
+    assert edges[0].node.name == 'Tatooine'
+    assert edges[1] is None
+    args, kwargs = stream_mock.call_args
+    assert args == (m.GetFilm.__QUERY__, ['data', 'film', 'planets', 'edges'])
+    assert kwargs['variables'] == {'id': '1'}
+
+    stream_mock.return_value = iter(['Gary Kurtz'])
+    assert list(m.GetFilm.execute_stream('film.producers', '1')) == ['Gary Kurtz']
+
+    with pytest.raises(ValueError):
+        list(m.GetFilm.execute_stream('film.title', '1'))
+
+
+def test_execute_passes_selection_plan(swapi_dataclass_renderer, swapi_parser, module_compiler, mocker):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) {
+            id
+            title
+          }
+        }
+    """
+
+    m = module_compiler(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+    assert m.GetFilm.__SELECTION__ == ('Query', None, (
+        ('film', 'film', {'id': ('$', 'id')}, ('Film', 'id', (('id', 'id', None, None), ('title', 'title', None, None)))),
+    ))
+
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = {'data': {'film': {'id': '1', 'title': 'A New Hope'}}}
+    m.GetFilm.execute('1')
+    assert call_mock.call_args[1]['selection'] is m.GetFilm.__SELECTION__
+
+
+def test_multiple_operations(swapi_dataclass_renderer, swapi_parser, module_compiler, mocker):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) { ...FilmFields }
+        }
+
+        query GetDirector {
+          film(id: "1") { ...FilmFields director }
+        }
+
+        fragment FilmFields on Film { title }
+    """
+
+    rendered = swapi_dataclass_renderer.render(swapi_parser.parse(query))
+    assert rendered.count('class FilmFields') == 1
+
+    m = module_compiler(rendered)
+    assert m.GetFilm.__QUERY__ == 'query GetFilm($id:ID!){film(id:$id){...FilmFields}}fragment FilmFields on Film{title}'
+    assert m.GetDirector.__QUERY__ == 'query GetDirector{film(id:"1"){...FilmFields director}}fragment FilmFields on Film{title}'
+
+    call_mock = mocker.patch.object(Client, 'call')
+    call_mock.return_value = {'data': {'film': {'title': 'A New Hope', 'director': 'George Lucas'}}}
+    film = m.GetDirector.execute().data.film
+    assert isinstance(film, m.FilmFields)
+    assert (film.title, film.director) == ('A New Hope', 'George Lucas')
+    assert m.GetFilm.execute('1').data.film.title == 'A New Hope'
+
+
+def test_heavy_imports_are_deferred(swapi_dataclass_renderer, swapi_parser, tmpdir):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) { title releaseDate }
+        }
+    """
+    tmpdir.join('get_film.py').write(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+
+    script = (
+        'import sys; import get_film; '
+        'get_film.GetFilm.decode({"data": {"film": {"title": "A New Hope", "releaseDate": "1977-05-25T00:00:00"}}}); '
+        'print(",".join(name for name in ("dataclasses_json", "marshmallow", "requests", "aiohttp") if name in sys.modules))'
+    )
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([str(tmpdir), os.path.dirname(os.path.dirname(__file__))])}
+    output = subprocess.run([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE, check=True).stdout
+    assert output.decode().strip() == ''
+
+
+def test_deferred_dataclasses_json_methods(swapi_dataclass_renderer, swapi_parser, module_compiler):
+    from dataclasses_json import DataClassJsonMixin
+
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) { title releaseDate }
+        }
+    """
+    m = module_compiler(swapi_dataclass_renderer.render(swapi_parser.parse(query)))
+    response = '{"data": {"film": {"title": "A New Hope", "releaseDate": "1977-05-25T00:00:00"}}, "errors": null}'
+
+    result = m.GetFilm.from_json(response)
+    assert result == m.GetFilm.decode(json.loads(response))
+    assert json.loads(result.data.film.to_json()) == {'title': 'A New Hope', 'releaseDate': '1977-05-25T00:00:00'}
+    assert m.GetFilm.GetFilmData.Film.schema().dump(result.data.film)['releaseDate'].startswith('1977-05-25T00:00:00')
+    assert isinstance(result, DataClassJsonMixin)
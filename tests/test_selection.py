@@ -0,0 +1,55 @@
+from graphql import parse, get_operation_ast
+
+from gql.selection import selection_plan
+
+
+def plan(schema, query):
+    document_ast = parse(query)
+    return selection_plan(schema, document_ast, get_operation_ast(document_ast))
+
+
+def test_selection_plan(swapi_schema):
+    query = """
+        query GetFilm($id: ID!) {
+          film(id: $id) {
+            id
+            ...FilmFields
+            planets(first: 2) { totalCount }
+          }
+          newHope: film(filmID: 1) { title }
+        }
+
+        fragment FilmFields on Film {
+          title
+          planets(first: 2) { edges { node { id } } }
+        }
+    """
+
+    assert plan(swapi_schema, query) == ('Query', None, (
+        ('film', 'film', {'id': ('$', 'id')}, ('Film', 'id', (
+            ('id', 'id', None, None),
+            ('title', 'title', None, None),
+            # Selections of the same field are merged
+            ('planets', 'planets', {'first': 2}, ('PlanetConnection', None, (
+                ('edges', 'edges', None, ('PlanetEdge', None, (
+                    ('node', 'node', None, ('Planet', 'id', (('id', 'id', None, None),))),
+                ))),
+                ('totalCount', 'totalCount', None, None),
+            ))),
+        ))),
+        ('newHope', 'film', {'filmID': 1}, ('Film', None, (('title', 'title', None, None),))),
+    ))
+
+
+def test_selection_plan_unsupported(swapi_schema):
+    assert plan(swapi_schema, 'query A($all: Boolean!) { film(id: "1") { title @include(if: $all) } }') is None
+    assert plan(swapi_schema, 'query A { node(id: "1") { ... on Film { title } } }') is None
+
+
+def test_selection_plan_abstract_entities(swapi_schema):
+    # Node entities are keyed by their concrete type, given by __typename
+    assert plan(swapi_schema, 'query A { node(id: "1") { __typename id } }') == ('Query', None, (
+        ('node', 'node', {'id': '1'}, ('Node', 'id', (('__typename', '__typename', None, None), ('id', 'id', None, None)))),
+    ))
+    assert plan(swapi_schema, 'query A { node(id: "1") { id } }') is None
+    assert plan(swapi_schema, 'query A { node(id: "1") { kind: __typename id } }') is None
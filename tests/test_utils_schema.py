@@ -0,0 +1,127 @@
+import os
+import json
+from glob import glob
+
+from graphql import build_client_schema
+
+from gql.query_parser import QueryParser
+from gql.utils_schema import load_schema, clear_schema_cache, diff_schemas, document_coordinates, SCHEMA_CACHE_PATTERN
+
+SWAPI_SCHEMA_FILENAME = os.path.join(os.path.dirname(__file__), 'fixtures/swapi-schema.graphql')
+
+
+def test_load_schema_writes_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+
+    assert len(glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN))) == 1
+
+
+def test_load_schema_from_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    built = load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    cached = load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+
+    assert cached is not built
+    assert set(cached.type_map) == set(built.type_map)
+    assert set(cached.type_map['Film'].fields) == set(built.type_map['Film'].fields)
+
+    parsed = QueryParser(cached).parse("""
+        query GetFilm($id: ID!) {
+          film(id: $id) {
+            title
+            releaseDate
+            characters { edges { node { name } } }
+          }
+        }
+    """)
+    assert parsed.objects[0].name == 'GetFilm'
+
+
+def test_load_schema_ignores_corrupt_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    for filename in glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN)):
+        with open(filename, 'wb') as outfile:
+            outfile.write(b'garbage')
+
+    schema = load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    assert 'Film' in schema.type_map
+
+
+def test_load_schema_ignores_unsupported_pickle_protocol(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    for filename in glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN)):
+        with open(filename, 'wb') as outfile:
+            outfile.write(b'\x80\x63garbage')
+
+    schema = load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    assert 'Film' in schema.type_map
+
+
+def test_load_schema_survives_failed_cache_write(tmpdir):
+    # A file where the cache directory should be
+    cache_dir = str(tmpdir.join('cache'))
+    tmpdir.join('cache').write('')
+
+    schema = load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+    assert 'Film' in schema.type_map
+
+
+def test_load_schema_removes_stale_cache_entries(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    cache_dir.join('schema-stale.pickle').write('')
+    cache_dir.join('other.pickle').write('')
+
+    load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=str(cache_dir))
+    filenames = glob(os.path.join(str(cache_dir), SCHEMA_CACHE_PATTERN))
+    assert len(filenames) == 1
+    assert os.path.basename(filenames[0]) != 'schema-stale.pickle'
+    assert cache_dir.join('other.pickle').exists()
+
+
+def test_clear_schema_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    load_schema(SWAPI_SCHEMA_FILENAME, cache_dir=cache_dir)
+
+    assert clear_schema_cache(cache_dir) == 1
+    assert not glob(os.path.join(cache_dir, SCHEMA_CACHE_PATTERN))
+
+
+def load_swapi_introspection():
+    with open(SWAPI_SCHEMA_FILENAME, 'r') as fin:
+        return json.load(fin)
+
+
+def remove_field(introspection, type_name, field_name):
+    for graphql_type in introspection['__schema']['types']:
+        if graphql_type['name'] == type_name:
+            graphql_type['fields'] = [field for field in graphql_type['fields'] if field['name'] != field_name]
+
+    return introspection
+
+
+def test_diff_schemas(swapi_schema):
+    changed_schema = build_client_schema(remove_field(load_swapi_introspection(), 'Film', 'director'))
+
+    assert diff_schemas(swapi_schema, swapi_schema) == set()
+    assert diff_schemas(swapi_schema, changed_schema) == {'Film.director'}
+
+
+def test_document_coordinates(swapi_schema):
+    coordinates = document_coordinates(swapi_schema, """
+        query GetFilm($id: ID) {
+          film(id: $id) {
+            title
+            planets(first: 2) { edges { node { ...PlanetFields } } }
+          }
+        }
+
+        fragment PlanetFields on Planet { name }
+    """)
+
+    assert coordinates == {
+        'schema.query', 'Query.film', 'ID', 'Film', 'Film.title', 'String', 'Film.planets', 'Int', 'PlanetConnection',
+        'PlanetConnection.edges', 'PlanetEdge', 'PlanetEdge.node', 'Planet', 'Planet.name',
+    }
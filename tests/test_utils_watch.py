@@ -0,0 +1,80 @@
+import os
+import threading
+import pytest
+
+from gql.utils_watch import GlobMatcher, Debouncer, split_glob
+
+
+@pytest.mark.parametrize('pattern, root, rest', [
+    ('./src/**/*.graphql', './src', '**/*.graphql'),
+    ('src/queries/*.graphql', 'src/queries', '*.graphql'),
+    ('*.graphql', '.', '*.graphql'),
+    ('/abs/src/q[0-9].graphql', '/abs/src', 'q[0-9].graphql'),
+    ('src/query.graphql', 'src', 'query.graphql'),
+])
+def test_split_glob(pattern, root, rest):
+    assert split_glob(pattern) == (root, rest)
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('src/query.graphql', True),
+    ('src/a/b/c/query.graphql', True),
+    ('src/a/query.py', False),
+    ('other/query.graphql', False),
+    ('query.graphql', False),
+    ('src/.query.graphql', False),
+    ('src/.hidden/query.graphql', False),
+])
+def test_glob_matcher_recursive(path, expected):
+    matcher = GlobMatcher('./src/**/*.graphql')
+
+    assert matcher.recursive
+    assert matcher.root == os.path.abspath('src')
+    assert matcher.matches(path) is expected
+    assert matcher.matches(os.path.abspath(path)) is expected
+
+
+def test_glob_matcher_flat():
+    matcher = GlobMatcher('queries/q?_[a-c].graphql')
+
+    assert not matcher.recursive
+    assert matcher.matches('queries/q1_a.graphql')
+    assert not matcher.matches('queries/q1_d.graphql')
+    assert not matcher.matches('queries/q12_a.graphql')
+    assert not matcher.matches('queries/sub/q1_a.graphql')
+
+
+def test_debouncer_coalesces_bursts():
+    calls = []
+    done = threading.Event()
+
+    def callback(key):
+        calls.append(key)
+        if len(calls) == 2:
+            done.set()
+
+    debouncer = Debouncer(0.05, callback)
+    for _ in range(5):
+        debouncer.trigger('a.graphql')
+    debouncer.trigger('b.graphql')
+
+    assert done.wait(timeout=5)
+    assert sorted(calls) == ['a.graphql', 'b.graphql']
+
+
+def test_debouncer_cancel():
+    calls = []
+    done = threading.Event()
+
+    def callback(key):
+        calls.append(key)
+        done.set()
+
+    debouncer = Debouncer(0.05, callback)
+    debouncer.trigger('a.graphql')
+    debouncer.cancel()
+
+    # Triggered later, so it fires after `a` would have
+    debouncer.trigger('b.graphql')
+    assert done.wait(timeout=5)
+    assert calls == ['b.graphql']